@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from config import AI_CACHE_DIR, AI_CACHE_MAX_MB
+
+
+class AIResponseCache:
+    """
+    AI 出题结果的磁盘缓存：
+    key = sha256(提示词版本, 模型名, 源文件内容哈希)，value 为解析后的题目元数据 JSON
+    - 同一份代码 (无论来自哪个仓库) 再次导入时直接复用，不再调用大模型
+    - 修改出题提示词时递增 ai_service.PROMPT_VERSION，旧缓存自然失效
+    - 总大小超过 max_bytes 时按最近使用时间 (文件 mtime) 淘汰最旧的条目
+    每个条目一个文件，写入用临时文件 + rename，进程中途退出也不会留下半个 JSON。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # 首次使用时扫描目录得到
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(code, prompt_version, model):
+        content_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{prompt_version}\0{model}\0{content_hash}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # 刷新 mtime，作为 LRU 的依据
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ [AICache] 写入失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self.stores += 1
+            self._size = self._current_size() + len(data) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _current_size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def _entries(self):
+        """(路径, 大小, mtime) 列表"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".json"):
+                    st = entry.stat()
+                    entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        """淘汰最久未使用的条目，直到总大小降到上限的 90% (留出余量，避免每次写入都触发全目录扫描)"""
+        entries = self._entries()
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+ai_cache = AIResponseCache(AI_CACHE_DIR, AI_CACHE_MAX_MB * 1024 * 1024)
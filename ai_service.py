@@ -1,18 +1,59 @@
 import json
-from openai import OpenAI
-from config import AI_API_KEY, AI_BASE_URL, AI_MODEL_NAME
+import time
+from openai import OpenAI, AsyncOpenAI, Timeout, APIConnectionError, APIStatusError, RateLimitError
+from config import AI_API_KEY, AI_BASE_URL, AI_MODEL_NAME, AI_CONNECT_TIMEOUT, AI_READ_TIMEOUT, AI_MAX_RETRIES
+import metrics
+from rate_limiter import ai_rate_limiter
+
+# 出题提示词 (generate_problem_metadata) 的版本号：修改提示词后 +1，让磁盘上的 AI 出题缓存失效
+PROMPT_VERSION = 1
+
+def is_retryable_error(e):
+    """429 / 5xx / 网络错误 / 超时可以重试；参数错误、鉴权失败、返回内容不是 JSON 等重试也没用"""
+    if isinstance(e, (APIConnectionError, RateLimitError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+def retry_after_seconds(e):
+    """服务端在 Retry-After 响应头里要求的等待秒数 (没有时返回 None)"""
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+AI_REQUEST_SECONDS = metrics.Histogram(
+    "pylearn_ai_request_seconds", "AI 接口调用耗时 (流式对话按整个流计)", ["call", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+AI_TOKENS = metrics.Counter("pylearn_ai_tokens", "AI 接口消耗的 token 数 (接口返回 usage 时才统计)", ["call", "kind"])
+
+
+def _record(call, started, outcome, usage=None):
+    AI_REQUEST_SECONDS.labels(call, outcome).observe(time.perf_counter() - started)
+    if usage is not None:
+        AI_TOKENS.labels(call, "prompt").inc(getattr(usage, "prompt_tokens", None) or 0)
+        AI_TOKENS.labels(call, "completion").inc(getattr(usage, "completion_tokens", None) or 0)
 
 class AIService:
     def __init__(self):
+        timeout = Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT)
+        options = {"api_key": AI_API_KEY, "timeout": timeout, "max_retries": AI_MAX_RETRIES}
         if AI_BASE_URL:
-            self.client = OpenAI(api_key=AI_API_KEY, base_url=AI_BASE_URL)
-        else:
-            self.client = OpenAI(api_key=AI_API_KEY)
+            options["base_url"] = AI_BASE_URL
+        # 同步客户端：给后台线程里的 ETL / 知识点整理用
+        self.client = OpenAI(**options)
+        # 异步客户端：给 /chat 等请求处理用，不阻塞事件循环。
+        # 全进程共享一个实例 = 共享一个 HTTP 连接池，多轮对话复用 keep-alive 连接，省掉每次的 TLS 握手
+        self.async_client = AsyncOpenAI(**options)
         self.model = AI_MODEL_NAME
 
-    def generate_problem_metadata(self, code_content):
+    def request_problem_metadata(self, code_content):
         """
         ETL: 强制 AI 生成包含 Markdown 代码块示例的描述
+        出错直接抛出异常 (由导入流水线决定是否重试)，SDK 自带的重试关闭，避免和外层退避叠加。
+        返回: (题目元数据字典, 本次消耗的 token 数；接口没返回用量时为 None)
         """
         prompt = f"""
         你是一个严谨的Python算法题出题专家。请分析下面的代码，将其转化为一道标准的编程练习题。
@@ -45,8 +86,9 @@ class AIService:
         6. knowledge: (字符串) 知识点，逗号分隔。
         """
         
+        started = time.perf_counter()
         try:
-            resp = self.client.chat.completions.create(
+            resp = self.client.with_options(max_retries=0).chat.completions.create(
                 model=self.model,
                 messages=[
                     {"role": "system", "content": "你是一个严格输出JSON的数据处理助手。"},
@@ -55,37 +97,101 @@ class AIService:
                 temperature=0.2,
                 response_format={"type": "json_object"}
             )
-            content = resp.choices[0].message.content
-            content = content.replace("```json", "").replace("```", "").strip()
-            return json.loads(content)
+        except Exception:
+            _record("problem_metadata", started, "error")
+            raise
+        _record("problem_metadata", started, "ok", resp.usage)
+        content = resp.choices[0].message.content
+        content = content.replace("```json", "").replace("```", "").strip()
+        return json.loads(content), (resp.usage.total_tokens if resp.usage else None)
+
+    def generate_problem_metadata(self, code_content):
+        try:
+            return self.request_problem_metadata(code_content)[0]
         except Exception as e:
             print(f"ETL Error: {e}")
             return None
 
-    def chat(self, user_msg, context):
+    def _chat_messages(self, user_msg, context):
+        return [
+            {"role": "system", "content": "你是Python助教。请根据上下文回答问题。"},
+            {"role": "user", "content": f"上下文:{context}\n问题:{user_msg}"}
+        ]
+
+    async def chat(self, user_msg, context):
+        started = time.perf_counter()
         try:
-            resp = self.client.chat.completions.create(
+            resp = await self.async_client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是Python助教。请根据上下文回答问题。"},
-                    {"role": "user", "content": f"上下文:{context}\n问题:{user_msg}"}
-                ]
+                messages=self._chat_messages(user_msg, context)
             )
+            _record("chat", started, "ok", resp.usage)
             return resp.choices[0].message.content
         except Exception as e:
+            _record("chat", started, "error")
             return f"连接失败: {e}"
 
+    async def chat_stream(self, user_msg, context):
+        """
+        流式对话：逐段 yield 模型输出的文本增量，首个 chunk 到达即可推给浏览器。
+        调用方提前关闭生成器 (浏览器断开) 时，finally 中会关闭上游 HTTP 响应，模型侧随之停止生成。
+        """
+        messages = self._chat_messages(user_msg, context)
+        # 与导入任务共用账号级的 RPM / TPM 配额：提示词按 3 字符 1 token 估算，再预留约 1000 的回答
+        estimated = sum(len(m["content"]) for m in messages) // 3 + 1000
+        await ai_rate_limiter.acquire_async(estimated)
+        started = time.perf_counter()
+        try:
+            stream = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},  # 流的最后一个 chunk 带上本次的 token 用量
+            )
+        except Exception:
+            ai_rate_limiter.settle(estimated, 0)
+            _record("chat_stream", started, "error")
+            raise
+        outcome, usage = "error", None
+        try:
+            async for chunk in stream:
+                # usage 只出现在最后一个 (choices 为空的) chunk 里
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+            outcome = "ok"
+        except GeneratorExit:
+            outcome = "cancelled"  # 浏览器中途断开
+            raise
+        finally:
+            # 按实际用量多退少补；中途断开拿不到 usage 时按估算值计
+            ai_rate_limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            _record("chat_stream", started, outcome, usage)
+            await stream.close()
+
+    async def close(self):
+        await self.async_client.close()
+
     def cluster_problems(self, problems_summary):
         prompt = f"""
         对以下题目进行知识点归类，统一相同的标签。
         题目列表: {json.dumps(problems_summary, ensure_ascii=False)}
         请返回 JSON 格式: {{"题目ID": "统一后的标签名", ...}}
         """
+        started = time.perf_counter()
         try:
             resp = self.client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}]
             )
+        except Exception as e:
+            _record("cluster_problems", started, "error")
+            return {}
+        _record("cluster_problems", started, "ok", resp.usage)
+        try:
             content = resp.choices[0].message.content.replace("```json", "").replace("```", "").strip()
             return json.loads(content)
         except Exception as e:
@@ -0,0 +1,138 @@
+"""
+数据库访问层微基准：对比 "每次查询新建连接" 与 "线程内长连接 + WAL" 的单次查询开销，
+再对比逐题提交与 bulk_upsert_problems 导入 1000 道题目的耗时，
+最后灌入 10 万道合成题目，测量分页列表 / 全文搜索的耗时。
+
+用法 (在临时数据库副本上运行，不会修改 pylearn.db):
+    python bench_db.py [次数] [题目数]
+
+热点查询的执行计划由 tests/test_query_plans.py 检查 (python -m pytest -q)。
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import config
+
+
+def _bench(label, fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    cost = (time.perf_counter() - start) / n * 1e6
+    print(f"  {label:<28} {cost:9.1f} µs/次")
+    return cost
+
+
+def bench_listing(db, rows):
+    words = ["循环", "列表推导", "字符串", "递归", "字典", "排序", "文件", "异常", "类与对象", "生成器"]
+    with db.transaction() as conn:
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM problems").fetchone()[0]
+        data = [(first_id + i, f"合成题目 {i} {words[i % 10]}", f"第 {i} 题：练习{words[i % 7]}与{words[i % 3]}", i % 5 + 1,
+                 f"{words[i % 10]},{words[(i // 10) % 10]}", f"def solve_{i}():\n    return {i}\n", "bench-synthetic", f"p{i}.py") for i in range(rows)]
+        conn.executemany("INSERT INTO problems (id, title, description, difficulty, knowledge_tag, sample_code, source_repo, file_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", data)
+        conn.executemany("INSERT OR IGNORE INTO problem_tags (tag, difficulty, problem_id) VALUES (?, ?, ?)",
+                         [(tag, d[3], d[0]) for d in data for tag in d[4].split(",")])
+    conn.execute("ANALYZE")
+
+    print(f"分页列表 / 搜索 ({rows} 道合成题目):")
+    deep = {}
+    for label, kwargs in [("列表", {}), ("按知识点", {"tag": "递归"}), ("按来源", {"source": "bench-synthetic"}), ("全文搜索", {"query": "列表推导"})]:
+        _, after = db.list_problems(50, **kwargs)
+        for _ in range(100):  # 翻到较深的位置，验证 keyset 分页不随页码变慢
+            _, after = db.list_problems(50, after, **kwargs) if after else (None, None)
+        deep[label] = after
+        _bench(f"{label} 第 1 页", lambda _: db.list_problems(50, **kwargs), 100)
+        _bench(f"{label} 第 101 页", lambda _: db.list_problems(50, deep[label], **kwargs), 100)
+    _bench("全文搜索 (罕见词)", lambda _: db.list_problems(50, query="solve_4242"), 100)
+    _bench("搜索 + 难度过滤", lambda _: db.list_problems(50, difficulty=3, query="列表推导"), 100)
+    _bench("短词 LIKE 回退", lambda _: db.list_problems(50, query="递归"), 20)
+
+
+def bench_bulk_import(db, n=1000):
+    def item(i, tag):
+        return ({"title": f"导入题目 {i}", "description": f"{tag} 描述 {i}", "difficulty": i % 5 + 1, "code": f"print({i})",
+                 "input": "", "output": str(i), "knowledge": "导入,批量", "source_repo": f"bench-import-{tag}", "file_path": f"f{i}.py"},
+                [{"input": str(k), "output": str(i + k)} for k in range(3)])
+
+    def legacy(tag):
+        """旧的导入方式：每道题一个事务，每个测试点再各自提交一次"""
+        for i in range(n):
+            data, cases = item(i, tag)
+            pid = db.add_problem_from_crawler(data)
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM test_cases WHERE problem_id=?", (pid,))
+            for case in cases:
+                with db.transaction() as conn:
+                    conn.execute("INSERT INTO test_cases (problem_id, input_data, output_data, is_sample) VALUES (?, ?, ?, 0)", (pid, case["input"], case["output"]))
+
+    print(f"批量导入 ({n} 道题目，每题 3 个测试点):")
+    before = _bench("逐题逐测试点提交", lambda _: legacy("legacy"), 1) / 1e6
+    after = _bench(f"bulk_upsert (每批 {config.CRAWLER_WRITE_BATCH_SIZE})",
+                   lambda _: [db.bulk_upsert_problems([item(i, "bulk") for i in range(k, min(k + config.CRAWLER_WRITE_BATCH_SIZE, n))])
+                              for k in range(0, n, config.CRAWLER_WRITE_BATCH_SIZE)], 1) / 1e6
+    print(f"  => 提速 {before / after:.1f}x")
+    _bench("bulk_upsert 重新导入 (整批)", lambda _: db.bulk_upsert_problems([item(i, "bulk") for i in range(n)]), 1)
+
+    # 重新导入是更新而不是新增：题目数不变，revision 递增，测试点被替换而不是追加
+    conn = db.get_conn()
+    count, revision = conn.execute("SELECT COUNT(*), MIN(revision) FROM problems WHERE source_repo='bench-import-bulk'").fetchone()
+    cases = conn.execute("SELECT COUNT(*) FROM test_cases t JOIN problems p ON p.id = t.problem_id WHERE p.source_repo='bench-import-bulk'").fetchone()[0]
+    assert (count, revision, cases) == (n, 1, n * 3), (count, revision, cases)
+    pids = db.bulk_upsert_problems([item(i, "bulk") for i in (5, 3)])
+    assert pids == [conn.execute("SELECT id FROM problems WHERE source_repo='bench-import-bulk' AND file_path=?", (f"f{i}.py",)).fetchone()[0] for i in (5, 3)]
+
+
+def main(n=2000, rows=100_000):
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    if os.path.exists(config.DB_NAME):
+        shutil.copy(config.DB_NAME, db_path)
+    config.DB_NAME = db_path
+
+    from database import Database  # 必须在修改 DB_NAME 之后导入
+    db = Database()
+    pid = db.add_problem_from_crawler({
+        "title": "bench", "description": "bench", "difficulty": 1, "code": "print(1)",
+        "input": "", "output": "1", "knowledge": "bench", "source_repo": "bench", "file_path": "bench.py",
+    })
+
+    read_sql = "SELECT id, title, description, difficulty, knowledge_tag, sample_code, time_limit FROM problems WHERE id=?"
+
+    def legacy_read(_):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute(read_sql, (pid,)).fetchone()
+        conn.close()
+
+    def legacy_write(_):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("INSERT INTO submissions (problem_id, code, user_output, error_msg, is_correct, ai_analysis, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (pid, "print(1)", "1", "", True, "", time.time()))
+        conn.commit()
+        conn.close()
+
+    print(f"数据库: {db_path}  (journal_mode={db.get_conn().execute('PRAGMA journal_mode').fetchone()[0]})")
+    # 两边执行同一条 SELECT；get_problem_detail 会命中题库缓存，比较不出连接本身的差别
+    print("读取 (同一条 SELECT，不经过题库缓存):")
+    before = _bench("每次新建连接", legacy_read, n)
+    after = _bench("线程内长连接", lambda _: db.get_conn().execute(read_sql, (pid,)).fetchone(), n)
+    print(f"  => 提速 {before / after:.1f}x")
+    _bench("(参考) get_problem_detail 缓存命中", lambda _: db.get_problem_detail(pid), n)
+
+    print("写入 save_submission:")
+    before = _bench("每次新建连接", legacy_write, n // 4)
+    after = _bench("线程内长连接", lambda _: db.save_submission(pid, "print(1)", "1", "", True, ""), n // 4)
+    print(f"  => 提速 {before / after:.1f}x")
+
+    bench_bulk_import(db)
+    bench_listing(db, rows)
+
+    db.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 100_000)
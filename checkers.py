@@ -0,0 +1,219 @@
+"""
+输出检查器 (checker)：把学员程序的 stdout 与期望输出对比。
+检查器以流的方式消费 stdout (沙箱每读到一块数据就调用一次 feed)，
+一旦确定答案错误就返回 False，沙箱随即 kill 掉子进程，不必等程序跑完、也不必把全部输出留在内存里。
+
+- exact:     去掉首尾空白后逐字符比较 (默认，与原来的整串比较一致)
+- token:     按空白切分后逐个比较，忽略空格 / 换行的数量和位置
+- float:     同 token，两边都是数字时允许 eps 以内的绝对或相对误差
+- unordered: 按行比较但不要求顺序 (忽略每行首尾空白和空行)
+"""
+import codecs
+import math
+from collections import Counter
+
+DEFAULT_CHECKER = "exact"
+DEFAULT_EPS = 1e-6
+
+
+def normalize_output(text: str) -> str:
+    """
+    标准化输出结果，用于对比答案：
+    1. 统一换行符 (\r\n -> \n)
+    2. 去除首尾空白
+    3. (可选) 清理可能存在的 markdown 代码块标记，防止 AI 生成的数据带格式导致判错
+    """
+    if not text:
+        return ""
+
+    # 基础清洗
+    text = text.strip().replace("\r\n", "\n")
+
+    # 容错处理：如果数据库中的 expected_output 包含了 markdown 标记 (```text ... ```)
+    # 我们尝试剥离它
+    if text.startswith("```"):
+        lines = text.splitlines()
+        # 如果是多行且首尾都是 ```，则取中间内容
+        if len(lines) >= 2 and "```" in lines[-1]:
+            text = "\n".join(lines[1:-1])
+
+    return text.strip()
+
+
+class Checker:
+    """
+    检查器基类：负责增量 UTF-8 解码和 \r\n 归一化，子类只处理文本。
+    用法: 运行中对每块 stdout 调用 feed(bytes)，返回 False 表示已确定错误；程序正常结束后调用 finish() 得到最终结果。
+    """
+
+    def __init__(self, expected, eps=DEFAULT_EPS):
+        self.eps = eps
+        self.failed = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._cr = False  # 上一块以 \r 结尾，等下一块决定是不是 \r\n
+
+    def _text(self, text):
+        if self._cr:
+            text = "\r" + text
+        self._cr = text.endswith("\r")
+        if self._cr:
+            text = text[:-1]
+        return text.replace("\r\n", "\n")
+
+    def feed(self, data: bytes) -> bool:
+        if not self.failed:
+            text = self._text(self._decoder.decode(data))
+            if text and not self._feed(text):
+                self.failed = True
+        return not self.failed
+
+    def finish(self) -> bool:
+        if self.failed:
+            return False
+        text = self._decoder.decode(b"", final=True)
+        text = ("\r" if self._cr else "") + text
+        self._cr = False
+        if text and not self._feed(text):
+            return False
+        return self._finish()
+
+    def _feed(self, text) -> bool:
+        raise NotImplementedError
+
+    def _finish(self) -> bool:
+        raise NotImplementedError
+
+
+class ExactChecker(Checker):
+    """等价于 normalize_output(输出) == normalize_output(期望)；学员输出里的 markdown 代码块标记不再剥离"""
+
+    def __init__(self, expected, eps=DEFAULT_EPS):
+        super().__init__(expected, eps)
+        self.expected = normalize_output(expected)
+        self.pos = 0
+        self.started = False  # 是否已越过开头的空白
+        self.pending = ""     # 暂不确定是否属于结尾的空白
+
+    def _feed(self, text):
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return True
+            self.started = True
+        body = text.rstrip()
+        if not body:
+            self.pending += text
+            return True
+        segment = self.pending + body
+        self.pending = text[len(body):]
+        if self.expected[self.pos:self.pos + len(segment)] != segment:
+            return False
+        self.pos += len(segment)
+        return True
+
+    def _finish(self):
+        return self.pos == len(self.expected)
+
+
+class TokenChecker(Checker):
+    """按空白切分成 token 逐个比较"""
+
+    def __init__(self, expected, eps=DEFAULT_EPS):
+        super().__init__(expected, eps)
+        self.expected = normalize_output(expected).split()
+        self.index = 0
+        self.partial = ""  # 被数据块边界截断的 token
+        self.max_len = max(map(len, self.expected), default=0)
+
+    def _match(self, actual, expected):
+        return actual == expected
+
+    def _too_long(self, partial):
+        # 还没读完的 token 已经比所有期望 token 都长，不可能再匹配上
+        return len(partial) > self.max_len
+
+    def _take(self, token):
+        if self.index >= len(self.expected) or not self._match(token, self.expected[self.index]):
+            return False
+        self.index += 1
+        return True
+
+    def _feed(self, text):
+        data = self.partial + text
+        tokens = data.split()
+        self.partial = tokens.pop() if tokens and not data[-1].isspace() else ""
+        if not all(self._take(token) for token in tokens):
+            return False
+        return not self._too_long(self.partial)
+
+    def _finish(self):
+        if self.partial and not self._take(self.partial):
+            return False
+        return self.index == len(self.expected)
+
+
+class FloatChecker(TokenChecker):
+    """数字 token 允许 eps 以内的绝对或相对误差，其余 token 精确比较"""
+
+    def _match(self, actual, expected):
+        if actual == expected:
+            return True
+        try:
+            a, e = float(actual), float(expected)
+        except ValueError:
+            return False
+        if math.isnan(a) or math.isnan(e):
+            return math.isnan(a) and math.isnan(e)
+        return math.isclose(a, e, rel_tol=self.eps, abs_tol=self.eps)
+
+    def _too_long(self, partial):
+        return False  # 1.0000000001 这类高精度输出可以比期望的 token 长
+
+
+class UnorderedLinesChecker(Checker):
+    """按行比较、不要求顺序 (忽略每行首尾空白和空行)，例如遍历集合 / 字典的输出"""
+
+    def __init__(self, expected, eps=DEFAULT_EPS):
+        super().__init__(expected, eps)
+        lines = [line.strip() for line in normalize_output(expected).split("\n")]
+        self.remaining = Counter(line for line in lines if line)
+        self.max_len = max(map(len, self.remaining), default=0)
+        self.partial = ""
+
+    def _take(self, line):
+        line = line.strip()
+        if not line:
+            return True
+        if self.remaining[line] <= 0:
+            return False  # 多出来的行，或者期望里没有的行
+        self.remaining[line] -= 1
+        return True
+
+    def _feed(self, text):
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        if not all(self._take(line) for line in lines):
+            return False
+        return len(self.partial.strip()) <= self.max_len
+
+    def _finish(self):
+        if self.partial and not self._take(self.partial):
+            return False
+        return not any(self.remaining.values())
+
+
+CHECKERS = {
+    "exact": ExactChecker,
+    "token": TokenChecker,
+    "float": FloatChecker,
+    "unordered": UnorderedLinesChecker,
+}
+
+
+def make_checker(name, expected, eps=None):
+    """按题目配置创建检查器；未知的名字退回默认的 exact"""
+    cls = CHECKERS.get(name or DEFAULT_CHECKER)
+    if cls is None:
+        print(f"⚠️ [Checker] 未知的检查器 {name!r}，使用 {DEFAULT_CHECKER}")
+        cls = CHECKERS[DEFAULT_CHECKER]
+    return cls(expected or "", DEFAULT_EPS if eps is None else eps)
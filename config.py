@@ -4,9 +4,95 @@ import os
 # --- AI 配置 ---
 # 如果使用 OpenAI，base_url 不需要改。
 # 如果使用国内模型（如 DeepSeek），请修改 BASE_URL 和 API_KEY。
-AI_API_KEY = "c50ae10fcce54889bdb12cb8fa97e084.EHRaEbFBnyGJrkpE"  # 🔴 请在此处填入你的 API Key
-AI_BASE_URL = "https://open.bigmodel.cn/api/paas/v4/" # 🔴 示例：DeepSeek 的 API 地址
-AI_MODEL_NAME = "GLM-4.5-Flash"             # 🔴 模型名称
+AI_API_KEY = os.environ.get("PYLEARN_AI_API_KEY", "c50ae10fcce54889bdb12cb8fa97e084.EHRaEbFBnyGJrkpE")  # 🔴 请在此处填入你的 API Key
+AI_BASE_URL = os.environ.get("PYLEARN_AI_BASE_URL", "https://open.bigmodel.cn/api/paas/v4/") # 🔴 示例：DeepSeek 的 API 地址 (本地联调时可用环境变量指向 stub 服务)
+AI_MODEL_NAME = os.environ.get("PYLEARN_AI_MODEL", "GLM-4.5-Flash")             # 🔴 模型名称
+AI_CONNECT_TIMEOUT = 5.0     # 秒，建立连接的超时
+AI_READ_TIMEOUT = 60.0       # 秒，两次数据到达之间的最长间隔 (流式输出时即相邻两个 chunk 之间)
+AI_MAX_RETRIES = 1           # 连接失败 / 429 / 5xx 时 SDK 自动重试次数 (流式输出开始后不会重试)
+AI_CACHE_DIR = "ai_cache"    # AI 出题结果的磁盘缓存目录 (按源文件内容哈希)
+AI_CACHE_MAX_MB = 200        # 缓存总大小上限，超出后淘汰最久未使用的条目
+
+# --- 仓库导入流水线 ---
+REPO_MIRROR_DIR = "repo_mirrors"  # 每个仓库一个本地 bare mirror，重复扫描时只 git fetch 增量
+CRAWLER_AI_CONCURRENCY = 4        # 同时进行中的 AI 出题请求数
+AI_RATE_LIMIT_RPM = 60            # 每分钟最多请求数 (按所用模型的配额填写，0 = 不限)
+AI_RATE_LIMIT_TPM = 200000        # 每分钟最多 token 数 (0 = 不限)
+CRAWLER_AI_MAX_RETRIES = 4        # 429 / 5xx / 网络错误时的最大重试次数
+CRAWLER_RETRY_BASE_DELAY = 1.0    # 指数退避的初始等待 (秒)，每次翻倍
+CRAWLER_RETRY_MAX_DELAY = 30.0    # 单次退避等待上限 (秒)
+CRAWLER_WRITE_BATCH_SIZE = 20     # 写入阶段每个事务最多提交的题目数
+CRAWLER_WRITE_FLUSH_INTERVAL = 1.0  # 攒不满一批时最多等待的秒数
+SCAN_MIN_FILE_SIZE = 20           # 扫描时忽略小于该字节数的 .py 文件
+SCAN_MAX_FILE_SIZE = 30000        # 扫描时忽略大于该字节数的 .py 文件
+SCAN_WORKERS = 0                  # 扫描时做语法检查的线程数，0 表示按 CPU 核数 (单核或文件少于一批时不启动线程池)
+SCAN_EVENTS_INTERVAL = 0.3        # /admin/scan_events 检查进度变化的间隔 (秒)
+SCAN_EVENTS_HEARTBEAT = 15.0      # 没有新进度时发送心跳的间隔 (秒)，防止代理断开空闲连接
 
 # --- 数据库配置 ---
 DB_NAME = "pylearn.db"
+DB_BUSY_TIMEOUT = 5.0             # 秒，写锁冲突时的等待时间
+DB_CACHE_SIZE_KB = 20000          # 每个连接的页缓存 (PRAGMA cache_size)
+DB_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取 (PRAGMA mmap_size)
+DB_STATEMENT_CACHE = 256          # 每个连接缓存的预编译语句数
+CATALOG_VERSION_CHECK_INTERVAL = 1.0  # 秒，题库缓存检查其他 worker 写入的间隔 (0 = 每次读取都检查)
+
+# --- 提交记录异步写入 ---
+SUBMISSION_BATCH_SIZE = 200         # 攒够多少条提交一次事务
+SUBMISSION_FLUSH_INTERVAL = 0.5     # 秒，最长攒批时间
+SUBMISSION_BUFFER_SIZE = 10000      # 内存缓冲区上限
+SUBMISSION_OVERFLOW_POLICY = "sync" # 缓冲区满时: "sync" 退回同步写入 (不丢数据) / "drop" 丢弃并计数
+
+# --- HTTP 缓存与压缩 ---
+HTTP_COMPRESS_MIN_SIZE = 1024  # 字节，小于该大小的响应不压缩
+HTTP_GZIP_LEVEL = 6
+HTTP_BROTLI_QUALITY = 5        # 仅在安装了 brotli 包时使用
+
+# --- 题目列表分页 ---
+PROBLEM_PAGE_SIZE = 50       # 首页 / /api/problems 默认每页条数
+PROBLEM_PAGE_MAX = 200       # /api/problems 单页上限
+
+# --- 沙箱配置 ---
+# "fork": 预热的 zygote 进程池，预先导入常用库后按提交 fork 子进程执行 (仅 Linux/macOS，判题更快)
+# "spawn": 每次提交冷启动一个新的 Python 解释器 (兼容性最好，Windows 下自动使用)
+SANDBOX_MODE = os.environ.get("PYLEARN_SANDBOX_MODE", "fork")
+SANDBOX_PRELOAD_MODULES = ["numpy", "pandas", "matplotlib", "matplotlib.pyplot", "scipy"]
+SANDBOX_MAX_STDOUT = 4 * 1024 * 1024  # 单次运行 stdout 上限 (字节)，超出立即 kill 并判为 Output Limit Exceeded
+SANDBOX_MAX_STDERR = 1024 * 1024      # 单次运行 stderr 上限 (字节)
+SANDBOX_OUTPUT_PREVIEW = 4096         # 输出超限时返回给学员的截断预览长度 (字节)
+# 时间限制按 CPU 时间 (user + sys) 计算，机器繁忙时正确的程序不会因为排队被判超时；
+# 另有墙钟兜底 (时间限制 × 倍数 + 1 秒)，防止 sleep / 阻塞的程序一直占着沙箱
+SANDBOX_WALL_TIME_FACTOR = 3
+SANDBOX_MEMORY_LIMIT_MB = 512    # 学员代码可用的地址空间 (RLIMIT_AS)；fork 模式下在 zygote 已占用的基础上额外允许这么多
+# RLIMIT_NPROC 按用户统计 (服务自身的线程、其他 worker、同一用户的其他程序都算在内)，固定值要么太紧要么形同虚设；
+# 因此上限取 "当前用户已有的进程 + 线程数 + 余量"，学员代码 (所有并发运行的沙箱共享) 最多再创建这么多个，防止 fork 炸弹。
+# 需要读 /proc (Linux)，拿不到时不设该上限；以 root 运行时内核也不检查它
+SANDBOX_PROCESS_HEADROOM = 64
+SANDBOX_PROCESS_COUNT_INTERVAL = 5.0  # 重新统计用户进程 / 线程数的间隔 (秒)
+
+# --- 判题队列配置 ---
+JUDGE_WORKERS = os.cpu_count() or 1   # 同时判题的提交数
+JUDGE_MAX_PENDING = JUDGE_WORKERS * 8 # 排队上限，超出时 /run 直接返回 503
+JUDGE_CASE_WORKERS = os.cpu_count() or 1  # 所有提交共享：同时运行的测试点子进程数
+SANDBOX_POOL_SIZE = JUDGE_CASE_WORKERS     # zygote 进程数，即 fork 模式下的最大并发执行数；与测试点线程数一致，线程不会空等 zygote
+JUDGE_STOP_ON_FIRST_FAILURE = True        # 任一测试点失败即取消其余测试点
+
+# --- 判题结果缓存 ---
+VERDICT_CACHE_SIZE = 2048      # 内存 LRU 条目数
+VERDICT_CACHE_DB_ROWS = 50000  # sqlite 持久层最多保留的条目数
+
+# --- 依赖库安装 (后台 pip 任务) ---
+PIP_WHEELHOUSE = os.environ.get("PYLEARN_PIP_WHEELHOUSE", "wheelhouse")  # 本地 wheel 目录，安装时优先从这里解析，下载过的包也存到这里
+PIP_OFFLINE = os.environ.get("PYLEARN_PIP_OFFLINE", "") == "1"         # 只从 wheelhouse 安装，不访问网络 (内网部署)
+PIP_INDEX_URL = os.environ.get("PYLEARN_PIP_INDEX_URL", "")             # 自定义镜像源，如 https://pypi.tuna.tsinghua.edu.cn/simple
+PIP_INSTALL_TIMEOUT = 900         # 单个 pip 命令的最长运行时间 (秒)
+PIP_JOB_HISTORY = 50              # 保留最近多少个已结束的安装任务 (含日志)
+
+# --- 运行指标 ---
+METRICS_TOKEN = os.environ.get("PYLEARN_METRICS_TOKEN", "")  # 非空时 /metrics 需要 Authorization: Bearer <token>
+
+# --- 按需剖析 (后台开启，默认关闭) ---
+PROFILE_DIR = "profiles"          # 抽样请求的 pstats 文件目录
+PROFILE_TOP_N = 30                # 报告里默认列出的函数 / 内存分配位置数
+PROFILE_MAX_DURATION = 3600       # 单次抽样最长持续时间 (秒)，到期自动关闭
+PROFILE_TRACEMALLOC_FRAMES = 5    # tracemalloc 记录的调用栈深度
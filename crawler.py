@@ -2,9 +2,43 @@ import os
 import shutil
 import tempfile
 import subprocess
-import glob
-from database import db
-from ai_service import ai
+import hashlib
+import queue
+import tarfile
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import (REPO_MIRROR_DIR, CRAWLER_AI_CONCURRENCY, CRAWLER_AI_MAX_RETRIES,
+                    CRAWLER_RETRY_BASE_DELAY, CRAWLER_RETRY_MAX_DELAY, CRAWLER_WRITE_BATCH_SIZE, CRAWLER_WRITE_FLUSH_INTERVAL,
+                    SCAN_MIN_FILE_SIZE, SCAN_MAX_FILE_SIZE, SCAN_WORKERS)
+from database import db, LEGACY_SOURCE_REPO
+from ai_service import ai, PROMPT_VERSION, is_retryable_error, retry_after_seconds
+from ai_cache import ai_cache
+from rate_limiter import ai_rate_limiter
+from file_discovery import FileDiscovery, not_boilerplate, size_between, is_valid_python
+from profiler import profiler
+
+def estimate_tokens(code):
+    """请求发出前粗估 token 用量：出题提示词约 600，代码按 3 字符 1 token，再预留约 1500 的输出"""
+    return 600 + len(code) // 3 + 1500
+
+
+class _Progress:
+    """并发分析时的进度计数 (完成数 / 缓存命中数)"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.cache_hits = 0
+        self._lock = threading.Lock()
+
+    def advance(self, cache_hit):
+        with self._lock:
+            self.done += 1
+            self.cache_hits += bool(cache_hit)
+            return self.done, self.total
+
 
 class RepoCrawler:
     def __init__(self):
@@ -12,17 +46,121 @@ class RepoCrawler:
         self.logs = [] 
         self.temp_repo_path = None 
         self.found_files = []
+        self.repo_url = None       # 当前扫描的仓库，导入的题目以它作为 source_repo
+        self.head_commit = None    # 本次扫描对应的提交，列出的文件全部选中并导入成功后记为该仓库的同步点
+        self.generation = 0        # logs / found_files 被替换 (新扫描、导入完成后清空文件列表) 时 +1；同一 generation 内只追加不修改
 
     def add_log(self, msg):
         print(f"[Crawler] {msg}")
         self.logs.append(msg)
 
-    def scan_structure(self, repo_url):
-        """Step 1: 仅下载代码，列出文件"""
+    def status_since(self, generation=None, log_offset=0, file_offset=0):
+        """
+        增量状态：只返回 log_offset / file_offset 之后新增的日志和文件，返回的偏移量下次原样带回即可。
+        generation 与当前不一致 (期间开始了新的扫描) 时从头返回，并带上 reset=True 让前端清空已有内容。
+        """
+        current = self.generation
+        logs, files = self.logs, self.found_files
+        reset = generation is not None and generation != current
+        if generation is None or reset:
+            log_offset = file_offset = 0
+        log_end, file_end = len(logs), len(files)
+        return {
+            "generation": current,
+            "reset": reset,
+            "is_busy": self.is_busy,
+            "has_repo": self.temp_repo_path is not None,
+            "logs": logs[log_offset:log_end],
+            "log_offset": log_end,
+            "files": [{"index": i, "path": files[i]} for i in range(file_offset, file_end)],
+            "file_offset": file_end,
+        }
+
+    def _git(self, *args):
+        """执行 git 命令并返回 stdout；失败时把 stderr 的最后一行带进异常信息"""
+        result = subprocess.run(["git", *args], capture_output=True)
+        if result.returncode != 0:
+            err = result.stderr.decode("utf-8", "replace").strip().splitlines()
+            raise RuntimeError(f"git {args[2] if args[0] == '--git-dir' else args[0]} 失败: {err[-1] if err else result.returncode}")
+        return result.stdout
+
+    def _sync_mirror(self, repo_url):
+        """
+        每个仓库 URL 对应一个本地 bare mirror：首次 clone --mirror，之后只 fetch 增量对象。
+        返回: (mirror 路径, 默认分支 HEAD 的 commit)
+        """
+        name = hashlib.sha1(repo_url.encode("utf-8")).hexdigest()[:16] + ".git"
+        mirror = os.path.join(REPO_MIRROR_DIR, name)
+        if os.path.isdir(mirror):
+            self.add_log("更新本地镜像 (git fetch)...")
+            self._git("--git-dir", mirror, "fetch", "--prune", "--quiet", "origin")
+        else:
+            self.add_log("首次同步该仓库，正在克隆镜像...")
+            os.makedirs(REPO_MIRROR_DIR, exist_ok=True)
+            tmp = mirror + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            self._git("clone", "--mirror", "--quiet", repo_url, tmp)
+            os.replace(tmp, mirror)  # 克隆中途失败不会留下半个镜像
+        head = self._git("--git-dir", mirror, "rev-parse", "HEAD^{commit}").decode().strip()
+        return mirror, head
+
+    def _has_commit(self, mirror, commit):
+        return subprocess.run(["git", "--git-dir", mirror, "cat-file", "-e", f"{commit}^{{commit}}"], capture_output=True).returncode == 0
+
+    def _diff_py_files(self, mirror, old, new):
+        """old..new 之间变化的 .py 文件，返回 (新增或修改的路径, 删除的路径)；重命名按 删除 + 新增 处理"""
+        out = self._git("--git-dir", mirror, "diff", "--name-status", "--no-renames", "-z", old, new).decode("utf-8", "replace")
+        fields = out.split("\0")
+        changed, deleted = [], []
+        for status, path in zip(fields[0::2], fields[1::2]):
+            if not path.endswith(".py"):
+                continue
+            (deleted if status == "D" else changed).append(path)
+        return changed, deleted
+
+    def _export_tree(self, mirror, commit, dest, paths=None):
+        """用 git archive 把 commit 中的文件 (或其中的 paths) 导出到 dest，不需要工作区，也不改动镜像"""
+        chunks = [None] if paths is None else [paths[i:i + 200] for i in range(0, len(paths), 200)]
+        for chunk in chunks:
+            cmd = ["git", "--git-dir", mirror, "archive", "--format=tar", commit]
+            if chunk:
+                cmd += ["--", *chunk]
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(dest, filter="data")
+                else:
+                    tar.extractall(dest)
+            if proc.wait() != 0:
+                raise RuntimeError(f"git archive 失败 (exit {proc.returncode})")
+
+    def _discovery(self):
+        return FileDiscovery(
+            self.temp_repo_path,
+            path_filters=[not_boilerplate, size_between(SCAN_MIN_FILE_SIZE, SCAN_MAX_FILE_SIZE)],
+            content_filters=[is_valid_python],
+            workers=SCAN_WORKERS,
+        )
+
+    def _collect(self, paths, discovery):
+        """边扫描边追加到 found_files，前端通过 status_since / scan_events 增量看到进度"""
+        for rel_path in paths:
+            self.found_files.append(rel_path)
+            if len(self.found_files) % 1000 == 0:
+                self.add_log(f"已发现 {len(self.found_files)} 个文件 (已遍历 {discovery.visited} 个 .py)...")
+
+    def scan_structure(self, repo_url, changed_only=True):
+        """
+        Step 1: 同步仓库镜像，列出文件
+        changed_only: 该仓库导入过时，只列出上次导入之后新增 / 修改的 .py 文件，并下架已删除文件对应的题目
+        """
         if self.is_busy: return
         self.is_busy = True
         self.logs = []
         self.found_files = []
+        self.generation += 1
+        self.repo_url = repo_url
+        self.head_commit = None
         
         # 清理旧数据
         if self.temp_repo_path and os.path.exists(self.temp_repo_path):
@@ -32,19 +170,35 @@ class RepoCrawler:
         
         try:
             self.add_log(f"正在连接仓库: {repo_url}")
-            subprocess.run(["git", "clone", "--depth", "1", repo_url, self.temp_repo_path], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
-            # 扫描 py 文件
-            all_py_files = glob.glob(os.path.join(self.temp_repo_path, "**/*.py"), recursive=True)
-            
-            for f_path in all_py_files:
-                if "__init__.py" in f_path or "setup.py" in f_path: continue
-                # 过滤过小或过大的文件
-                if os.path.getsize(f_path) < 20 or os.path.getsize(f_path) > 30000: continue
-                
-                rel_path = os.path.relpath(f_path, self.temp_repo_path)
-                self.found_files.append(rel_path)
-            
+            mirror, head = self._sync_mirror(repo_url)
+            last = db.get_repo_last_commit(repo_url) if changed_only else None
+            if last and not self._has_commit(mirror, last):
+                self.add_log(f"⚠️ 上次导入的提交 {last[:7]} 已不在仓库中 (可能被 force push)，改为全量扫描")
+                last = None
+
+            if last:
+                changed, deleted = self._diff_py_files(mirror, last, head)
+                retired = db.retire_problems(repo_url, deleted) if deleted else 0
+                self.add_log(f"增量扫描 {last[:7]}..{head[:7]}: 新增/修改 {len(changed)} 个, 删除 {len(deleted)} 个 .py 文件 (下架 {retired} 道题)")
+                if changed:
+                    self._export_tree(mirror, head, self.temp_repo_path, changed)
+                    try:
+                        # 各级 .gitignore 也导出来，增量扫描与全量扫描使用同样的忽略规则
+                        self._export_tree(mirror, head, self.temp_repo_path, [":(glob)**/.gitignore"])
+                    except (RuntimeError, tarfile.TarError):
+                        pass  # 仓库里没有 .gitignore
+                discovery = self._discovery()
+                self._collect(discovery.filter_paths(changed), discovery)
+                if not changed:
+                    # 没有需要导入的文件，直接把同步点推进到最新提交
+                    db.set_repo_last_commit(repo_url, head)
+            else:
+                self._export_tree(mirror, head, self.temp_repo_path)
+                # 扫描 py 文件 (跳过 venv / node_modules 等目录和 .gitignore 忽略的路径)
+                discovery = self._discovery()
+                self._collect(discovery.scan(), discovery)
+
+            self.head_commit = head
             self.add_log(f"✅ 扫描完成! 发现 {len(self.found_files)} 个文件。请选择需要导入的文件。")
             
         except Exception as e:
@@ -53,90 +207,169 @@ class RepoCrawler:
         finally:
             self.is_busy = False
 
-    def process_selected(self, selected_indices):
-        """Step 2: 对选中的文件进行 AI 分析"""
+    def generate_metadata(self, code, bypass_cache=False, label=""):
+        """
+        AI 出题，结果按 (文件内容, 提示词版本, 模型) 缓存在磁盘上。
+        未命中缓存时先经过限速器；遇到 429 / 5xx / 网络错误按指数退避重试。
+        返回: (元数据字典或 None, 是否命中缓存)
+        """
+        key = ai_cache.make_key(code, PROMPT_VERSION, ai.model)
+        if not bypass_cache:
+            meta = ai_cache.get(key)
+            if meta is not None:
+                return meta, True
+
+        estimated = estimate_tokens(code)
+        for attempt in range(CRAWLER_AI_MAX_RETRIES + 1):
+            ai_rate_limiter.acquire(estimated)
+            try:
+                meta, used_tokens = ai.request_problem_metadata(code)
+            except Exception as e:
+                ai_rate_limiter.settle(estimated, 0)
+                if not is_retryable_error(e) or attempt == CRAWLER_AI_MAX_RETRIES:
+                    self.add_log(f"⚠️ {label} AI 请求失败: {e}")
+                    return None, False
+                # 服务端给了 Retry-After 就照做，否则指数退避 + 随机抖动，避免所有并发请求同时重试
+                delay = retry_after_seconds(e) or min(CRAWLER_RETRY_MAX_DELAY, CRAWLER_RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+                self.add_log(f"⏳ {label} 第 {attempt + 1} 次请求失败 ({type(e).__name__})，{delay:.1f} 秒后重试")
+                time.sleep(delay)
+                continue
+            ai_rate_limiter.settle(estimated, used_tokens)
+            if meta and isinstance(meta, dict):
+                ai_cache.put(key, meta)
+            return meta, False
+        return None, False
+
+    def _analyze_file(self, repo_url, rel_path, bypass_cache, progress):
+        """流水线的 AI 阶段 (并发执行)：读文件、出题、清洗，返回 (题目数据, 测试点列表)；失败返回 None"""
+        full_path = os.path.join(self.temp_repo_path, rel_path)
+        with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
+            code = f.read()
+
+        start = time.monotonic()
+        meta, hit = self.generate_metadata(code, bypass_cache, label=rel_path)
+        done, total = progress.advance(hit)
+        if not (meta and isinstance(meta, dict)):
+            self.add_log(f"[{done}/{total}] ⚠️ 跳过 {rel_path}: AI 数据生成失败")
+            return None
+        if hit:
+            self.add_log(f"[{done}/{total}] ⚡ 命中缓存，跳过 AI: {rel_path}")
+        else:
+            self.add_log(f"[{done}/{total}] ✅ 分析完成: {rel_path} ({time.monotonic() - start:.1f}s)")
+
+        # 数据清洗
+        if isinstance(meta.get('knowledge'), list):
+            meta['knowledge'] = ", ".join(str(x) for x in meta['knowledge'])
+        if not meta.get('knowledge'): meta['knowledge'] = "综合"
+        for field in ('title', 'description', 'input', 'output', 'difficulty'):
+            meta.setdefault(field, None if field == 'difficulty' else "")
+
+        meta['source_repo'] = repo_url
+        meta['file_path'] = rel_path
+        meta['code'] = code
+
+        # 如果 AI 生成了 test_cases 列表就全部保存
+        # 技巧：处理多行输入。如果程序有多个 input()，数据库存的数据必须是 "Line1\nLine2"，
+        # 这里的 input 应该是 AI 生成好的带 \n 的字符串
+        if isinstance(meta.get('test_cases'), list):
+            cases = [{"input": c.get('input', ''), "output": c.get('output', '')} for c in meta['test_cases'] if isinstance(c, dict)]
+        else:
+            # 兼容旧逻辑：如果 AI 没生成数组，用单组数据兜底
+            cases = [{"input": meta.get('input', ''), "output": meta.get('output', '')}]
+        return meta, cases
+
+    def _write_results(self, results, counters):
+        """
+        流水线的写入阶段 (单线程)：攒够 CRAWLER_WRITE_BATCH_SIZE 道题或等待超过 CRAWLER_WRITE_FLUSH_INTERVAL 秒，
+        就用一个事务提交一批。收到 None 表示 AI 阶段已全部结束。
+        """
+        finished = False
+        while not finished:
+            batch = []
+            deadline = None
+            while len(batch) < CRAWLER_WRITE_BATCH_SIZE:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = results.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + CRAWLER_WRITE_FLUSH_INTERVAL
+            if not batch:
+                continue
+            try:
+                db.bulk_upsert_problems(batch)
+                counters["saved"] += len(batch)
+                self.add_log(f"💾 已入库 {len(batch)} 题 (累计 {counters['saved']})")
+            except Exception as e:
+                counters["failed"] += len(batch)
+                self.add_log(f"❌ 写入失败 {len(batch)} 题: {e}")
+
+    def process_selected(self, selected_indices, bypass_cache=False):
+        """
+        Step 2: 对选中的文件进行 AI 分析 (bypass_cache=True 时忽略缓存，强制重新生成)
+        两段式流水线：最多 CRAWLER_AI_CONCURRENCY 个文件同时请求 AI (受 RPM / TPM 限速)，
+        结果交给唯一的写入线程按批提交，AI 请求不会被数据库写入拖慢。
+        """
         if self.is_busy: return
         self.is_busy = True
         
-        total = len(selected_indices)
-        self.add_log(f"开始 AI 分析 {total} 个文件...")
+        paths = [self.found_files[idx] for idx in selected_indices if 0 <= idx < len(self.found_files)]
+        # 只有本次扫描列出的文件全部被选中时，导入成功后才能推进同步点；否则没选的文件下次增量扫描就不会再出现
+        covers_scan = set(paths) >= set(self.found_files)
+        repo_url = self.repo_url or LEGACY_SOURCE_REPO
+        head_commit = self.head_commit
+        total = len(paths)
+        started = time.monotonic()
+        self.add_log(f"开始 AI 分析 {total} 个文件 (并发 {CRAWLER_AI_CONCURRENCY})..." + (" (忽略缓存)" if bypass_cache else ""))
         
+        results = queue.Queue()
+        counters = {"saved": 0, "failed": 0}
+        progress = _Progress(total)
+        waited_before = ai_rate_limiter.waited
+        writer = threading.Thread(target=profiler.bind(self._write_results), args=(results, counters), name="crawler-writer", daemon=True)
+        writer.start()
         try:
-            success_count = 0
-            for i, idx in enumerate(selected_indices):
-                if idx < 0 or idx >= len(self.found_files): continue
-                
-                rel_path = self.found_files[idx]
-                full_path = os.path.join(self.temp_repo_path, rel_path)
-                
-                self.add_log(f"[{i+1}/{total}] 分析中: {rel_path}")
-                
-                try:
-                    with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        code = f.read()
-                    
-                    meta = ai.generate_problem_metadata(code)
-                    
-                    if meta and isinstance(meta, dict):
-                        # 数据清洗
-                        if isinstance(meta.get('knowledge'), list):
-                            meta['knowledge'] = ", ".join(str(x) for x in meta['knowledge'])
-                        if not meta.get('knowledge'): meta['knowledge'] = "综合"
-                        
-                        meta['source_repo'] = "Git Import"
-                        meta['file_path'] = rel_path
-                        meta['code'] = code
-                        
-                        # 1. 保存题目主体 (这部分逻辑微调，获取插入后的 ID)
-                        # 注意：你需要修改 add_problem_from_crawler 让它返回 ID，或者先查 ID
-                        db.add_problem_from_crawler(meta)
-                        
-                        # 获取刚刚插入的题目 ID
-                        conn = db.get_conn()
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT id FROM problems WHERE source_repo=? AND file_path=?", (meta['source_repo'], meta['file_path']))
-                        pid = cursor.fetchone()[0]
-                        conn.close()
-
-                        # 2. 【新增】保存多组测试用例
-                        # 先清空旧的（防止重复导入时堆积）
-                        db.clear_test_cases(pid)
-                        
-                        # 如果 AI 生成了 test_cases 列表
-                        if 'test_cases' in meta and isinstance(meta['test_cases'], list):
-                            for case in meta['test_cases']:
-                                # 确保输入数据最后有换行符，防止 EOFError
-                                inp = case.get('input', '')
-                                out = case.get('output', '')
-                                
-                                # 技巧：处理多行输入。
-                                # 如果程序有多个 input()，数据库存的数据必须是 "Line1\nLine2"
-                                # 这里的 inp 应该是 AI 生成好的带 \n 的字符串
-                                
-                                db.add_test_case(pid, inp, out)
-                                
-                            print(f"✅ 已保存 {len(meta['test_cases'])} 组测试数据")
-                        else:
-                            # 兼容旧逻辑：如果 AI 没生成数组，用单组数据兜底
-                            db.add_test_case(pid, meta.get('input', ''), meta.get('output', ''))
-
-                        success_count += 1
-                    else:
-                        self.add_log(f"⚠️ 跳过 {rel_path}: AI 数据生成失败")
-                        
-                except Exception as e:
-                    print(f"File Error: {e}")
-            
-            self.add_log(f"🎉 全部完成! 成功入库: {success_count} 题。")
-            
+            with ThreadPoolExecutor(max_workers=max(1, CRAWLER_AI_CONCURRENCY), thread_name_prefix="crawler-ai") as pool:
+                analyze = profiler.bind(self._analyze_file)
+                futures = {pool.submit(analyze, repo_url, rel_path, bypass_cache, progress): rel_path for rel_path in paths}
+                for fut in as_completed(futures):
+                    try:
+                        item = fut.result()
+                    except Exception as e:
+                        progress.advance(False)
+                        self.add_log(f"⚠️ 跳过 {futures[fut]}: {e}")
+                        continue
+                    if item is not None:
+                        results.put(item)
         except Exception as e:
             self.add_log(f"❌ 流程中断: {e}")
         finally:
+            results.put(None)
+            writer.join()
+            if head_commit and total and counters["saved"] == total and covers_scan:
+                db.set_repo_last_commit(repo_url, head_commit)
+                self.add_log(f"📌 已记录同步点 {head_commit[:7]}，下次增量扫描只列出之后的改动")
+            elif head_commit and total and not covers_scan:
+                self.add_log("ℹ️ 只导入了部分文件，同步点保持不变，下次增量扫描仍会列出未选中的文件")
+            elif head_commit and total:
+                self.add_log("⚠️ 有文件未能导入，同步点保持不变，下次增量扫描仍会列出它们")
+            elapsed = time.monotonic() - started
+            hit_rate = f"{progress.cache_hits / total:.0%}" if total else "-"
+            self.add_log(f"🎉 全部完成! 成功入库: {counters['saved']} 题，失败 {total - counters['saved']} 题，"
+                         f"耗时 {elapsed:.1f}s。AI 缓存命中 {progress.cache_hits}/{total} ({hit_rate})，限速等待 {ai_rate_limiter.waited - waited_before:.1f}s")
             # 完成后清理
             if self.temp_repo_path and os.path.exists(self.temp_repo_path):
                 shutil.rmtree(self.temp_repo_path, ignore_errors=True)
                 self.temp_repo_path = None
+                # 文件列表被替换而不是追加，必须开启新的 generation，让增量客户端收到 reset 并清空旧列表
+                # (日志保留在新 generation 中，客户端重置后会完整地重新拿到)
                 self.found_files = []
+                self.generation += 1
             self.is_busy = False
 
     def organize_database(self):
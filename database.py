@@ -1,19 +1,316 @@
 import sqlite3
+import threading
 import time
+from contextlib import contextmanager
 import bcrypt  # 🟢 改用原生 bcrypt
-from config import DB_NAME
+from checkers import DEFAULT_CHECKER, DEFAULT_EPS
+import metrics
+from config import DB_NAME, DB_BUSY_TIMEOUT, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE, CATALOG_VERSION_CHECK_INTERVAL
+
+# --- 版本化迁移步骤 ---
+# 只能在末尾追加新步骤，已发布的步骤不要修改。每一步都要能在旧库和新建库上安全执行。
+
+def _has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def _m1_time_limit(conn):
+    if not _has_column(conn, "problems", "time_limit"):
+        conn.execute("ALTER TABLE problems ADD COLUMN time_limit INTEGER DEFAULT 2")
+
+
+def _m2_test_version(conn):
+    if not _has_column(conn, "problems", "test_version"):
+        conn.execute("ALTER TABLE problems ADD COLUMN test_version INTEGER DEFAULT 0")
+
+
+def _m3_indexes(conn):
+    # get_test_cases: WHERE problem_id=? ORDER BY id (索引隐含 rowid，同一题内天然按 id 有序)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_test_cases_problem ON test_cases(problem_id)")
+    # get_history: WHERE problem_id=? ORDER BY id DESC LIMIT 5
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_submissions_problem ON submissions(problem_id)")
+    # get_all_problems: ORDER BY difficulty, id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_problems_difficulty ON problems(difficulty)")
+    # _bump_test_version: DELETE FROM verdict_cache WHERE problem_id=?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verdict_cache_problem ON verdict_cache(problem_id)")
+
+
+def _m4_unique_source(conn):
+    # 旧版本可能重复导入过同一文件：保留最早的那道题，删除其余重复题目及其测试点
+    dup_ids = [r[0] for r in conn.execute("""
+        SELECT p.id FROM problems p
+        WHERE p.source_repo IS NOT NULL AND p.file_path IS NOT NULL
+          AND p.id > (SELECT MIN(q.id) FROM problems q WHERE q.source_repo=p.source_repo AND q.file_path=p.file_path)
+    """)]
+    if dup_ids:
+        print(f"⚠️ [Migrate] 删除 {len(dup_ids)} 道重复导入的题目: {dup_ids}")
+        conn.executemany("DELETE FROM test_cases WHERE problem_id=?", [(i,) for i in dup_ids])
+        conn.executemany("DELETE FROM problems WHERE id=?", [(i,) for i in dup_ids])
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_problems_source ON problems(source_repo, file_path)")
+
+
+def _m5_app_meta(conn):
+    # 全局版本戳：题库 (列表 / 详情) 每次变更 +1，多个 worker 据此判断内存缓存是否过期
+    conn.execute("CREATE TABLE IF NOT EXISTS app_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('catalog_version', 0)")
+
+
+def _m6_revision(conn):
+    if not _has_column(conn, "problems", "revision"):
+        conn.execute("ALTER TABLE problems ADD COLUMN revision INTEGER DEFAULT 0")
+    if not _has_column(conn, "problems", "updated_at"):
+        conn.execute("ALTER TABLE problems ADD COLUMN updated_at REAL")
+        conn.execute("UPDATE problems SET updated_at=COALESCE(created_at, ?)", (time.time(),))
+
+
+def _fts5_tokenizer(conn):
+    """当前 sqlite 支持的 FTS5 分词器：trigram (3.34+，支持中文子串) > unicode61；不支持 FTS5 时返回 None"""
+    for tokenizer in ("trigram", "unicode61"):
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x, tokenize='{tokenizer}')")
+            conn.execute("DROP TABLE temp._fts5_probe")
+            return tokenizer
+        except sqlite3.OperationalError:
+            continue
+    return None
+
+
+def _m7_fts_search(conn):
+    # 分页列表的 keyset 游标是 (difficulty, id)，NULL 难度会让游标比较失效
+    conn.execute("UPDATE problems SET difficulty=1 WHERE difficulty IS NULL")
+    tokenizer = _fts5_tokenizer(conn)
+    if tokenizer is None:
+        print("⚠️ [Migrate] 当前 sqlite 未编译 FTS5，题目搜索退回 LIKE 全表扫描")
+        return
+    # 外部内容表：只存倒排索引，正文仍在 problems 表里；由触发器保持同步
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS problems_fts USING fts5(
+            title, description, sample_code,
+            content='problems', content_rowid='id', tokenize='{tokenizer}'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS problems_fts_ai AFTER INSERT ON problems BEGIN
+            INSERT INTO problems_fts (rowid, title, description, sample_code) VALUES (new.id, new.title, new.description, new.sample_code);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS problems_fts_ad AFTER DELETE ON problems BEGIN
+            INSERT INTO problems_fts (problems_fts, rowid, title, description, sample_code) VALUES ('delete', old.id, old.title, old.description, old.sample_code);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS problems_fts_au AFTER UPDATE OF title, description, sample_code ON problems BEGIN
+            INSERT INTO problems_fts (problems_fts, rowid, title, description, sample_code) VALUES ('delete', old.id, old.title, old.description, old.sample_code);
+            INSERT INTO problems_fts (rowid, title, description, sample_code) VALUES (new.id, new.title, new.description, new.sample_code);
+        END
+    """)
+    conn.execute("INSERT INTO problems_fts (problems_fts) VALUES ('rebuild')")
+
+
+def split_tags(knowledge_tag):
+    """knowledge_tag 是逗号分隔的知识点 (AI 生成，中英文逗号都可能出现)，拆成去重后的列表"""
+    tags = []
+    for tag in (knowledge_tag or "").replace("，", ",").split(","):
+        tag = tag.strip()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def _m8_problem_tags(conn):
+    # 知识点倒排表：按知识点过滤时直接在 (tag, difficulty, problem_id) 上做 keyset 范围扫描，
+    # 不用对逗号分隔的 knowledge_tag 做全表子串匹配。difficulty 冗余存一份，保证与列表顺序一致
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS problem_tags (
+            tag TEXT,
+            difficulty INTEGER,
+            problem_id INTEGER,
+            PRIMARY KEY (tag, difficulty, problem_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_problem_tags_problem ON problem_tags(problem_id)")
+    conn.execute("DELETE FROM problem_tags")
+    conn.executemany(
+        "INSERT OR IGNORE INTO problem_tags (tag, difficulty, problem_id) VALUES (?, ?, ?)",
+        [(tag, difficulty, pid) for pid, knowledge_tag, difficulty in conn.execute("SELECT id, knowledge_tag, difficulty FROM problems").fetchall()
+         for tag in split_tags(knowledge_tag)],
+    )
+    # 按来源过滤的分页：(source_repo, difficulty) + 隐含的 rowid 正好是 keyset 的顺序
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_problems_source ON problems(source_repo, difficulty)")
+
+
+def _m9_repo_sync(conn):
+    # 每个仓库最后一次导入时的 commit，增量扫描时据此 git diff
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS repo_sync (
+            repo_url TEXT PRIMARY KEY,
+            last_commit TEXT,
+            synced_at REAL
+        )
+    """)
+
+
+def _m10_checker(conn):
+    if not _has_column(conn, "problems", "checker"):
+        conn.execute("ALTER TABLE problems ADD COLUMN checker TEXT DEFAULT 'exact'")
+    if not _has_column(conn, "problems", "checker_eps"):
+        conn.execute("ALTER TABLE problems ADD COLUMN checker_eps REAL DEFAULT 1e-6")
+
+
+def _m11_submission_usage(conn):
+    for column in ("cpu_ms", "wall_ms", "max_rss_kb"):
+        if not _has_column(conn, "submissions", column):
+            conn.execute(f"ALTER TABLE submissions ADD COLUMN {column} INTEGER")
+
+
+# 旧版本的爬虫导入题目时不记录仓库地址，source_repo 一律写成这个值
+LEGACY_SOURCE_REPO = "Git Import"
+
+MIGRATIONS = [
+    (1, "problems.time_limit 字段", _m1_time_limit),
+    (2, "problems.test_version 字段", _m2_test_version),
+    (3, "热点查询的二级索引", _m3_indexes),
+    (4, "UNIQUE (source_repo, file_path)", _m4_unique_source),
+    (5, "app_meta 版本戳 (题库缓存)", _m5_app_meta),
+    (6, "problems.revision / updated_at 字段 (HTTP 缓存)", _m6_revision),
+    (7, "problems_fts 全文索引 + 同步触发器", _m7_fts_search),
+    (8, "problem_tags 知识点倒排表 + 来源索引", _m8_problem_tags),
+    (9, "repo_sync 仓库增量同步记录", _m9_repo_sync),
+    (10, "problems.checker / checker_eps 字段 (输出检查器)", _m10_checker),
+    (11, "submissions.cpu_ms / wall_ms / max_rss_kb 字段 (资源用量)", _m11_submission_usage),
+]
+
+
+class _CatalogCache:
+    """
+    进程内的题库缓存：题目列表 + 每道题的详情字典。
+    - 本进程的写操作提交后立即失效 (write-through invalidation)
+    - 其他 worker 的写操作通过 sqlite 中的 catalog_version 感知，最多每 check_interval 秒检查一次，
+      稳态下页面渲染完全不访问数据库
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None     # 缓存内容对应的 catalog_version
+        self._checked_at = 0.0
+        self._generation = 0     # 每次失效 +1，防止并发读把失效前的旧数据写回缓存
+        self._list = None
+        self._details = {}
+
+    def sync(self, read_version):
+        """按间隔比对数据库版本戳，版本变化时清空缓存；返回当前 generation"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            version = read_version()
+            with self._lock:
+                self._checked_at = now
+                if version != self._version:
+                    self._clear()
+                    self._version = version
+        return self._generation
+
+    @property
+    def version(self):
+        return self._version
+
+    def _clear(self):
+        self._generation += 1
+        self._list = None
+        self._details = {}
+
+    def invalidate(self, pid=None):
+        with self._lock:
+            self._generation += 1
+            self._list = None
+            if pid is None:
+                self._details = {}
+            else:
+                self._details.pop(pid, None)
+            self._checked_at = 0.0  # 下次读取时重新确认版本戳
+
+    def get_list(self):
+        return self._list
+
+    def put_list(self, generation, value):
+        with self._lock:
+            if generation == self._generation:
+                self._list = value
+
+    def get_detail(self, pid):
+        return self._details.get(pid)
+
+    def put_detail(self, generation, pid, value):
+        with self._lock:
+            if generation == self._generation:
+                self._details[pid] = value
+
 
 class Database:
     def __init__(self):
         self.db_path = DB_NAME
+        self._local = threading.local()
+        self.catalog = _CatalogCache(CATALOG_VERSION_CHECK_INTERVAL)
         self.init_db()
 
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=DB_BUSY_TIMEOUT,                 # 写锁被占用时等待，而不是立即 "database is locked"
+            cached_statements=DB_STATEMENT_CACHE,    # 连接级的预编译语句缓存，长连接下才能发挥作用
+        )
+        # WAL: 读写互不阻塞；NORMAL 在 WAL 下只在 checkpoint 时 fsync，仍然不会损坏数据库
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
     def get_conn(self):
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        """
+        返回当前线程复用的长连接 (每个线程一个，不要 close)。
+        sqlite3 连接不能安全地跨线程并发使用，所以按线程隔离而不是全局共享一个。
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
 
-    def init_db(self):
+    @contextmanager
+    def transaction(self):
+        """写操作统一入口：正常结束自动 commit，出错自动 rollback"""
         conn = self.get_conn()
-        cursor = conn.cursor()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close(self):
+        """关闭当前线程的连接 (主要用于测试 / 进程退出)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def init_db(self):
+        with self.transaction() as conn:
+            self._create_tables(conn.cursor())
+        self._migrate()
+        self.fts_tokenizer = self._detect_fts()
+
+    def _detect_fts(self):
+        """problems_fts 使用的分词器 (trigram / unicode61)；没有全文索引时为 None"""
+        row = self.get_conn().execute("SELECT sql FROM sqlite_master WHERE name='problems_fts'").fetchone()
+        if not row:
+            return None
+        return "trigram" if "trigram" in row[0] else "unicode61"
+
+    def _create_tables(self, cursor):
         
         # 1. 题目表
         cursor.execute('''
@@ -27,6 +324,11 @@ class Database:
                 test_input TEXT,
                 expected_output TEXT,
                 time_limit INTEGER DEFAULT 2,  -- 🟢 新增字段
+                test_version INTEGER DEFAULT 0,  -- 测试数据版本号，判题结果缓存的失效依据
+                revision INTEGER DEFAULT 0,      -- 题目内容修订号，HTTP ETag 的依据
+                checker TEXT DEFAULT 'exact',    -- 输出检查器 (见 checkers.py)
+                checker_eps REAL DEFAULT 1e-6,   -- float 检查器允许的误差
+                updated_at REAL,
                 source_repo TEXT,
                 file_path TEXT,
                 created_at REAL
@@ -43,7 +345,10 @@ class Database:
                 error_msg TEXT,
                 is_correct BOOLEAN,
                 ai_analysis TEXT,
-                created_at REAL
+                created_at REAL,
+                cpu_ms INTEGER,      -- 各测试点 CPU 时间之和 (毫秒)
+                wall_ms INTEGER,     -- 最慢测试点的墙钟时间 (毫秒)
+                max_rss_kb INTEGER   -- 测试点中的内存峰值 (KB)
             )
         ''')
 
@@ -65,15 +370,20 @@ class Database:
                 is_sample BOOLEAN DEFAULT 0  -- 标记是否为展示给用户的样例
             )
         ''')
+
+        # 4. 判题结果缓存 (持久层)，key 中已包含题目的 test_version
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS verdict_cache (
+                cache_key TEXT PRIMARY KEY,
+                problem_id INTEGER,
+                result TEXT,
+                created_at REAL
+            )
+        ''')
         
         # 创建默认管理员
         self._create_default_admin(cursor)
 
-        conn.commit()
-        conn.close()
-
-        self._check_and_migrate()
-
     def _create_default_admin(self, cursor):
         cursor.execute("SELECT * FROM users WHERE username='admin'")
         if not cursor.fetchone():
@@ -88,12 +398,8 @@ class Database:
 
     # --- 用户鉴权方法 ---
     def authenticate_user(self, username, password):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT hashed_password FROM users WHERE username=?", (username,))
-        row = cursor.fetchone()
-        conn.close()
-        
+        row = self.get_conn().execute("SELECT hashed_password FROM users WHERE username=?", (username,)).fetchone()
+
         if not row: return False
         
         stored_hash = row[0]
@@ -105,54 +411,242 @@ class Database:
             print(f"Auth Error: {e}")
             return False
     
-    def _check_and_migrate(self):
-        """简单的自动迁移脚本"""
-        conn = self.get_conn()
-        try:
-            # 尝试查询该字段，如果报错说明不存在
-            conn.execute("SELECT time_limit FROM problems LIMIT 1")
-        except:
-            print("⚠️ 检测到旧版数据库，正在添加 time_limit 字段...")
-            conn.execute("ALTER TABLE problems ADD COLUMN time_limit INTEGER DEFAULT 2")
-            conn.commit()
-        finally:
-            conn.close()
-            
-    # --- 写入接口 (保持不变) ---
-    def add_problem_from_crawler(self, data):
+    def _migrate(self):
+        """
+        版本化迁移：schema_version 记录已执行的步骤，按版本号顺序执行 MIGRATIONS 中未执行的部分。
+        每一步在独立的 BEGIN IMMEDIATE 事务中执行 (DDL 在 sqlite 中也是事务性的)，
+        多个 uvicorn worker 同时启动时只有一个会真正执行，其余等锁后发现已是最新版本。
+        """
         conn = self.get_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM problems WHERE source_repo=? AND file_path=?", (data['source_repo'], data['file_path']))
-        exist = cursor.fetchone()
-        if exist:
-            cursor.execute('''UPDATE problems SET title=?, description=?, difficulty=?, sample_code=?, test_input=?, expected_output=?, knowledge_tag=? WHERE id=?''', 
-                           (data['title'], data['description'], data['difficulty'], data['code'], data['input'], data['output'], data['knowledge'], exist[0]))
-        else:
-            cursor.execute('''INSERT INTO problems (title, description, difficulty, sample_code, test_input, expected_output, knowledge_tag, source_repo, file_path, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                           (data['title'], data['description'], data['difficulty'], data['code'], data['input'], data['output'], data['knowledge'], data['source_repo'], data['file_path'], time.time()))
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at REAL
+            )
+        """)
         conn.commit()
-        conn.close()
+        for version, description, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+                if version <= current:
+                    conn.rollback()
+                    continue
+                print(f"⚙️ [Migrate] v{version}: {description}")
+                step(conn)
+                conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)", (version, description, time.time()))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def schema_version(self):
+        return self.get_conn().execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+    def explain(self, sql, params=()):
+        """返回查询计划的 detail 列表，用于确认热点查询走了索引"""
+        return [row[3] for row in self.get_conn().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+    def _bump_catalog_version(self, conn):
+        """题库内容变化：递增全局版本戳，让其他 worker 的缓存失效 (调用方负责 commit)"""
+        conn.execute("UPDATE app_meta SET value=value+1 WHERE key='catalog_version'")
 
-    # --- 读取接口 (保持不变) ---
+    def get_catalog_version(self):
+        res = self.get_conn().execute("SELECT value FROM app_meta WHERE key='catalog_version'").fetchone()
+        return res[0] if res else 0
+
+    def get_cached_catalog_version(self):
+        """题库版本戳 (走缓存的检查间隔，稳态下不访问数据库)，用于生成首页 ETag"""
+        self.catalog.sync(self.get_catalog_version)
+        return self.catalog.version
+
+    def _bump_test_version(self, conn, pid):
+        """题目的判题数据发生变化：版本号 +1，并清掉该题的持久化判题缓存 (调用方负责 commit)"""
+        conn.execute("UPDATE problems SET test_version=COALESCE(test_version, 0)+1 WHERE id=?", (pid,))
+        conn.execute("DELETE FROM verdict_cache WHERE problem_id=?", (pid,))
+
+    def _sync_tags(self, conn, pids):
+        """题目的 knowledge_tag / difficulty 变化或被删除后，重建其在 problem_tags 中的行 (调用方负责 commit)"""
+        for pid in pids:
+            conn.execute("DELETE FROM problem_tags WHERE problem_id=?", (pid,))
+            row = conn.execute("SELECT knowledge_tag, difficulty FROM problems WHERE id=?", (pid,)).fetchone()
+            if row:
+                conn.executemany("INSERT OR IGNORE INTO problem_tags (tag, difficulty, problem_id) VALUES (?, ?, ?)",
+                                 [(tag, row[1], pid) for tag in split_tags(row[0])])
+
+    # --- 写入接口 ---
+    def add_problem_from_crawler(self, data):
+        """写入 / 更新一道爬取的题目 (不改动测试点)，返回题目 ID"""
+        return self.bulk_upsert_problems([(data, None)])[0]
+
+    def bulk_upsert_problems(self, items):
+        """
+        批量导入题目：items 为 (题目数据, 测试点列表) 元组列表，测试点列表为 None 时保留原有测试点。
+        整批在一个事务里完成 (要么全部写入，要么全部回滚，只 fsync 一次)，每一步都是 executemany / 集合操作：
+        0. 旧版本导入的题目 source_repo 都是 LEGACY_SOURCE_REPO (没有记录仓库地址)：同一路径还没有新记录时，
+           先把旧记录认领到本次的仓库下，重新导入会更新它而不是再插入一道重复的题目
+        1. 按 (source_repo, file_path) UPSERT 题目：已存在则更新内容并递增 revision / test_version
+        2. 一次查询取回全部题目 ID
+        3. 清掉这些题目的持久化判题缓存、知识点倒排行和 (需要替换的) 测试点，再批量插入新数据
+        返回与 items 一一对应的题目 ID 列表
+        """
+        if not items:
+            return []
+        now = time.time()
+        rows = [(data['title'], data['description'], data['difficulty'] or 1, data['code'], data['input'], data['output'],
+                 data['knowledge'], data['source_repo'], data['file_path'], now, now) for data, _ in items]
+        with self.transaction() as conn:
+            conn.executemany("""UPDATE problems SET source_repo=? WHERE source_repo=? AND file_path=?
+                                AND NOT EXISTS (SELECT 1 FROM problems WHERE source_repo=? AND file_path=?)""",
+                             [(repo, LEGACY_SOURCE_REPO, path, repo, path) for repo, path in dict.fromkeys((r[7], r[8]) for r in rows) if repo != LEGACY_SOURCE_REPO])
+            conn.executemany('''INSERT INTO problems (title, description, difficulty, sample_code, test_input, expected_output, knowledge_tag, source_repo, file_path, created_at, updated_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT(source_repo, file_path) DO UPDATE SET
+                                    title=excluded.title, description=excluded.description, difficulty=excluded.difficulty,
+                                    sample_code=excluded.sample_code, test_input=excluded.test_input, expected_output=excluded.expected_output,
+                                    knowledge_tag=excluded.knowledge_tag, updated_at=excluded.updated_at,
+                                    revision=COALESCE(revision, 0)+1, test_version=COALESCE(test_version, 0)+1''', rows)
+
+            ids = {}
+            keys = sorted({(r[7], r[8]) for r in rows})
+            for i in range(0, len(keys), 400):  # 每条语句 800 个参数，低于旧版 SQLite 的 999 上限
+                chunk = keys[i:i + 400]
+                placeholders = ", ".join(["(?, ?)"] * len(chunk))
+                for pid, repo, path in conn.execute(f"SELECT id, source_repo, file_path FROM problems WHERE (source_repo, file_path) IN (VALUES {placeholders})",
+                                                    [v for key in chunk for v in key]):
+                    ids[(repo, path)] = pid
+            pids = [ids[(r[7], r[8])] for r in rows]
+
+            touched = [(pid,) for pid in dict.fromkeys(pids)]
+            conn.executemany("DELETE FROM verdict_cache WHERE problem_id=?", touched)
+            conn.executemany("DELETE FROM problem_tags WHERE problem_id=?", touched)
+            # 同一批里重复出现的题目以最后一次为准
+            latest = dict(zip(pids, items))
+            conn.executemany("INSERT OR IGNORE INTO problem_tags (tag, difficulty, problem_id) VALUES (?, ?, ?)",
+                             [(tag, data['difficulty'] or 1, pid) for pid, (data, _) in latest.items() for tag in split_tags(data['knowledge'])])
+            replaced = {pid: cases for pid, (_, cases) in latest.items() if cases is not None}
+            conn.executemany("DELETE FROM test_cases WHERE problem_id=?", [(pid,) for pid in replaced])
+            conn.executemany("INSERT INTO test_cases (problem_id, input_data, output_data, is_sample) VALUES (?, ?, ?, 0)",
+                             [(pid, case['input'], case['output']) for pid, cases in replaced.items() for case in cases])
+            self._bump_catalog_version(conn)
+        self.catalog.invalidate(pids[0] if len(touched) == 1 else None)
+        return pids
+
+    # --- 读取接口 (经过进程内题库缓存) ---
     def get_all_problems(self):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, knowledge_tag, difficulty, source_repo FROM problems ORDER BY difficulty ASC, id ASC")
-        rows = cursor.fetchall()
-        conn.close()
-        return [{"id": r[0], "title": r[1], "category": r[2], "difficulty": r[3], "source": r[4]} for r in rows]
+        generation = self.catalog.sync(self.get_catalog_version)
+        cached = self.catalog.get_list()
+        if cached is None:
+            rows = self.get_conn().execute("SELECT id, title, knowledge_tag, difficulty, source_repo FROM problems ORDER BY difficulty ASC, id ASC").fetchall()
+            cached = [{"id": r[0], "title": r[1], "category": r[2], "difficulty": r[3], "source": r[4]} for r in rows]
+            self.catalog.put_list(generation, cached)
+        return list(cached)
+
+    def first_page(self, limit=20):
+        """
+        不带过滤条件的第一页：直接切缓存的全量列表 (排序同 list_problems)，首页渲染不访问数据库
+        返回: (本页题目列表, 下一页的 after；没有下一页时为 None)
+        """
+        problems = self.get_all_problems()
+        items = problems[:limit]
+        next_after = (items[-1]["difficulty"], items[-1]["id"]) if len(problems) > limit else None
+        return items, next_after
+
+    def list_problems(self, limit=20, after=None, tag=None, difficulty=None, source=None, query=None):
+        """
+        分页列表 / 搜索 (不经过缓存；不带游标和过滤条件的第一页请用 first_page)，全部是 keyset 分页，翻到第几页都不需要 OFFSET：
+        - 普通列表 / 按知识点过滤：按 (difficulty, id) 排序
+        - 全文搜索 (query)：由 FTS5 按 id 顺序流式产出匹配结果，凑够一页就停止
+        after: 上一页最后一条的 (difficulty, id)，None 表示第一页
+        返回: (本页题目列表, 下一页的 after；没有下一页时为 None)
+        """
+        fts_match, like_terms = self._search_terms(query)
+        columns = "SELECT p.id, p.title, p.knowledge_tag, p.difficulty, p.source_repo"
+        where, params = [], []
+        # keyset 条件的若干种写法，多于一种时用 UNION ALL 合并 (每一支都能走索引范围扫描)
+        keyset = [(None, [])]
+        if fts_match:
+            sql = f"{columns} FROM problems_fts JOIN problems p ON p.id = problems_fts.rowid"
+            order = "problems_fts.rowid"
+            where.append("problems_fts MATCH ?")
+            params.append(fts_match)
+            if tag:
+                where.append("EXISTS (SELECT 1 FROM problem_tags t WHERE t.tag = ? AND t.difficulty = p.difficulty AND t.problem_id = p.id)")
+                params.append(tag.strip())
+            if after is not None:
+                keyset = [("problems_fts.rowid > ?", [after[1]])]
+        elif tag:
+            sql = f"{columns} FROM problem_tags t JOIN problems p ON p.id = t.problem_id"
+            order = "t.difficulty, t.problem_id"
+            where.append("t.tag = ?")
+            params.append(tag.strip())
+            if after is not None:
+                keyset = [("(t.difficulty, t.problem_id) > (?, ?)", list(after))]
+        else:
+            sql = f"{columns} FROM problems p"
+            order = "p.difficulty, p.id"
+            if after is not None:
+                # 行值比较 (difficulty, id) > (?, ?) 在这里只能用上 difficulty 做范围，
+                # 同一难度内会从头扫到游标位置；拆成两支后各自都是精确的索引范围
+                keyset = [("p.difficulty = ? AND p.id > ?", list(after)), ("p.difficulty > ?", [after[0]])]
+
+        if difficulty is not None:
+            where.append("p.difficulty = ?")
+            params.append(difficulty)
+        if source:
+            where.append("p.source_repo = ?")
+            params.append(source)
+        for term in like_terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(p.title LIKE ? ESCAPE '\\' OR p.description LIKE ? ESCAPE '\\' OR p.sample_code LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+
+        parts, args = [], []
+        for clause, clause_params in keyset:
+            clauses = where + ([clause] if clause else [])
+            parts.append(sql + (" WHERE " + " AND ".join(clauses) if clauses else ""))
+            args.extend(params + clause_params)
+        if len(parts) == 1:
+            final = f"{parts[0]} ORDER BY {order} LIMIT ?"
+        else:
+            final = " UNION ALL ".join(parts) + " ORDER BY 4, 1 LIMIT ?"
+        rows = self.get_conn().execute(final, args + [limit + 1]).fetchall()
+
+        items = [{"id": r[0], "title": r[1], "category": r[2], "difficulty": r[3], "source": r[4]} for r in rows[:limit]]
+        next_after = (rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_after
+
+    def _search_terms(self, query):
+        """
+        拆分搜索词：能走 FTS5 索引的词合成一个 MATCH 表达式，其余退回 LIKE 过滤。
+        trigram 分词器无法匹配不足 3 个字符的词；没有 FTS5 时全部走 LIKE。
+        返回: (MATCH 表达式或 None, LIKE 词列表)
+        """
+        fts_terms, like_terms = [], []
+        for term in (query or "").split():
+            if self.fts_tokenizer == "unicode61":
+                fts_terms.append('"' + term.replace('"', '""') + '"*')
+            elif self.fts_tokenizer == "trigram" and len(term) >= 3:
+                fts_terms.append('"' + term.replace('"', '""') + '"')
+            else:
+                like_terms.append(term)
+        return (" AND ".join(fts_terms) or None), like_terms
 
     def get_problem_detail(self, pid):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM problems WHERE id=?", (pid,))
-        row = cursor.fetchone()
-        conn.close()
+        generation = self.catalog.sync(self.get_catalog_version)
+        cached = self.catalog.get_detail(pid)
+        if cached is None:
+            cached = self._load_problem_detail(pid)
+            if cached is None:
+                return None
+            self.catalog.put_detail(generation, pid, cached)
+        return dict(cached)
+
+    def _load_problem_detail(self, pid):
+        # 在 SQL 里指定列名，不依赖建表 / 迁移后的列顺序
+        row = self.get_conn().execute("SELECT id, title, description, difficulty, knowledge_tag, sample_code, time_limit, revision, updated_at, created_at, checker, checker_eps FROM problems WHERE id=?", (pid,)).fetchone()
         if row:
-            # 注意：row 的索引取决于你的建表顺序，建议用 row['time_limit'] 如果开启了 row_factory
-            # 这里假设 time_limit 是第 8 列 (从0开始数，基于上面的 CREATE TABLE 顺序)
-            # id(0), title(1), desc(2), diff(3), tag(4), code(5), input(6), output(7), limit(8)...
-            # 为了稳妥，我们重新查一次或者在 SQL 里指定列名
             return {
                 "id": row[0], 
                 "title": row[1], 
@@ -160,15 +654,17 @@ class Database:
                 "difficulty": row[3], 
                 "category": row[4], 
                 "sample_code": row[5],
-                "time_limit": row[8] if len(row) > 8 else 2 # 🟢 返回时间限制
+                "time_limit": row[6] or 2, # 🟢 返回时间限制
+                "revision": row[7] or 0,
+                "updated_at": row[8] or row[9],
+                "checker": row[10] or DEFAULT_CHECKER,
+                "checker_eps": row[11] if row[11] is not None else DEFAULT_EPS,
             }
         return None
     
     def get_test_data(self, pid):
-        conn = self.get_conn()
         # 🟢 顺便读出 time_limit
-        res = conn.execute("SELECT test_input, expected_output, time_limit FROM problems WHERE id=?", (pid,)).fetchone()
-        conn.close()
+        res = self.get_conn().execute("SELECT test_input, expected_output, time_limit FROM problems WHERE id=?", (pid,)).fetchone()
         if res:
             # 如果数据库里是 NULL (老数据)，默认给 2 秒
             t_limit = res[2] if res[2] else 2
@@ -176,61 +672,126 @@ class Database:
         return "", "", 2
 
     def save_submission(self, pid, code, output, error, is_correct, ai_analysis):
-        conn = self.get_conn()
-        conn.execute('''INSERT INTO submissions (problem_id, code, user_output, error_msg, is_correct, ai_analysis, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)''', (pid, code, output, error, is_correct, ai_analysis, time.time()))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute('''INSERT INTO submissions (problem_id, code, user_output, error_msg, is_correct, ai_analysis, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)''', (pid, code, output, error, is_correct, ai_analysis, time.time()))
+
+    def save_submissions_batch(self, records):
+        """
+        批量写入提交记录 (一个事务、一次 fsync)，
+        records 为 (pid, code, output, error, is_correct, ai_analysis, created_at, cpu_ms, wall_ms, max_rss_kb) 元组列表
+        """
+        with self.transaction() as conn:
+            conn.executemany('''INSERT INTO submissions (problem_id, code, user_output, error_msg, is_correct, ai_analysis, created_at, cpu_ms, wall_ms, max_rss_kb)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', records)
 
     def get_history(self, pid):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM submissions WHERE problem_id=? ORDER BY id DESC LIMIT 5", (pid,))
-        rows = cursor.fetchall()
-        conn.close()
-        return [{"date": time.strftime("%H:%M", time.localtime(r[7])), "is_correct": r[5]} for r in rows]
+        rows = self.get_conn().execute("SELECT created_at, is_correct FROM submissions WHERE problem_id=? ORDER BY id DESC LIMIT 5", (pid,)).fetchall()
+        return [{"date": time.strftime("%H:%M", time.localtime(r[0])), "is_correct": r[1]} for r in rows]
 
     def delete_problem(self, pid):
-        conn = self.get_conn()
-        conn.execute("DELETE FROM problems WHERE id=?", (pid,))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM problems WHERE id=?", (pid,))
+            self._sync_tags(conn, [pid])
+            self._bump_catalog_version(conn)
+        self.catalog.invalidate(pid)
 
     def update_problem_details(self, pid, data):
-        conn = self.get_conn()
-        # 🟢 增加 time_limit 更新
-        conn.execute('''UPDATE problems SET title=?, description=?, difficulty=?, knowledge_tag=?, sample_code=?, time_limit=? WHERE id=?''', 
-                     (data['title'], data['description'], data['difficulty'], data['category'], data['code'], data['time_limit'], pid))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            # 🟢 增加 time_limit 更新
+            conn.execute('''UPDATE problems SET title=?, description=?, difficulty=?, knowledge_tag=?, sample_code=?, time_limit=?, checker=?, checker_eps=?, revision=revision+1, updated_at=? WHERE id=?''', 
+                         (data['title'], data['description'], data['difficulty'], data['category'], data['code'], data['time_limit'],
+                          data.get('checker', DEFAULT_CHECKER), data.get('checker_eps', DEFAULT_EPS), time.time(), pid))
+            self._bump_test_version(conn, pid)
+            self._sync_tags(conn, [pid])
+            self._bump_catalog_version(conn)
+        self.catalog.invalidate(pid)
         
     def update_knowledge_tags(self, updates):
-        conn = self.get_conn()
-        for pid, tag in updates.items():
-            conn.execute("UPDATE problems SET knowledge_tag=? WHERE id=?", (tag, pid))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            now = time.time()
+            conn.executemany("UPDATE problems SET knowledge_tag=?, revision=revision+1, updated_at=? WHERE id=?", [(tag, now, pid) for pid, tag in updates.items()])
+            self._sync_tags(conn, list(updates))
+            self._bump_catalog_version(conn)
+        self.catalog.invalidate()
 
     def add_test_case(self, pid, input_data, output_data, is_sample=False):
-        conn = self.get_conn()
-        conn.execute("INSERT INTO test_cases (problem_id, input_data, output_data, is_sample) VALUES (?, ?, ?, ?)", 
-                     (pid, input_data, output_data, is_sample))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO test_cases (problem_id, input_data, output_data, is_sample) VALUES (?, ?, ?, ?)", 
+                         (pid, input_data, output_data, is_sample))
+            self._bump_test_version(conn, pid)
 
     def get_test_cases(self, pid):
         """获取该题目的所有测试点"""
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT input_data, output_data FROM test_cases WHERE problem_id=?", (pid,))
-        rows = cursor.fetchall()
-        conn.close()
+        rows = self.get_conn().execute("SELECT input_data, output_data FROM test_cases WHERE problem_id=? ORDER BY id", (pid,)).fetchall()
         return [{"input": r[0], "output": r[1]} for r in rows]
 
     def clear_test_cases(self, pid):
         """更新题目时先清空旧的测试点"""
-        conn = self.get_conn()
-        conn.execute("DELETE FROM test_cases WHERE problem_id=?", (pid,))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM test_cases WHERE problem_id=?", (pid,))
+            self._bump_test_version(conn, pid)
         
+    def retire_problems(self, source_repo, file_paths):
+        """仓库中已删除的文件：删除对应题目及其测试点 (提交记录保留)，返回删除的题目数"""
+        with self.transaction() as conn:
+            pids = []
+            for path in file_paths:
+                res = conn.execute("SELECT id FROM problems WHERE source_repo=? AND file_path=?", (source_repo, path)).fetchone()
+                if res:
+                    pids.append(res[0])
+            conn.executemany("DELETE FROM test_cases WHERE problem_id=?", [(pid,) for pid in pids])
+            conn.executemany("DELETE FROM verdict_cache WHERE problem_id=?", [(pid,) for pid in pids])
+            conn.executemany("DELETE FROM problems WHERE id=?", [(pid,) for pid in pids])
+            self._sync_tags(conn, pids)
+            if pids:
+                self._bump_catalog_version(conn)
+        if pids:
+            self.catalog.invalidate()
+        return len(pids)
+
+    def get_repo_last_commit(self, repo_url):
+        res = self.get_conn().execute("SELECT last_commit FROM repo_sync WHERE repo_url=?", (repo_url,)).fetchone()
+        return res[0] if res else None
+
+    def set_repo_last_commit(self, repo_url, commit):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO repo_sync (repo_url, last_commit, synced_at) VALUES (?, ?, ?)", (repo_url, commit, time.time()))
+
+    def get_problem_id_by_source(self, source_repo, file_path):
+        res = self.get_conn().execute("SELECT id FROM problems WHERE source_repo=? AND file_path=?", (source_repo, file_path)).fetchone()
+        return res[0] if res else None
+
+    # --- 判题结果缓存 (持久层) ---
+    def get_checker(self, pid):
+        """题目使用的输出检查器: (名称, eps)"""
+        res = self.get_conn().execute("SELECT checker, checker_eps FROM problems WHERE id=?", (pid,)).fetchone()
+        if res:
+            return res[0] or DEFAULT_CHECKER, (res[1] if res[1] is not None else DEFAULT_EPS)
+        return DEFAULT_CHECKER, DEFAULT_EPS
+
+    def get_judge_meta(self, pid):
+        """判题缓存 key 需要的题目信息: (time_limit, test_version)"""
+        res = self.get_conn().execute("SELECT time_limit, test_version FROM problems WHERE id=?", (pid,)).fetchone()
+        if res:
+            return (res[0] if res[0] else 2), (res[1] or 0)
+        return 2, 0
+
+    def get_cached_verdict(self, cache_key):
+        res = self.get_conn().execute("SELECT result FROM verdict_cache WHERE cache_key=?", (cache_key,)).fetchone()
+        return res[0] if res else None
+
+    def put_cached_verdict(self, cache_key, pid, result, max_rows):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO verdict_cache (cache_key, problem_id, result, created_at) VALUES (?, ?, ?, ?)",
+                         (cache_key, pid, result, time.time()))
+            # 控制持久层大小：只保留最新的 max_rows 条
+            conn.execute("DELETE FROM verdict_cache WHERE rowid <= (SELECT MAX(rowid) FROM verdict_cache) - ?", (max_rows,))
+
+# 每个公开方法的耗时 (连接 / 事务管理本身不计)
+DB_CALL_SECONDS = metrics.Histogram(
+    "pylearn_db_call_seconds", "Database 各方法的调用耗时", ["method"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+metrics.instrument_methods(Database, DB_CALL_SECONDS, exclude=("get_conn", "transaction", "close"))
+
 db = Database()
\ No newline at end of file
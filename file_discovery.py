@@ -0,0 +1,306 @@
+"""
+仓库文件发现：找出可以出题的 .py 文件。
+- os.scandir 迭代遍历 (每个文件只 stat 一次)，边走边产出结果，不会先把整个仓库的路径列表攒在内存里
+- 提前剪掉 .git / venv / node_modules / site-packages 等目录，并遵守各级 .gitignore
+- 路径级过滤 (文件名、大小) 在遍历线程里做；需要读文件内容的过滤 (能否通过语法检查) 分批交给线程池
+本模块只依赖标准库。
+"""
+import ast
+import os
+import re
+import stat
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 内容检查用线程池而不是进程池：扫描运行在多线程的 Web 服务进程里，fork 出的子进程可能继承别的线程持有的锁
+# (日志、sqlite、import 锁) 而卡死；spawn 又会在子进程里重新执行 __main__。
+# ast.parse 本身要持有 GIL，线程池主要让读文件的 IO 与解析重叠，并让遍历不必等检查完成。
+
+# 直接剪掉、不进入的目录 (版本库元数据、虚拟环境、第三方依赖、缓存)
+PRUNE_DIRS = {
+    ".git", ".hg", ".svn", "__pycache__", "node_modules", "site-packages", "dist-packages",
+    "venv", ".venv", "env", ".env", ".tox", ".nox", ".mypy_cache", ".pytest_cache", ".ruff_cache", ".eggs",
+}
+
+
+# --- .gitignore ---
+
+POSIX_CLASSES = {
+    "alpha": "a-zA-Z", "digit": "0-9", "alnum": "a-zA-Z0-9", "upper": "A-Z", "lower": "a-z",
+    "xdigit": "0-9a-fA-F", "space": r" \t\n\r\f\v", "blank": r" \t",
+    "punct": re.escape("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"),
+}
+
+
+def _char_class(pattern, start):
+    """
+    解析从 start 开始的 [...] 字符集 (! 或 ^ 取反、开头的 ] 是普通字符、a-z 范围、\\ 转义、[:alpha:] 等)，
+    返回 (正则, 结尾 ] 的下标)；没有闭合的 ] 时返回 (None, start)。和 git 一样，字符集永远不匹配 /
+    """
+    i = start + 1
+    negate = i < len(pattern) and pattern[i] in "!^"
+    if negate:
+        i += 1
+    items, first = [], True
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "]" and not first:
+            body = "".join(items)
+            if negate:
+                return f"[^/{body}]", i
+            return (f"(?!/)[{body}]" if body else "(?!)"), i
+        first = False
+        if c == "[" and pattern.startswith("[:", i):
+            end = pattern.find(":]", i + 2)
+            if end != -1 and pattern[i + 2:end] in POSIX_CLASSES:
+                items.append(POSIX_CLASSES[pattern[i + 2:end]])
+                i = end + 2
+                continue
+        if c == "\\" and i + 1 < len(pattern):
+            i += 1
+            c = pattern[i]
+        if i + 2 < len(pattern) and pattern[i + 1] == "-" and pattern[i + 2] != "]":
+            hi_at = i + 3 if pattern[i + 2] == "\\" and i + 3 < len(pattern) else i + 2
+            hi = pattern[hi_at]
+            if c <= hi:  # 反向范围不匹配任何字符
+                items.append(f"{re.escape(c)}-{re.escape(hi)}")
+            i = hi_at + 1
+            continue
+        items.append(re.escape(c))
+        i += 1
+    return None, start
+
+
+def _translate(pattern):
+    """把 gitignore 通配符转成正则：* 和 ? 不跨目录，** 可以跨任意层目录"""
+    i, out = 0, []
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            regex, end = _char_class(pattern, i)
+            if regex is None:
+                out.append(re.escape(c))  # 没有闭合的 [ 按普通字符处理
+            else:
+                out.append(regex)
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+class GitIgnore:
+    """
+    .gitignore 规则 (覆盖常用语法：注释、! 取反、结尾 / 只匹配目录、开头或中间的 / 表示相对 .gitignore 所在目录、**)。
+    每个目录的 .gitignore 只作用于该目录的子树，后出现的规则优先。
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)  # (base 目录的相对路径, 正则, 是否取反, 是否只匹配目录, 是否只匹配文件名)
+
+    def extended(self, base, path):
+        """读取 base 目录下的 .gitignore，返回叠加了新规则的 GitIgnore (文件不存在时返回自身)"""
+        try:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        rules = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            # 结尾的 / 只表示 "只匹配目录"，不算锚定；开头或中间的 / 才让规则相对 .gitignore 所在目录
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if line:
+                rules.append((base, _translate(line), negate, dir_only, not anchored))
+        return GitIgnore(self.rules + rules) if rules else self
+
+    def ignored(self, rel_path, is_dir):
+        result = False
+        for base, regex, negate, dir_only, name_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + "/"):
+                    continue
+                target = rel_path[len(base) + 1:]
+            else:
+                target = rel_path
+            if name_only:
+                target = target.rsplit("/", 1)[-1]
+            if regex.match(target):
+                result = not negate
+        return result
+
+
+# --- 过滤器 ---
+# 路径过滤器: (相对路径, 文件大小) -> bool，在遍历线程中执行
+# 内容过滤器: (源码文本) -> bool，在线程池中执行，必须是线程安全的
+
+def not_boilerplate(rel_path, size):
+    return os.path.basename(rel_path) not in ("__init__.py", "setup.py")
+
+
+def size_between(min_size, max_size):
+    """过滤过小或过大的文件"""
+    def check(rel_path, size):
+        return min_size <= size <= max_size
+    return check
+
+
+def is_valid_python(source):
+    """能通过语法检查 (ast.parse) 的文件才值得交给 AI 出题"""
+    try:
+        ast.parse(source)
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+def _check_chunk(root, rel_paths, content_filters):
+    """线程池 worker：读入一批文件，返回通过全部内容过滤器的相对路径"""
+    passed = []
+    for rel_path in rel_paths:
+        try:
+            with open(os.path.join(root, rel_path), "r", encoding="utf-8", errors="ignore") as f:
+                source = f.read()
+        except OSError:
+            continue
+        if all(check(source) for check in content_filters):
+            passed.append(rel_path)
+    return passed
+
+
+class FileDiscovery:
+    def __init__(self, root, path_filters=None, content_filters=None, workers=0, chunk_size=64):
+        self.root = root
+        self.path_filters = path_filters if path_filters is not None else [not_boilerplate]
+        self.content_filters = content_filters if content_filters is not None else [is_valid_python]
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.visited = 0  # 已遍历的文件数 (含被过滤掉的)
+
+    def _walk(self):
+        """深度优先遍历 root，产出通过路径过滤器的 .py 文件相对路径"""
+        stack = [("", GitIgnore().extended("", os.path.join(self.root, ".gitignore")))]
+        while stack:
+            rel_dir, ignore = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.root, rel_dir) if rel_dir else self.root))
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in PRUNE_DIRS or entry.name.endswith(".egg-info") or ignore.ignored(rel_path, True):
+                        continue
+                    subdirs.append(rel_path)
+                elif entry.name.endswith(".py") and entry.is_file(follow_symlinks=False):
+                    self.visited += 1
+                    if ignore.ignored(rel_path, False):
+                        continue
+                    size = entry.stat(follow_symlinks=False).st_size
+                    if all(check(rel_path, size) for check in self.path_filters):
+                        yield rel_path
+            for rel_path in reversed(sorted(subdirs)):
+                stack.append((rel_path, ignore.extended(rel_path, os.path.join(self.root, rel_path, ".gitignore"))))
+
+    def scan(self):
+        """遍历整个仓库，边扫描边产出可用文件的相对路径"""
+        return self._filter_content(self._walk())
+
+    def filter_paths(self, rel_paths):
+        """只检查给定的文件 (增量扫描时的改动列表)，规则与 scan 相同"""
+        ignores = {}
+
+        def ignore_for(rel_dir):
+            """逐级叠加 rel_dir 及其上级目录的 .gitignore (按目录缓存)"""
+            if rel_dir not in ignores:
+                parent = ignore_for(rel_dir.rpartition("/")[0]) if rel_dir else GitIgnore()
+                ignores[rel_dir] = parent.extended(rel_dir, os.path.join(self.root, rel_dir, ".gitignore"))
+            return ignores[rel_dir]
+
+        root = os.path.realpath(self.root)
+
+        def candidates():
+            for rel_path in rel_paths:
+                parts = rel_path.split("/")
+                if any(p in ("", ".", "..") for p in parts):
+                    continue
+                if any(p in PRUNE_DIRS or p.endswith(".egg-info") for p in parts[:-1]):
+                    continue
+                if any(ignore_for("/".join(parts[:i])).ignored("/".join(parts[:i + 1]), i < len(parts) - 1) for i in range(len(parts))):
+                    continue
+                # 与 scan 一样不跟随符号链接：文件本身或路径上任何一级目录是链接 (可能指向仓库外) 都跳过
+                full_path = os.path.join(root, *parts)
+                if os.path.realpath(full_path) != full_path:
+                    continue
+                try:
+                    st = os.lstat(full_path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                self.visited += 1
+                if all(check(rel_path, st.st_size) for check in self.path_filters):
+                    yield rel_path
+        return self._filter_content(candidates())
+
+    def _filter_content(self, candidates):
+        if not self.content_filters:
+            yield from candidates
+            return
+
+        chunk = []
+        pool = None
+        pending = set()
+        try:
+            for rel_path in candidates:
+                chunk.append(rel_path)
+                if len(chunk) < self.chunk_size:
+                    continue
+                if pool is None:
+                    if self.workers <= 1:
+                        yield from _check_chunk(self.root, chunk, self.content_filters)
+                        chunk = []
+                        continue
+                    # 文件足够多时才启动线程池
+                    pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan-check")
+                pending.add(pool.submit(_check_chunk, self.root, chunk, self.content_filters))
+                chunk = []
+                # 在途批次有上限：遍历速度快于检查速度时停下来等，内存占用不随仓库大小增长
+                done, pending = wait(pending, timeout=0 if len(pending) < self.workers * 2 else None, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield from fut.result()
+            if chunk:
+                yield from _check_chunk(self.root, chunk, self.content_filters)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield from fut.result()
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
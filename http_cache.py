@@ -0,0 +1,141 @@
+"""
+HTTP 缓存与压缩：
+- 根据题目修订号生成 ETag / Last-Modified，支持 If-None-Match / If-Modified-Since 条件请求 (304)
+- CompressionMiddleware：对超过阈值的 HTML / JSON 响应做 brotli (如已安装) 或 gzip 压缩
+"""
+import gzip
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+from config import HTTP_COMPRESS_MIN_SIZE, HTTP_GZIP_LEVEL, HTTP_BROTLI_QUALITY
+
+try:
+    import brotli  # 可选依赖：pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/html", "text/plain", "text/css", "application/json", "application/javascript")
+
+
+# --- 条件请求 ---
+
+def make_etag(*parts):
+    """弱 ETag：同一修订的内容在压缩 / 未压缩时语义相同"""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+def http_date(ts):
+    return formatdate(ts, usegmt=True) if ts else None
+
+
+def cache_headers(etag, last_modified=None, cache_control="no-cache"):
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def _strip_weak(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """If-None-Match 优先 (弱比较)；没有时才看 If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        target = _strip_weak(etag)
+        return any(_strip_weak(t) == target for t in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+# --- 压缩 ---
+
+def _choose_encoding(accept_encoding):
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=HTTP_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    纯 ASGI 中间件：只压缩一次性返回的响应体 (more_body=False)，
+    流式响应 (SSE、StreamingResponse) 原样透传，不会被缓冲。
+    """
+
+    def __init__(self, app, minimum_size=HTTP_COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict((k.lower(), v) for k, v in scope.get("headers", []))
+        encoding = _choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough or start_message is None:
+                return await send(message)
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            resp_headers = [(k, v) for k, v in start.get("headers", [])]
+            lowered = {k.lower(): v for k, v in resp_headers}
+            content_type = lowered.get(b"content-type", b"").decode("latin-1")
+
+            compressible = (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and b"content-encoding" not in lowered
+                and content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if not compressible:
+                passthrough = True
+                await send(start)
+                return await send(message)
+
+            compressed = _compress(body, encoding)
+            resp_headers = [(k, v) for k, v in resp_headers if k.lower() not in (b"content-length", b"vary")]
+            vary = lowered.get(b"vary")
+            resp_headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+            resp_headers.append((b"content-encoding", encoding.encode("latin-1")))
+            resp_headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+            await send(dict(start, headers=resp_headers))
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
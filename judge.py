@@ -0,0 +1,303 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import JUDGE_WORKERS, JUDGE_MAX_PENDING, JUDGE_CASE_WORKERS, JUDGE_STOP_ON_FIRST_FAILURE
+from database import db
+from sandbox import Sandbox, CompileError
+from checkers import make_checker, normalize_output
+from submission_sink import submission_sink
+from verdict_cache import verdict_cache
+import metrics
+from profiler import profiler
+from library_manager import lib_manager
+
+
+# 单个测试点的判定结果
+VERDICT_AC = "Accepted"
+VERDICT_WA = "Wrong Answer"
+VERDICT_RE = "Runtime Error"
+VERDICT_TLE = "Time Limit Exceeded"
+VERDICT_OLE = "Output Limit Exceeded"
+VERDICT_MLE = "Memory Limit Exceeded"
+VERDICT_SE = "System Error"
+VERDICT_CE = "Compile Error"
+VERDICT_SKIPPED = "Skipped"
+
+_STATUS_VERDICTS = {
+    "runtime_error": VERDICT_RE,
+    "timeout": VERDICT_TLE,
+    "output_limit": VERDICT_OLE,
+    "memory_limit": VERDICT_MLE,
+    "system_error": VERDICT_SE,
+    "cancelled": VERDICT_SKIPPED,
+    "aborted": VERDICT_WA,  # 检查器在运行中途已确定答案错误
+}
+
+CASE_VERDICTS = metrics.Counter("pylearn_judge_case_verdicts", "实际运行的测试点判定结果分布 (不含缓存命中)", ["verdict"])
+SUBMISSION_VERDICTS = metrics.Counter("pylearn_judge_submissions", "提交的最终判定 (第一个失败测试点的结果，全部通过为 Accepted)", ["verdict", "cached"])
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    "pylearn_judge_queue_wait_seconds", "提交在判题队列中等待空闲 worker 的时间",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+JUDGE_SECONDS = metrics.Histogram(
+    "pylearn_judge_seconds", "单个提交的判题耗时 (不含排队)", ["cached"],
+    buckets=(0.001, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+# 所有提交共享的测试点线程池：每个线程驱动一个沙箱子进程，限制全局同时运行的子进程数
+_case_executor = ThreadPoolExecutor(max_workers=max(1, JUDGE_CASE_WORKERS), thread_name_prefix="judge-case")
+
+
+def load_cases(problem_id: int):
+    """
+    优先使用 test_cases 表中的多组数据，没有时退回 problems 表里的单组数据
+    返回: (测试点列表, 时间限制, (检查器名, eps))
+    """
+    db_input, db_output, time_limit = db.get_test_data(problem_id)
+    cases = db.get_test_cases(problem_id)
+    if not cases:
+        cases = [{"input": db_input, "output": db_output}]
+        # 判空保护：如果数据库里完全没数据，给一个默认空输入
+        if not db_input and not db_output:
+            cases = [{"input": "\n", "output": ""}]
+    return cases, time_limit, db.get_checker(problem_id)
+
+
+def _run_case(code, case, time_limit, cancel, checker_spec):
+    """运行单个测试点并给出判定"""
+    # 预处理输入
+    real_input = case['input'].replace('\\n', '\n') if case['input'] else ""
+    if cancel.is_set():
+        return _skipped()
+
+    # 检查器边运行边比对 stdout，确定答案错误时沙箱立即 kill 子进程
+    checker = make_checker(checker_spec[0], case['output'], checker_spec[1])
+    result = Sandbox.run(code, real_input, timeout=time_limit, cancel=cancel, on_stdout=checker.feed)
+    if result["status"] == "success":
+        verdict = VERDICT_AC if checker.finish() else VERDICT_WA
+    else:
+        verdict = _STATUS_VERDICTS.get(result["status"], VERDICT_SE)
+    return {"verdict": verdict, "time_ms": result["time_ms"], "cpu_ms": result["cpu_ms"], "max_rss_kb": result["max_rss_kb"],
+            "stdout": result["stdout"], "stderr": result["stderr"]}
+
+
+def _skipped():
+    return {"verdict": VERDICT_SKIPPED, "time_ms": 0, "cpu_ms": None, "max_rss_kb": None, "stdout": "", "stderr": ""}
+
+
+def run_cases(code, cases, time_limit, stop_on_failure=True, checker_spec=(None, None)):
+    """
+    把一个提交的所有测试点并行分发到沙箱子进程中执行。
+    code: 源码字符串或 Sandbox.prepare 得到的 PreparedProgram
+    stop_on_failure: 任一测试点失败后取消其余测试点 (排队中的直接跳过，运行中的立即 kill)
+    checker_spec: (检查器名, eps)，None 表示默认的 exact
+    返回: 与 cases 一一对应的结果列表
+    """
+    cancel = threading.Event()
+    run_case = profiler.bind(_run_case)  # 被抽样剖析的请求：测试点线程也一起记录
+    futures = {_case_executor.submit(run_case, code, case, time_limit, cancel, checker_spec): idx for idx, case in enumerate(cases)}
+    results = [None] * len(cases)
+    for fut in as_completed(futures):
+        if fut.cancelled():
+            continue
+        idx = futures[fut]
+        results[idx] = fut.result()
+        if stop_on_failure and results[idx]["verdict"] not in (VERDICT_AC, VERDICT_SKIPPED):
+            cancel.set()
+            for other in futures:
+                other.cancel()
+    for idx, res in enumerate(results):
+        if res is None:  # 被取消、从未开始执行的测试点
+            results[idx] = _skipped()
+    return results
+
+
+def evaluate(problem_id: int, code: str, stop_on_failure: bool):
+    """
+    实际判题：运行所有测试点并汇总成 /run 的响应字典 (不写提交记录)
+    """
+    cases, time_limit, checker_spec = load_cases(problem_id)
+    total_cases = len(cases)
+
+    # 编译预检：语法错误当场返回，不启动任何子进程；编译通过的字节码由所有测试点共用
+    try:
+        program = Sandbox.prepare(code)
+    except CompileError as e:
+        return compile_error_response(e, total_cases)
+
+    print(f"🚀 开始判题 ID:{problem_id}, 共 {total_cases} 个测试点")
+    with program:
+        results = run_cases(program, cases, time_limit, stop_on_failure, checker_spec)
+    for r in results:
+        CASE_VERDICTS.labels(r["verdict"]).inc()
+    passed_cases = sum(1 for r in results if r["verdict"] == VERDICT_AC)
+    is_all_correct = (passed_cases == total_cases)
+
+    # 展示给学员的输出：第一个实际执行完的测试点
+    first_output = next((r["stdout"] for r in results if r["verdict"] != VERDICT_SKIPPED), "")
+    # 按测试点顺序找第一个失败点 (并行执行时完成顺序不确定，按编号报告更直观)
+    failed_idx = next((i for i, r in enumerate(results) if r["verdict"] not in (VERDICT_AC, VERDICT_SKIPPED)), None)
+
+    # 资源用量：CPU 时间为各测试点之和，墙钟时间和内存取最大的一个测试点
+    ran = [r for r in results if r["verdict"] != VERDICT_SKIPPED]
+    cpu = [r["cpu_ms"] for r in ran if r["cpu_ms"] is not None]
+    rss = [r["max_rss_kb"] for r in ran if r["max_rss_kb"] is not None]
+
+    response_data = {
+        "output": first_output,
+        "is_correct": is_all_correct,
+        "error": "",
+        "expected": "",
+        "passed": passed_cases,
+        "total": total_cases,
+        "cpu_ms": sum(cpu) if cpu else None,
+        "wall_ms": max((r["time_ms"] for r in ran), default=0),
+        "max_rss_kb": max(rss) if rss else None,
+        "cases": [{"index": i + 1, "verdict": r["verdict"], "time_ms": r["time_ms"], "cpu_ms": r["cpu_ms"], "max_rss_kb": r["max_rss_kb"]}
+                  for i, r in enumerate(results)],
+    }
+
+    if is_all_correct:
+        response_data["expected"] = "All Passed"
+        return response_data
+
+    failed = results[failed_idx] if failed_idx is not None else None
+    if failed and failed["verdict"] != VERDICT_WA:
+        # 运行出错 / 超时：直接把 stderr 返回给学员
+        response_data["output"] = failed["stdout"]
+        response_data["error"] = failed["stderr"] or failed["verdict"]
+        response_data["expected"] = failed["verdict"]
+        return response_data
+
+    err_msg = f"❌ 未通过。成功: {passed_cases}/{total_cases}。\n"
+    if failed:
+        case = cases[failed_idx]
+        expected = normalize_output(case['output'])
+        err_msg += f"在第 {failed_idx + 1} 组数据出错。\n"
+        err_msg += f"输入: {case['input']}\n"
+        err_msg += f"你的输出: {normalize_output(failed['stdout'])}\n"
+        err_msg += f"期望输出: {expected}"
+        response_data["expected"] = expected
+
+    response_data["error"] = err_msg
+    return response_data
+
+
+def compile_error_response(error, total_cases):
+    """编译错误的 /run 响应：带出错的行号 / 列号，所有测试点都不运行"""
+    return {
+        "output": "",
+        "is_correct": False,
+        "error": error.formatted,
+        "expected": VERDICT_CE,
+        "passed": 0,
+        "total": total_cases,
+        "cpu_ms": None,
+        "wall_ms": 0,
+        "max_rss_kb": None,
+        "compile_error": error.to_dict(),
+        "cases": [{"index": i + 1, "verdict": VERDICT_CE, "time_ms": 0, "cpu_ms": None, "max_rss_kb": None} for i in range(total_cases)],
+    }
+
+
+def _is_cacheable(response_data):
+    # 超时 / 系统错误与机器负载有关，不缓存，下次重新判
+    return not any(c["verdict"] in (VERDICT_TLE, VERDICT_SE) for c in response_data["cases"])
+
+
+def judge_submission(problem_id: int, code: str, stop_on_failure: bool = None):
+    """
+    同步判题流程 (在判题线程池中执行，不会阻塞事件循环)
+    相同代码 + 相同题目版本直接复用缓存的判题结果。
+    返回: /run 接口的响应字典
+    """
+    if stop_on_failure is None:
+        stop_on_failure = JUDGE_STOP_ON_FIRST_FAILURE
+
+    started = time.perf_counter()
+    time_limit, test_version = db.get_judge_meta(problem_id)
+    # 环境指纹：安装新库后变化，缺库导致的 Runtime Error 不会继续从缓存返回
+    cache_key = verdict_cache.make_key(code, problem_id, test_version, time_limit, stop_on_failure, lib_manager.registry.fingerprint)
+    response_data = verdict_cache.get(cache_key)
+    cached = response_data is not None
+    if cached:
+        response_data = dict(response_data, cached=True)
+    else:
+        response_data = evaluate(problem_id, code, stop_on_failure)
+        if _is_cacheable(response_data):
+            verdict_cache.put(cache_key, problem_id, response_data)
+    cached_label = "true" if cached else "false"
+    JUDGE_SECONDS.labels(cached_label).observe(time.perf_counter() - started)
+    verdict = next((c["verdict"] for c in response_data["cases"] if c["verdict"] not in (VERDICT_AC, VERDICT_SKIPPED)), VERDICT_AC)
+    SUBMISSION_VERDICTS.labels(verdict, cached_label).inc()
+
+    # 提交记录交给后台写入器批量落盘，不占用判题延迟
+    submission_sink.submit(problem_id, code, response_data["output"], response_data["error"], response_data["is_correct"], "",
+                           response_data.get("cpu_ms"), response_data.get("wall_ms"), response_data.get("max_rss_kb"))
+    return response_data
+
+
+class JudgeQueueFull(Exception):
+    """判题队列已满，调用方应返回 503 让客户端稍后重试"""
+
+
+class JudgeQueue:
+    """
+    有界判题队列：
+    - 最多 workers 个提交同时判题 (默认等于 CPU 核数)
+    - 最多 max_pending 个提交排队等待，超出时立即拒绝 (快速失败，不拖垮事件循环)
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="judge")
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.completed = 0
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "capacity": self.workers + self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def _run(self, fn, args, enqueued):
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - enqueued)
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def submit(self, fn, *args):
+        with self._lock:
+            if self.running + self.waiting >= self.workers + self.max_pending:
+                self.rejected += 1
+                raise JudgeQueueFull()
+            self.waiting += 1
+        loop = asyncio.get_running_loop()
+        # run_in_executor 不会带上 contextvars，剖析状态由 profiler.bind 显式带进判题线程
+        return await loop.run_in_executor(self._executor, self._run, profiler.bind(fn), args, time.perf_counter())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+judge_queue = JudgeQueue(JUDGE_WORKERS, JUDGE_MAX_PENDING)
+
+metrics.Gauge("pylearn_judge_queue_running", "正在判题的提交数", callback=lambda: judge_queue.running)
+metrics.Gauge("pylearn_judge_queue_waiting", "排队等待判题的提交数", callback=lambda: judge_queue.waiting)
+metrics.CounterFunc("pylearn_judge_queue_rejected", "队列已满被拒绝 (503) 的提交数", callback=lambda: judge_queue.rejected)
@@ -1,10 +1,317 @@
 import ast
+import hashlib
+import os
+import re
 import sys
+import time
+import inspect
+import itertools
+import pkgutil
+import sysconfig
+import threading
 import subprocess
+import importlib
 import importlib.util
+import importlib.metadata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PIP_WHEELHOUSE, PIP_OFFLINE, PIP_INDEX_URL, PIP_INSTALL_TIMEOUT, PIP_JOB_HISTORY
+
+
+def _stdlib_names():
+    """标准库顶层模块名 (3.10+ 直接用 sys.stdlib_module_names，3.9 扫描标准库目录)"""
+    names = getattr(sys, "stdlib_module_names", None)
+    if names is not None:
+        return set(names)
+    paths = sysconfig.get_paths()
+    dirs = [paths["stdlib"], paths["platstdlib"]]
+    dirs += [d + "/lib-dynload" for d in dirs]
+    return {m.name for m in pkgutil.iter_modules(dirs)}
+
+
+def _dist_key(dist):
+    return (dist.metadata["Name"] or "", dist.version)
+
+
+def _top_level_modules(dist):
+    """一个已安装的发行包提供了哪些顶层模块 (与 packages_distributions 的推断方式一致)"""
+    declared = dist.read_text("top_level.txt")
+    if declared:
+        return {name for name in declared.split() if name}
+    modules = set()
+    for f in dist.files or ():
+        parts = f.parts
+        if not parts or parts[0] in ("..", "__pycache__"):
+            continue
+        if len(parts) > 1:
+            if "." not in parts[0]:  # 跳过 xxx.dist-info / xxx.data 目录
+                modules.add(parts[0])
+        else:
+            name = inspect.getmodulename(parts[0])
+            if name:
+                modules.add(name)
+    return modules
+
+
+class ModuleRegistry:
+    """
+    已安装模块索引：启动时构建一次，之后所有依赖检查都是 O(1) 的字典查找。
+    - modules:  顶层 import 名 -> 提供它的 pip 包名列表 (来自已安装包的元数据)
+    - stdlib:   标准库和内置模块名
+    - extra:    sys.path 上没有包元数据的顶层模块 (手动拷贝的模块等)
+    pip 安装成功后调用 refresh()，只读取新出现 / 版本变化的包的元数据。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self.modules = {}
+        self.stdlib = set()
+        self.extra = set()
+        self._seen = set()  # 已索引的 (包名, 版本)
+        self._fingerprint = ""
+
+    def build(self):
+        with self._lock:
+            if self._built:
+                return
+            stdlib = _stdlib_names() | set(sys.builtin_module_names)
+            if hasattr(importlib.metadata, "packages_distributions"):
+                modules = {k: list(v) for k, v in importlib.metadata.packages_distributions().items()}
+                seen = {_dist_key(d) for d in importlib.metadata.distributions()}
+            else:
+                modules, seen = {}, set()
+                self._index_new(modules, seen)
+            extra = {m.name for m in pkgutil.iter_modules()}
+            self.stdlib, self.modules, self.extra, self._seen = stdlib, modules, extra, seen
+            self._update_fingerprint()
+            self._built = True
+            print(f"📚 [LibraryManager] 模块索引已建立: {len(modules)} 个第三方模块, {len(stdlib)} 个标准库模块")
+
+    @staticmethod
+    def _index_new(modules, seen):
+        """把 seen 里还没有的发行包加入索引，返回新增的包数"""
+        added = 0
+        for dist in importlib.metadata.distributions():
+            key = _dist_key(dist)
+            if key in seen:
+                continue
+            seen.add(key)
+            added += 1
+            for module in _top_level_modules(dist):
+                providers = modules.setdefault(module, [])
+                if key[0] not in providers:
+                    providers.append(key[0])
+        return added
+
+    def refresh(self, hint=None):
+        """
+        增量刷新 (pip install 之后调用)：只处理新增 / 升级的包。
+        hint: 刚安装的 import 名，元数据里找不到时 (例如包没有 RECORD) 再用 find_spec 确认一次
+        """
+        self.build()
+        importlib.invalidate_caches()
+        with self._lock:
+            added = self._index_new(self.modules, self._seen)
+            if hint and not self._known(hint):
+                try:
+                    if importlib.util.find_spec(hint) is not None:
+                        self.extra.add(hint)
+                except (ImportError, ValueError):
+                    pass
+            self._update_fingerprint()
+        return added
+
+    def _update_fingerprint(self):
+        items = sorted(f"{name}=={version}" for name, version in self._seen) + sorted(self.extra)
+        self._fingerprint = hashlib.sha1("\n".join(items).encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def fingerprint(self):
+        """
+        已安装环境的指纹 (包名 + 版本 + 无元数据的模块)：安装新库后改变。
+        由内容计算而不是计数器，进程重启或多个 worker 之间对同一个环境得到相同的值。
+        """
+        self.build()
+        return self._fingerprint
+
+    def _known(self, name):
+        return name in self.stdlib or name in self.modules or name in self.extra
+
+    def is_installed(self, name):
+        self.build()
+        return self._known(name)
+
+    def distribution(self, name):
+        """import 名对应的已安装 pip 包名，不是第三方包时返回 None"""
+        self.build()
+        providers = self.modules.get(name)
+        return providers[0] if providers else None
+
+
+def _canonical(name):
+    """PEP 503 包名归一化：Foo_Bar / foo.bar / FOO-bar 视为同一个包"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class InstallJob:
+    """一个后台 pip 安装任务；logs 只追加，前端按偏移量增量拉取"""
+
+    def __init__(self, job_id, lib_name, package):
+        self.id = job_id
+        self.lib_name = lib_name
+        self.package = package
+        self.status = "queued"  # queued / running / success / failed
+        self.message = ""
+        self.logs = []
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.status in ("success", "failed")
+
+    def log(self, line):
+        self.logs.append(line)
+
+    def to_dict(self, log_offset=0):
+        logs = self.logs
+        end = len(logs)
+        return {
+            "id": self.id,
+            "lib_name": self.lib_name,
+            "package": self.package,
+            "status": self.status,
+            "message": self.message,
+            "done": self.done,
+            "logs": logs[log_offset:end],
+            "log_offset": end,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class InstallJobManager:
+    """
+    后台安装队列：
+    - 同一个包同时只有一个进行中的任务，重复请求直接返回已有任务
+    - 单线程依次执行 (多个 pip 同时写同一个环境会互相破坏)
+    - 先用 --no-index 从本地 wheelhouse 安装；没有时 pip wheel 下载 / 构建到 wheelhouse 再装，
+      之后同样的包可离线、可重复地安装
+    """
+
+    def __init__(self, registry, wheelhouse=PIP_WHEELHOUSE, offline=PIP_OFFLINE):
+        self.registry = registry
+        self.wheelhouse = os.path.abspath(wheelhouse)
+        self.offline = offline
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pip-install")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = OrderedDict()  # id -> InstallJob，按创建顺序
+        self._active = {}           # 归一化包名 -> 进行中的任务
+        self._process = None
+        self._closed = False
+
+    def submit(self, lib_name, package):
+        """提交安装任务，返回 (任务, 是否新建)"""
+        key = _canonical(package)
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job, False
+            job = InstallJob(str(next(self._ids)), lib_name, package)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._trim()
+        self._executor.submit(self._run, job, key)
+        return job, True
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return [job.to_dict(log_offset=len(job.logs)) for job in reversed(list(self._jobs.values()))]
+
+    def _trim(self):
+        finished = [jid for jid, job in self._jobs.items() if job.done]
+        for jid in finished[:max(0, len(finished) - PIP_JOB_HISTORY)]:
+            del self._jobs[jid]
+
+    def _pip(self, job, args):
+        """运行一条 pip 命令，逐行把输出写进任务日志，返回退出码"""
+        cmd = [sys.executable, "-m", "pip", *args, "--disable-pip-version-check", "--progress-bar", "off"]
+        job.log("$ " + " ".join(cmd[1:]))
+        env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   env=env, text=True, encoding="utf-8", errors="replace", bufsize=1)
+        self._process = process
+        timer = threading.Timer(PIP_INSTALL_TIMEOUT, process.kill)
+        timer.start()
+        try:
+            for line in process.stdout:
+                job.log(line.rstrip())
+            rc = process.wait()
+        finally:
+            timer.cancel()
+            self._process = None
+        if rc < 0:
+            job.log(f"⏰ pip 运行超过 {PIP_INSTALL_TIMEOUT} 秒或服务正在退出，已终止")
+        return rc
+
+    def _install(self, job):
+        os.makedirs(self.wheelhouse, exist_ok=True)
+        local = ["--find-links", self.wheelhouse]
+        # 1. 只用本地 wheelhouse (不联网)
+        if os.listdir(self.wheelhouse):
+            job.log(f"📦 尝试从本地 wheelhouse 安装: {self.wheelhouse}")
+            if self._pip(job, ["install", "--no-index", *local, job.package]) == 0:
+                return True
+        if self.offline:
+            job.log("🚫 离线模式 (PYLEARN_PIP_OFFLINE=1)，wheelhouse 中没有可用的包")
+            return False
+        if self._closed:
+            return False
+        # 2. 下载 / 构建 wheel (含依赖) 到 wheelhouse，已有的 wheel 直接复用
+        job.log("🌐 下载并构建 wheel 到 wheelhouse...")
+        index = ["--index-url", PIP_INDEX_URL] if PIP_INDEX_URL else []
+        if self._pip(job, ["wheel", "--wheel-dir", self.wheelhouse, *local, *index, job.package]) != 0:
+            return False
+        # 3. 再从 wheelhouse 安装
+        return self._pip(job, ["install", "--no-index", *local, job.package]) == 0
+
+    def _run(self, job, key):
+        job.status = "running"
+        print(f"Installing: {job.lib_name} -> {job.package}...")
+        try:
+            ok = self._install(job)
+            if ok:
+                # 增量更新模块索引，下次依赖检查立即生效
+                self.registry.refresh(hint=job.lib_name)
+            job.message = f"Success ({job.package})" if ok else f"Installation Failed for '{job.package}'"
+            job.status = "success" if ok else "failed"
+        except Exception as e:
+            job.log(f"❌ {e}")
+            job.message = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop(key, None)
+            print(f"[LibraryManager] 安装任务 #{job.id} {job.package}: {job.status}")
+
+    def shutdown(self):
+        """服务退出：丢弃排队中的任务并终止正在运行的 pip"""
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        process = self._process
+        if process is not None:
+            process.kill()
+
 
 class LibraryManager:
     # --- 新增：常用库的 import 名到 pip 包名的映射 ---
+    # 已安装的库由 registry 从包元数据自动解析，这里只用于还没安装的库
     PKG_MAPPING = {
         "wx": "wxPython",
         "cv2": "opencv-python",
@@ -17,6 +324,10 @@ class LibraryManager:
         "dotenv": "python-dotenv"
     }
 
+    def __init__(self):
+        self.registry = ModuleRegistry()
+        self.jobs = InstallJobManager(self.registry)
+
     @staticmethod
     def get_imports(code: str):
         """解析代码中的所有 import 库名"""
@@ -31,50 +342,21 @@ class LibraryManager:
                 for alias in node.names:
                     imports.add(alias.name.split('.')[0])
             elif isinstance(node, ast.ImportFrom):
-                if node.module:
+                # level > 0 是相对导入 (from . import x)，不是外部依赖
+                if node.module and not node.level:
                     imports.add(node.module.split('.')[0])
         return imports
 
-    @staticmethod
-    def check_missing_libs(imports: set):
-        """检查哪些库在当前环境中未安装"""
-        missing = []
-        for lib in imports:
-            # 排除 Python 内置库
-            if lib in sys.builtin_module_names:
-                continue
-
-            try:
-                # 尝试查找模块规格
-                spec = importlib.util.find_spec(lib)
-                if spec is None:
-                    missing.append(lib)
-            except:
-                # 如果查找出错，也视为缺失，等待后续安装时处理
-                missing.append(lib)
-        return missing
-
-    @staticmethod
-    def install_lib(lib_name: str):
-        """调用 pip 安装库 (支持别名映射)"""
-        
-        # 1. 查表获取真实的 pip 包名
-        # 如果 lib_name 在映射表中，取映射值；否则默认使用 lib_name
-        real_pkg_name = LibraryManager.PKG_MAPPING.get(lib_name, lib_name)
+    def check_missing_libs(self, imports: set):
+        """检查哪些库在当前环境中未安装 (查索引，不再逐个 find_spec)"""
+        return sorted(lib for lib in imports if not self.registry.is_installed(lib))
 
-        print(f"Installing: {lib_name} -> {real_pkg_name}...") # 打印日志方便调试
+    def package_name(self, lib_name: str):
+        """import 名 -> pip 包名：已安装的从包元数据解析，否则查映射表，再否则原样使用"""
+        return self.registry.distribution(lib_name) or self.PKG_MAPPING.get(lib_name, lib_name)
 
-        try:
-            # 2. 指定清华源或其他国内源可加速下载 (可选，如果服务器在海外可去掉 -i 参数)
-            # subprocess.check_call([sys.executable, "-m", "pip", "install", real_pkg_name, "-i", "https://pypi.tuna.tsinghua.edu.cn/simple"])
-            
-            # 使用默认源安装
-            subprocess.check_call([sys.executable, "-m", "pip", "install", real_pkg_name])
-            
-            return True, f"Success ({real_pkg_name})"
-        except subprocess.CalledProcessError:
-            return False, f"Installation Failed for '{real_pkg_name}'"
-        except Exception as e:
-            return False, str(e)
+    def install_lib(self, lib_name: str):
+        """提交后台 pip 安装任务 (支持别名映射)，立即返回 (任务, 是否新建)"""
+        return self.jobs.submit(lib_name, self.package_name(lib_name))
 
-lib_manager = LibraryManager()
\ No newline at end of file
+lib_manager = LibraryManager()
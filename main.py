@@ -1,13 +1,25 @@
 from fastapi import FastAPI, Request, BackgroundTasks, HTTPException, Depends, status
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette.middleware.sessions import SessionMiddleware
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import asyncio
+import base64
+import json
+import os
 
 from database import db
-from sandbox import Sandbox
+from sandbox import fork_pool
+from judge import judge_queue, judge_submission, JudgeQueueFull
+from checkers import CHECKERS, DEFAULT_CHECKER, DEFAULT_EPS
+from verdict_cache import verdict_cache
+from submission_sink import submission_sink
+from http_cache import CompressionMiddleware, make_etag, cache_headers, is_not_modified
+from config import PROBLEM_PAGE_SIZE, PROBLEM_PAGE_MAX, SCAN_EVENTS_INTERVAL, SCAN_EVENTS_HEARTBEAT, METRICS_TOKEN
+import metrics
+from profiler import profiler, ProfilingMiddleware, SORT_KEYS
 from ai_service import ai
 from crawler import crawler_service
 from library_manager import lib_manager
@@ -18,12 +30,46 @@ app = FastAPI(title="PyLearn AI Platform")
 # ⚠️ 生产环境请修改 secret_key 为随机长字符串
 app.add_middleware(SessionMiddleware, secret_key="YOUR_SUPER_SECRET_KEY")
 
+# --- 响应压缩 (超过阈值的 HTML / JSON 使用 brotli 或 gzip) ---
+app.add_middleware(CompressionMiddleware)
+
+# --- 按需剖析 (默认关闭，管理员在 /admin/profiling 开启) ---
+app.add_middleware(ProfilingMiddleware)
+
+# --- 请求指标 (最外层，耗时包含压缩) ---
+app.add_middleware(metrics.MetricsMiddleware)
+
 templates = Jinja2Templates(directory="templates")
+INDEX_TEMPLATE_MTIME = os.path.getmtime(os.path.join("templates", "index.html"))
+
+# --- 生命周期 ---
+@app.on_event("startup")
+def warm_sandbox():
+    # 启动时预热 zygote 进程池，避免第一个提交承担库导入的开销
+    if fork_pool is not None:
+        fork_pool.start()
+    submission_sink.start()
+    # 已安装模块索引，依赖检查直接查表
+    lib_manager.registry.build()
+
+@app.on_event("shutdown")
+def stop_sandbox():
+    judge_queue.shutdown()
+    # 判题线程全部结束后再停写入器，确保缓冲区里的提交记录全部落盘
+    submission_sink.stop()
+    if fork_pool is not None:
+        fork_pool.shutdown()
+    lib_manager.jobs.shutdown()
+
+@app.on_event("shutdown")
+async def close_ai_client():
+    await ai.close()
 
 # --- Pydantic Models ---
 class RunRequest(BaseModel):
     problem_id: int
     code: str
+    stop_on_failure: Optional[bool] = None  # 为空时使用 config 中的默认值
 
 class ChatRequest(BaseModel):
     message: str
@@ -33,9 +79,11 @@ class ChatRequest(BaseModel):
 
 class ScanRequest(BaseModel):
     url: str
+    changed_only: bool = True  # 导入过的仓库只列出上次导入后改动的文件
 
 class ImportRequest(BaseModel):
     indices: List[int]
+    bypass_cache: bool = False  # True 时忽略 AI 出题缓存，强制重新生成
 
 class UpdateProblemRequest(BaseModel):
     id: int
@@ -45,10 +93,19 @@ class UpdateProblemRequest(BaseModel):
     category: str
     code: str
     time_limit: int =2
+    checker: str = DEFAULT_CHECKER
+    checker_eps: float = DEFAULT_EPS
 
 class InstallLibRequest(BaseModel):
     lib_name: str
 
+class ProfilingRequest(BaseModel):
+    rate: Optional[float] = None  # 抽样比例 0~1，默认指定 route 时 1.0，否则 0.1
+    route: Optional[str] = None   # 只抽样该路由，如 /run 或 /api/problems/{pid}
+    memory: bool = False          # 同时开启 tracemalloc 统计内存分配位置
+    duration: float = 300         # 持续秒数，到期自动停止
+    max_samples: int = 200
+
 # --- 鉴权依赖 ---
 def get_current_user(request: Request):
     user = request.session.get("user")
@@ -62,29 +119,20 @@ def admin_required(request: Request):
         raise HTTPException(status_code=302, detail="Unauthorized", headers={"Location": "/login"})
     return user
 
-# --- 核心逻辑补充：标准化输出函数 ---
-def normalize_output(text: str) -> str:
-    """
-    标准化输出结果，用于对比答案：
-    1. 统一换行符 (\r\n -> \n)
-    2. 去除首尾空白
-    3. (可选) 清理可能存在的 markdown 代码块标记，防止 AI 生成的数据带格式导致判错
-    """
-    if not text:
-        return ""
-    
-    # 基础清洗
-    text = text.strip().replace("\r\n", "\n")
-    
-    # 容错处理：如果数据库中的 expected_output 包含了 markdown 标记 (```text ... ```)
-    # 我们尝试剥离它
-    if text.startswith("```"):
-        lines = text.splitlines()
-        # 如果是多行且首尾都是 ```，则取中间内容
-        if len(lines) >= 2 and "```" in lines[-1]:
-            text = "\n".join(lines[1:-1])
-            
-    return text.strip()
+# --- 分页游标 ---
+# 游标是上一页最后一条的 (difficulty, id)，对客户端不透明
+def encode_cursor(after):
+    if after is None:
+        return None
+    return base64.urlsafe_b64encode(f"{after[0]}:{after[1]}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        difficulty, pid = raw.split(":")
+        return int(difficulty), int(pid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
 
 # --- 登录页面 & API ---
 
@@ -109,112 +157,114 @@ async def logout(request: Request):
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    problems = db.get_all_problems()
     user = request.session.get("user")
-    return templates.TemplateResponse("index.html", {"request": request, "problems": problems, "user": user})
+    # 页面内容只取决于题库版本、当前用户和模板本身
+    etag = make_etag("index", db.get_cached_catalog_version(), user, INDEX_TEMPLATE_MTIME)
+    headers = cache_headers(etag, cache_control="private, no-cache")
+    headers["Vary"] = "Cookie"
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    # 只渲染第一页，其余由前端滚动时通过 /api/problems 按游标加载
+    problems, after = db.first_page(PROBLEM_PAGE_SIZE)
+    return templates.TemplateResponse("index.html", {"request": request, "problems": problems, "next_cursor": encode_cursor(after), "user": user}, headers=headers)
+
+@app.get("/api/problems")
+def list_problems_api(cursor: Optional[str] = None, limit: int = PROBLEM_PAGE_SIZE, tag: Optional[str] = None,
+                      difficulty: Optional[int] = None, source: Optional[str] = None, q: Optional[str] = None):
+    """
+    题目列表 / 搜索：keyset 分页，按 (难度, ID) 排序。
+    q 在标题、描述、示例代码中全文搜索；tag / difficulty / source 为过滤条件。
+    返回的 next_cursor 原样传回即可取下一页，为 null 表示已到最后一页。
+    """
+    limit = max(1, min(limit, PROBLEM_PAGE_MAX))
+    if not (cursor or tag or difficulty is not None or source or q):
+        items, next_after = db.first_page(limit)  # 与首页相同，走题库缓存
+    else:
+        after = decode_cursor(cursor) if cursor else None
+        items, next_after = db.list_problems(limit, after, tag=tag, difficulty=difficulty, source=source, query=q)
+    return {"items": items, "next_cursor": encode_cursor(next_after)}
 
 @app.get("/problem/{pid}")
-async def get_problem(pid: int):
+async def get_problem(pid: int, request: Request):
     detail = db.get_problem_detail(pid)
-    return {"detail": detail}
+    if detail is None:
+        return {"detail": detail}
+    etag = make_etag("problem", pid, detail["revision"])
+    headers = cache_headers(etag, detail["updated_at"])
+    if is_not_modified(request, etag, detail["updated_at"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"detail": detail}, headers=headers)
 
 @app.post("/run")
 async def run_code(req: RunRequest):
-    # --- 🟢 [修改开始] 数据获取适配部分 🟢 ---
-    
-    # 1. 从数据库获取单组测试数据和时间限制
-    # 注意：这里调用的是 database.py 中修改后的 get_test_data，它返回 (input, output, time_limit)
-    # 这样就能获取到 time_limit 变量，供下面的 Sandbox.run 使用
-    db_input, db_output, time_limit = db.get_test_data(req.problem_id)
-    
-    # 2. 将单组数据封装成列表，适配下方的循环逻辑
-    # (如果未来您实现了 get_test_cases，可以直接替换这里)
-    cases = [{"input": db_input, "output": db_output}]
-    
-    # 判空保护：如果数据库里完全没数据，给一个默认空输入
-    if not db_input and not db_output:
-         cases = [{"input": "\n", "output": ""}]
-    
-    # --- 🟢 [修改结束] 下面完全保留您的循环逻辑 🟢 ---
-
-    total_cases = len(cases)
-    passed_cases = 0
-    first_error = None
-    first_output = None 
-    
-    print(f"🚀 开始判题 ID:{req.problem_id}, 共 {total_cases} 个测试点")
-
-    # 3. 循环判题
-    for idx, case in enumerate(cases):
-        # 预处理输入
-        real_input = case['input'].replace('\\n', '\n') if case['input'] else ""
-        
-        # 运行沙箱 (🟢 此时 time_limit 变量已在上面定义，不会报错了)
-        result = Sandbox.run(req.code, real_input, timeout=time_limit)
-        
-        # 记录第一组输出
-        if idx == 0:
-            first_output = result["stdout"]
-            if result["status"] != "success":
-                return {
-                    "output": result["stdout"],
-                    "error": result["stderr"],
-                    "is_correct": False,
-                    "expected": "Runtime Error"
-                }
-
-        # 标准化对比
-        user_out = normalize_output(result["stdout"])
-        std_out = normalize_output(case['output'])
-        
-        if user_out == std_out:
-            passed_cases += 1
-        else:
-            if first_error is None:
-                first_error = {
-                    "case_idx": idx + 1,
-                    "input": case['input'],
-                    "user_out": user_out,
-                    "expected": std_out
-                }
-
-    # 4. 汇总结果
-    is_all_correct = (passed_cases == total_cases)
-    
-    response_data = {
-        "output": first_output, 
-        "is_correct": is_all_correct,
-        "error": "",
-        "expected": ""
-    }
-
-    if is_all_correct:
-        response_data["expected"] = "All Passed"
-        db.save_submission(req.problem_id, req.code, first_output, "", True, "")
-    else:
-        err_msg = f"❌ 未通过。成功: {passed_cases}/{total_cases}。\n"
-        if first_error:
-            err_msg += f"在第 {first_error['case_idx']} 组数据出错。\n"
-            err_msg += f"输入: {first_error['input']}\n"
-            err_msg += f"你的输出: {first_error['user_out']}\n"
-            err_msg += f"期望输出: {first_error['expected']}"
-        
-        response_data["error"] = err_msg
-        response_data["expected"] = first_error['expected'] if first_error else ""
-        
-        db.save_submission(req.problem_id, req.code, first_output, err_msg, False, "")
-
-    return response_data
-
-@app.post("/chat")
-async def chat_with_ai(req: ChatRequest):
+    # 判题 (沙箱执行 + 写提交记录) 都是阻塞操作，交给有界判题队列在线程池中执行，
+    # 事件循环在此期间可以继续处理页面加载、/chat 等其他请求
+    try:
+        return await judge_queue.submit(judge_submission, req.problem_id, req.code, req.stop_on_failure)
+    except JudgeQueueFull:
+        stats = judge_queue.stats()
+        raise HTTPException(
+            status_code=503,
+            detail=f"判题队列已满 ({stats['running']} 运行中, {stats['waiting']} 排队中)，请稍后重试",
+            headers={"Retry-After": "2"},
+        )
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus 文本格式的运行指标 (判题 / 沙箱 / 数据库 / AI / HTTP)"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="需要 metrics token")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/judge/status")
+async def judge_status():
+    """判题队列深度与判题缓存命中情况，用于监控与前端提示"""
+    return {**judge_queue.stats(), "verdict_cache": verdict_cache.stats(), "submission_sink": submission_sink.stats()}
+
+def build_chat_context(req: ChatRequest):
     detail = db.get_problem_detail(req.problem_id)
-    context = f"当前题目：{detail['title']}\n"
+    context = f"当前题目：{detail['title'] if detail else ''}\n"
     if req.code_context: context += f"\n用户代码：\n{req.code_context}\n"
     if req.error_context: context += f"\n报错：\n{req.error_context}\n"
-    reply = ai.chat(req.message, context)
+    return context
+
+@app.post("/chat")
+async def chat_with_ai(req: ChatRequest):
+    reply = await ai.chat(req.message, build_chat_context(req))
     return {"reply": reply}
 
+def sse_event(data, event=None, event_id=None):
+    head = f"event: {event}\n" if event else ""
+    if event_id is not None:
+        head += f"id: {event_id}\n"
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, request: Request):
+    """
+    流式对话 (Server-Sent Events)：
+    data: {"delta": "..."}  逐段输出；event: done 正常结束；event: error 出错
+    浏览器断开后停止读取并关闭上游连接，不再为没人看的回答消耗 token。
+    """
+    context = build_chat_context(req)
+
+    async def events():
+        stream = ai.chat_stream(req.message, context)
+        try:
+            async for delta in stream:
+                if await request.is_disconnected():
+                    print("💬 [Chat] 客户端已断开，取消上游生成")
+                    return
+                yield sse_event({"delta": delta})
+            yield sse_event({}, event="done")
+        except Exception as e:
+            yield sse_event({"error": f"连接失败: {e}"}, event="error")
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- 管理路由 (需要鉴权) ---
 
 @app.get("/admin", response_class=HTMLResponse)
@@ -230,30 +280,69 @@ async def admin_page(request: Request):
 @app.post("/admin/scan")
 async def start_scan(req: ScanRequest, bg_tasks: BackgroundTasks, user=Depends(admin_required)):
     if crawler_service.is_busy: return {"status": "busy", "msg": "忙碌中"}
-    bg_tasks.add_task(crawler_service.scan_structure, req.url)
+    bg_tasks.add_task(crawler_service.scan_structure, req.url, req.changed_only)
     return {"status": "ok"}
 
 @app.get("/admin/scan_status")
-async def get_scan_status(user=Depends(admin_required)):
-    files = []
-    for i, f in enumerate(crawler_service.found_files): files.append({"index": i, "path": f})
-    return {"is_busy": crawler_service.is_busy, "logs": crawler_service.logs, "files": files, "has_repo": crawler_service.temp_repo_path is not None}
+async def get_scan_status(generation: Optional[int] = None, log_offset: int = 0, file_offset: int = 0, user=Depends(admin_required)):
+    """扫描 / 导入进度：带上次返回的 generation 与偏移量时只返回新增部分，不带时返回全部"""
+    return crawler_service.status_since(generation, log_offset, file_offset)
+
+@app.get("/admin/scan_events")
+async def scan_events(request: Request, generation: Optional[int] = None, log_offset: int = 0, file_offset: int = 0, user=Depends(admin_required)):
+    """
+    扫描 / 导入进度的 SSE 推送：状态有变化时推送一条增量 (格式同 /admin/scan_status)。
+    事件 id 即游标，浏览器 EventSource 断线重连时通过 Last-Event-ID 自动从断点继续。
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            generation, log_offset, file_offset = (int(x) for x in last_event_id.split(":"))
+        except ValueError:
+            pass
+
+    async def events():
+        cursor = (generation, log_offset, file_offset)
+        last_state = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            status = crawler_service.status_since(*cursor)
+            state = (status["generation"], status["log_offset"], status["file_offset"], status["is_busy"], status["has_repo"])
+            if state != last_state:
+                cursor = state[:3]
+                last_state = state
+                idle = 0.0
+                yield sse_event(status, event_id=":".join(str(x) for x in cursor))
+            elif idle >= SCAN_EVENTS_HEARTBEAT:
+                idle = 0.0
+                yield ": ping\n\n"
+            await asyncio.sleep(SCAN_EVENTS_INTERVAL)
+            idle += SCAN_EVENTS_INTERVAL
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/admin/import")
 async def process_files(req: ImportRequest, bg_tasks: BackgroundTasks, user=Depends(admin_required)):
     if crawler_service.is_busy: return {"status": "busy"}
-    bg_tasks.add_task(crawler_service.process_selected, req.indices)
+    bg_tasks.add_task(profiler.bind(crawler_service.process_selected), req.indices, req.bypass_cache)
     return {"status": "ok"}
 
 @app.post("/admin/update_problem")
 async def update_problem_api(req: UpdateProblemRequest, user=Depends(admin_required)):
+    if req.checker not in CHECKERS:
+        raise HTTPException(status_code=400, detail=f"未知的检查器: {req.checker}")
+    if not req.checker_eps >= 0:
+        raise HTTPException(status_code=400, detail="误差必须是非负数")
     db.update_problem_details(req.id, {
         "title": req.title, 
         "description": req.description, 
         "difficulty": req.difficulty, 
         "category": req.category, 
         "code": req.code,
-        "time_limit": req.time_limit
+        "time_limit": req.time_limit,
+        "checker": req.checker,
+        "checker_eps": req.checker_eps,
     })
     return {"status": "ok"}
 
@@ -268,15 +357,48 @@ async def delete_problem(pid: int, user=Depends(admin_required)):
 async def check_dependencies(req: RunRequest, user=Depends(admin_required)):
     imports = lib_manager.get_imports(req.code)
     missing = lib_manager.check_missing_libs(imports)
-    return {"missing": list(missing)}
+    return {"missing": missing, "packages": {lib: lib_manager.package_name(lib) for lib in missing}}
 
 @app.post("/admin/install_lib")
 async def install_lib(req: InstallLibRequest, user=Depends(admin_required)):
-    success, msg = lib_manager.install_lib(req.lib_name)
-    if success:
-        return {"status": "ok", "msg": f"{req.lib_name} 安装成功"}
-    else:
-        return {"status": "error", "msg": f"安装失败: {msg}"}
+    """提交后台安装任务，立即返回任务 id；同一个包已在安装时返回已有任务"""
+    job, created = lib_manager.install_lib(req.lib_name)
+    return {"status": "ok", "job_id": job.id, "created": created, "package": job.package,
+            "msg": f"{req.lib_name} 已加入安装队列" if created else f"{job.package} 正在安装中"}
+
+@app.get("/admin/install_jobs")
+async def list_install_jobs(user=Depends(admin_required)):
+    """最近的安装任务 (不含日志)"""
+    return {"jobs": lib_manager.jobs.list()}
+
+@app.get("/admin/install_jobs/{job_id}")
+async def get_install_job(job_id: str, log_offset: int = 0, user=Depends(admin_required)):
+    """安装任务状态：只返回 log_offset 之后新增的 pip 日志，返回的 log_offset 下次原样带回"""
+    job = lib_manager.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="安装任务不存在")
+    return job.to_dict(log_offset)
+
+# --- 按需剖析 ---
+
+@app.post("/admin/profiling/start")
+async def start_profiling(req: ProfilingRequest, user=Depends(admin_required)):
+    if req.rate is not None and not 0 <= req.rate <= 1:
+        raise HTTPException(status_code=400, detail="rate 必须在 0 到 1 之间")
+    profiler.start(req.rate, req.route, req.memory, req.duration, req.max_samples)
+    return {"status": "ok", "config": profiler.config}
+
+@app.post("/admin/profiling/stop")
+async def stop_profiling(top: int = 30, sort: str = "cumulative", user=Depends(admin_required)):
+    profiler.stop()
+    return profiler.report(top, sort)
+
+@app.get("/admin/profiling")
+async def profiling_report(top: int = 30, sort: str = "cumulative", user=Depends(admin_required)):
+    """汇总的热点函数 (sort: cumulative / tottime / calls) 与内存分配位置，以及已写出的 pstats 文件"""
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort 只能是 {', '.join(SORT_KEYS)}")
+    return profiler.report(top, sort)
 
 if __name__ == "__main__":
     import uvicorn
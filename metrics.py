@@ -0,0 +1,315 @@
+"""
+运行指标：计数器 / 直方图 / 仪表盘，按 Prometheus 文本格式 (text/plain; version=0.0.4) 从 /metrics 导出。
+不依赖 prometheus_client；各模块在自己的文件里定义用到的指标，例如:
+
+    RUNS = metrics.Histogram("pylearn_sandbox_run_seconds", "...", ["mode", "status"], buckets=...)
+    RUNS.labels("fork", "success").observe(0.03)
+
+热路径上的开销只有一次字典查找 + 一把锁 (labels() 的结果可以提前取好复用)。
+本地验证: curl -s localhost:8000/metrics | grep pylearn_
+"""
+import bisect
+import functools
+import inspect
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render():
+    return REGISTRY.render()
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """取得一组标签值对应的子指标 (首次使用时创建)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际传入 {values}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(v) for v in values), self._new_child())
+                self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        # 同一个子指标可能同时以原始值和字符串值为键缓存，导出时去重
+        seen = set()
+        with self._lock:
+            items = list(self._children.items())
+        for values, child in items:
+            if id(child) in seen:
+                continue
+            seen.add(id(child))
+            yield list(zip(self.labelnames, (str(v) for v in values))), child
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """只增不减的计数器；导出时自动加 _total 后缀"""
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for labels, child in self._items():
+            yield "_total", labels, child.value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    """
+    可增可减的数值。callback: 可选，导出时才调用，返回当前值；
+    有标签时返回 {标签值元组: 值}，适合直接读取已有的统计 (队列深度等)，平时零开销。
+    """
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, callback=None):
+        self.callback = callback
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def samples(self):
+        if self.callback is None:
+            for labels, child in self._items():
+                yield "", labels, child.value
+            return
+        value = self.callback()
+        if not self.labelnames:
+            yield "", [], value
+            return
+        for values, v in value.items():
+            yield "", list(zip(self.labelnames, (str(x) for x in values))), v
+
+
+class CounterFunc(Gauge):
+    """由回调提供数值的计数器 (例如对象里已有的累计计数)"""
+    type = "counter"
+
+    def samples(self):
+        for suffix, labels, value in super().samples():
+            yield "_total", labels, value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一格是 +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)  # le 语义：value <= 上界
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    """耗时等分布；buckets 为各桶上界 (秒)，导出 _bucket / _sum / _count"""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for labels, child in self._items():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", labels + [("le", _format_value(bound))], cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+def instrument_methods(cls, histogram, exclude=()):
+    """
+    给类的所有公开方法套上计时：histogram 需要一个标签 (方法名)。
+    生成器 / 上下文管理器类的方法 (调用时并未真正执行) 请放进 exclude。
+    """
+    for name, fn in list(vars(cls).items()):
+        if name.startswith("_") or name in exclude or not inspect.isfunction(fn):
+            continue
+        setattr(cls, name, _timed(fn, histogram.labels(name)))
+    return cls
+
+
+def _timed(fn, child):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - started)
+    return wrapper
+
+
+# --- HTTP 请求 ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "pylearn_http_request_seconds", "HTTP 请求处理耗时 (到响应体发送完毕；SSE 等长连接按整个连接计)",
+    ["method", "route", "status"],
+)
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：按路由模板 (/api/problem/{pid}，而不是具体路径) 统计请求数和耗时，
+    未匹配到路由的请求统一记为 <unmatched>，避免标签基数失控。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, status).observe(time.perf_counter() - started)
@@ -0,0 +1,294 @@
+"""
+按需请求剖析 (管理员在后台开启，默认关闭)：
+- 按比例 (或只针对某个路由) 抽样请求，用 cProfile 记录函数耗时，可选用 tracemalloc 记录内存分配位置
+- 抽中的请求会把剖析状态通过 contextvar 带进判题 / 测试点 / 导入线程 (bind)，这些线程各自开一个 cProfile，
+  结束后合并到同一份结果里
+- 每个抽样请求写一份 pstats 文件 (PROFILE_DIR)，停止时再写一份汇总，可用 `python -m pstats xxx.prof` 或 snakeviz 查看
+
+关闭时的开销：中间件只读一个布尔值，bind() 只读一次 contextvar，原样返回函数。
+注意：事件循环线程上的 cProfile 会把同一时间段内其他协程的耗时也算进来，同一时间最多一个抽样请求占用它。
+"""
+import contextvars
+import cProfile
+import functools
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+
+from config import PROFILE_DIR, PROFILE_TOP_N, PROFILE_MAX_DURATION, PROFILE_TRACEMALLOC_FRAMES
+
+_current = contextvars.ContextVar("pylearn_profile_sample", default=None)
+_local = threading.local()  # active: 当前线程是否已经在被 cProfile 记录
+
+SORT_KEYS = {"cumulative": 3, "tottime": 2, "calls": 1}
+
+
+def _route_regex(route):
+    """/api/problems/{pid} -> /api/problems/[^/]+ (整体匹配)；不带 {} 的按原样精确匹配"""
+    parts = re.split(r"(\{[^}]+\})", route)
+    return re.compile("".join("[^/]+" if p.startswith("{") else re.escape(p) for p in parts))
+
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_")[:60] or "root"
+
+
+class ProfileSample:
+    """一个被抽中的请求：收集它用到的各个线程的 cProfile"""
+
+    def __init__(self, owner, method, path):
+        self.owner = owner
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.profiles = []
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            if not self.finished:
+                self.profiles.append(profile)
+                return
+        # 请求已经返回 (例如还在跑的后台线程)，直接并入汇总
+        self.owner._merge([profile])
+
+
+def _enable(profile):
+    try:
+        profile.enable()
+        return True
+    except ValueError:
+        return False  # 其他剖析工具已经占用了当前线程
+
+
+def _run_bound(sample, fn, *args, **kwargs):
+    token = _current.set(sample)
+    profile = None
+    if not getattr(_local, "active", False):
+        profile = cProfile.Profile()
+        if _enable(profile):
+            _local.active = True
+        else:
+            profile = None
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if profile is not None:
+            profile.disable()
+            _local.active = False
+            sample.add(profile)
+        _current.reset(token)
+
+
+class RequestProfiler:
+    def __init__(self, dump_dir=PROFILE_DIR):
+        self.dump_dir = dump_dir
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._loop_busy = False
+        self._stats = None
+        self._memory_started = False
+        self._baseline = None
+        self._last_memory = None
+        self.config = {}
+        self.samples = 0
+        self.by_route = {}
+        self.dumps = []
+        self.started_at = None
+        self.deadline = 0.0
+        self._route_re = None
+
+    # --- 开关 ---
+
+    def start(self, rate=None, route=None, memory=False, duration=300, max_samples=200):
+        """
+        开始抽样。rate: 抽样比例 (0~1，默认指定 route 时 1.0、否则 0.1)；
+        route: 只抽样匹配的路由 (可用 /api/problems/{pid} 这样的模板)；memory: 同时开启 tracemalloc
+        """
+        self.stop()
+        rate = (1.0 if route else 0.1) if rate is None else min(1.0, max(0.0, rate))
+        duration = min(max(1.0, duration), PROFILE_MAX_DURATION)
+        with self._lock:
+            self._stats = None
+            self.samples = 0
+            self.by_route = {}
+            self.dumps = []
+            self._last_memory = None
+            self.config = {"rate": rate, "route": route, "memory": memory, "duration": duration, "max_samples": max_samples}
+            self._route_re = _route_regex(route) if route else None
+            self.started_at = time.time()
+            self.deadline = time.monotonic() + duration
+            if memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+                    self._memory_started = True
+                self._baseline = tracemalloc.take_snapshot()
+            os.makedirs(self.dump_dir, exist_ok=True)
+            self.enabled = True
+        print(f"🔬 [Profiler] 开始抽样: {self.config}")
+
+    def stop(self):
+        """停止抽样，写出汇总的 pstats 文件；已收集的结果保留到下次 start"""
+        with self._lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            if self._baseline is not None:
+                self._last_memory = self._memory_report(PROFILE_TOP_N)
+                self._baseline = None
+            if self._memory_started:
+                tracemalloc.stop()
+                self._memory_started = False
+            if self._stats is not None:
+                path = os.path.join(self.dump_dir, f"aggregate-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+                self._stats.dump_stats(path)
+                self.dumps.append(path)
+        print(f"🔬 [Profiler] 已停止，共抽样 {self.samples} 个请求")
+
+    # --- 抽样 ---
+
+    def choose(self, method, path):
+        if time.monotonic() > self.deadline or self.samples >= self.config["max_samples"]:
+            self.stop()
+            return False
+        if self._route_re is not None and not self._route_re.fullmatch(path):
+            return False
+        return random.random() < self.config["rate"]
+
+    def begin(self, method, path):
+        """开始记录一个请求，返回 (sample, 事件循环线程上的 cProfile 或 None)"""
+        sample = ProfileSample(self, method, path)
+        loop_profile = None
+        with self._lock:
+            if not self._loop_busy and not getattr(_local, "active", False):
+                self._loop_busy = True
+                loop_profile = cProfile.Profile()
+        if loop_profile is not None:
+            if _enable(loop_profile):
+                _local.active = True
+            else:
+                loop_profile = None
+                self._loop_busy = False
+        return sample, loop_profile
+
+    def finish(self, sample, loop_profile):
+        if loop_profile is not None:
+            loop_profile.disable()
+            _local.active = False
+            self._loop_busy = False
+            sample.profiles.append(loop_profile)
+        with sample._lock:
+            sample.finished = True
+            profiles = list(sample.profiles)
+        elapsed_ms = int((time.perf_counter() - sample.started) * 1000)
+        stats = self._merge(profiles)
+        key = f"{sample.method} {sample.path}"
+        with self._lock:
+            self.samples += 1
+            self.by_route[key] = self.by_route.get(key, 0) + 1
+        if stats is not None:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{sample.method}-{_slug(sample.path)}-{elapsed_ms}ms.prof"
+            path = os.path.join(self.dump_dir, name)
+            try:
+                stats.dump_stats(path)
+                with self._lock:
+                    self.dumps.append(path)
+            except OSError as e:
+                print(f"⚠️ [Profiler] 写入 {path} 失败: {e}")
+
+    def _merge(self, profiles):
+        """把一组 cProfile 合并成一份 Stats，并累加到汇总结果"""
+        if not profiles:
+            return None
+        stats = pstats.Stats()
+        stats.add(*profiles)
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats()
+            self._stats.add(stats)
+        return stats
+
+    def bind(self, fn):
+        """
+        让 fn 在其他线程里执行时继续属于当前抽样请求 (并在该线程开启 cProfile)。
+        当前请求没被抽中 (绝大多数情况) 时原样返回 fn。
+        """
+        sample = _current.get()
+        if sample is None:
+            return fn
+        return functools.partial(_run_bound, sample, fn)
+
+    # --- 报告 ---
+
+    def _memory_report(self, top):
+        if not tracemalloc.is_tracing():
+            return self._last_memory
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, pstats.__file__),  # 剖析结果本身占用的内存
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        if self._baseline is not None:
+            diffs = snapshot.compare_to(self._baseline, "lineno")[:top]
+            sites = [{"site": str(d.traceback), "size_kb": round(d.size / 1024, 1), "size_diff_kb": round(d.size_diff / 1024, 1),
+                      "count": d.count, "count_diff": d.count_diff} for d in diffs]
+        else:
+            sites = [{"site": str(s.traceback), "size_kb": round(s.size / 1024, 1), "count": s.count}
+                     for s in snapshot.statistics("lineno")[:top]]
+        return {"traced_kb": current // 1024, "peak_kb": peak // 1024, "top_allocations": sites}
+
+    def report(self, top=PROFILE_TOP_N, sort="cumulative"):
+        column = SORT_KEYS.get(sort, SORT_KEYS["cumulative"])
+        # 内存快照比较慢，不在锁内做
+        memory = self._memory_report(top) if self.enabled and self._baseline is not None else self._last_memory
+        with self._lock:
+            rows = list(self._stats.stats.items()) if self._stats is not None else []
+            total = self._stats.total_tt if self._stats is not None else 0.0
+            summary = {
+                "enabled": self.enabled,
+                "config": self.config,
+                "started_at": self.started_at,
+                "remaining_s": max(0, round(self.deadline - time.monotonic(), 1)) if self.enabled else 0,
+                "samples": self.samples,
+                "by_route": dict(sorted(self.by_route.items(), key=lambda kv: -kv[1])),
+                "dump_dir": os.path.abspath(self.dump_dir),
+                "dumps": self.dumps[-20:],
+            }
+        rows.sort(key=lambda kv: kv[1][column], reverse=True)
+        summary["total_time_s"] = round(total, 4)
+        summary["top_functions"] = [
+            {"function": name, "file": filename, "line": line, "ncalls": nc, "primitive_calls": cc,
+             "tottime_s": round(tt, 6), "cumtime_s": round(ct, 6)}
+            for (filename, line, name), (cc, nc, tt, ct, _callers) in rows[:top]
+        ]
+        summary["memory"] = memory
+        return summary
+
+
+profiler = RequestProfiler()
+
+
+class ProfilingMiddleware:
+    """纯 ASGI 中间件：抽样被选中的请求，其余请求只多一次布尔判断"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.enabled or scope["type"] != "http" or not profiler.choose(scope["method"], scope["path"]):
+            return await self.app(scope, receive, send)
+
+        sample, loop_profile = profiler.begin(scope["method"], scope["path"])
+        token = _current.set(sample)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            profiler.finish(sample, loop_profile)
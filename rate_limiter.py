@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+from config import AI_RATE_LIMIT_RPM, AI_RATE_LIMIT_TPM
+
+
+class TokenBucket:
+    """
+    令牌桶：每分钟补充 rate_per_minute 个令牌，最多攒一分钟的量 (允许短时突发)。
+    rate_per_minute <= 0 表示不限速。
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """还要等多久才能取出 amount 个令牌 (超过桶容量的请求按装满为准，避免永远等不到)"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        need = min(amount, self.capacity) - self.tokens
+        return max(0.0, need / self.rate)
+
+
+class RateLimiter:
+    """
+    AI 接口限速：请求数 (RPM) 和 token 数 (TPM) 两个令牌桶同时满足才放行。
+    - 发请求前按估算的 token 数 acquire
+    - 拿到响应后用 settle 按实际用量多退少补 (超出的部分记为欠账，拖慢后续请求)
+    """
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self.waited = 0.0  # 因限速累计等待的秒数
+
+    def _try_acquire(self, estimated_tokens):
+        """配额够时直接扣除并返回 0，否则返回还需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(estimated_tokens, now))
+            if delay <= 0:
+                if not self.requests.unlimited:
+                    self.requests.tokens -= 1
+                if not self.tokens.unlimited:
+                    self.tokens.tokens -= estimated_tokens
+                return 0.0
+            self.waited += delay
+            return delay
+
+    def acquire(self, estimated_tokens):
+        while (delay := self._try_acquire(estimated_tokens)) > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, estimated_tokens):
+        """协程版 acquire：等待配额时不阻塞事件循环"""
+        while (delay := self._try_acquire(estimated_tokens)) > 0:
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        if actual_tokens is None or self.tokens.unlimited:
+            return
+        with self._lock:
+            self.tokens.tokens -= actual_tokens - estimated_tokens
+
+
+# 全进程共享的 AI 限速器 (RPM / TPM 配额是账号级的)：导入任务和学员对话都从这里取配额
+ai_rate_limiter = RateLimiter(AI_RATE_LIMIT_RPM, AI_RATE_LIMIT_TPM)
@@ -2,56 +2,581 @@ import subprocess
 import sys
 import tempfile
 import os
+import importlib.util
+import json
+import marshal
+import queue
+import signal
+import socket
+import selectors
+import threading
+import time
+import traceback
+
+try:
+    import resource  # 仅 Unix；Windows 下不设资源上限，只有墙钟超时
+except ImportError:
+    resource = None
+
+import metrics
+from config import (SANDBOX_MODE, SANDBOX_POOL_SIZE, SANDBOX_PRELOAD_MODULES, SANDBOX_MAX_STDOUT, SANDBOX_MAX_STDERR,
+                    SANDBOX_OUTPUT_PREVIEW, SANDBOX_WALL_TIME_FACTOR, SANDBOX_MEMORY_LIMIT_MB,
+                    SANDBOX_PROCESS_HEADROOM, SANDBOX_PROCESS_COUNT_INTERVAL)
+
+ZYGOTE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_zygote.py")
+CANCEL_POLL_INTERVAL = 0.05  # 秒
+
+SANDBOX_RUN_SECONDS = metrics.Histogram(
+    "pylearn_sandbox_run_seconds", "沙箱子进程从启动到退出的墙钟时间", ["mode", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+def _sandbox_env():
+    # 1. 准备环境变量，强制指定 Python IO 编码为 UTF-8
+    # 这能解决在 Windows (默认GBK) 或某些容器中 print 中文报错的问题
+    env = os.environ.copy()
+    env["PYTHONIOENCODING"] = "utf-8"
+    # 无界面环境下 matplotlib 只能用 Agg 后端；BLAS 单线程，避免 fork 后线程池状态错乱
+    env.setdefault("MPLBACKEND", "Agg")
+    env.setdefault("OPENBLAS_NUM_THREADS", "1")
+    env.setdefault("OMP_NUM_THREADS", "1")
+    return env
+
+
+def _pump(stdin_fd, stdout_fd, stderr_fd, input_bytes, deadline, cancel=None, on_stdout=None,
+          stdout_limit=SANDBOX_MAX_STDOUT, stderr_limit=SANDBOX_MAX_STDERR):
+    """
+    向子进程写入输入并读取 stdout/stderr，直到两个管道都关闭、超时、被取消或输出超限。
+    每个管道最多读入 limit 字节 (超出即停止)，单次运行占用的内存与输出量无关。
+    on_stdout: 可选回调，每读到一块 stdout 就调用一次；返回 False 时立即停止 (reason="aborted")。
+               此时 stdout 已由回调消费，只保留开头 SANDBOX_OUTPUT_PREVIEW + 1 字节用于展示。
+    三个 fd 都会在此函数内关闭。
+    返回: (stdout_bytes, stderr_bytes, reason)，reason 为 None / "timeout" / "cancelled" / "output_limit" / "aborted"
+    """
+    chunks = {stdout_fd: [], stderr_fd: []}
+    room = {stdout_fd: stdout_limit, stderr_fd: stderr_limit}  # 各管道还能接收的字节数
+    keep = {stdout_fd: SANDBOX_OUTPUT_PREVIEW + 1 if on_stdout else stdout_limit, stderr_fd: stderr_limit}  # 各管道还要保留的字节数
+    sel = selectors.DefaultSelector()
+    reason = None
+    try:
+        if input_bytes:
+            os.set_blocking(stdin_fd, False)
+            sel.register(stdin_fd, selectors.EVENT_WRITE)
+        else:
+            os.close(stdin_fd)
+            stdin_fd = None
+        sel.register(stdout_fd, selectors.EVENT_READ)
+        sel.register(stderr_fd, selectors.EVENT_READ)
+
+        offset = 0
+        while sel.get_map():
+            if cancel is not None and cancel.is_set():
+                reason = "cancelled"
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                reason = "timeout"
+                break
+            # 有取消信号时定期醒来检查一次
+            wait = remaining if cancel is None else min(remaining, CANCEL_POLL_INTERVAL)
+            for key, _ in sel.select(wait):
+                fd = key.fd
+                if fd == stdin_fd:
+                    try:
+                        offset += os.write(fd, input_bytes[offset:offset + 65536])
+                    except BrokenPipeError:
+                        offset = len(input_bytes)  # 子进程不读输入，直接丢弃
+                    if offset >= len(input_bytes):
+                        sel.unregister(fd)
+                        os.close(fd)
+                        stdin_fd = None
+                else:
+                    # 多读 1 字节用来判断是否超限
+                    data = os.read(fd, min(65536, room[fd] + 1))
+                    if not data:
+                        sel.unregister(fd)
+                        continue
+                    if len(data) > room[fd]:
+                        data = data[:room[fd]]
+                        reason = "output_limit"
+                    if keep[fd] > 0:
+                        chunks[fd].append(data[:keep[fd]])
+                        keep[fd] -= len(chunks[fd][-1])
+                    room[fd] -= len(data)
+                    if fd == stdout_fd and on_stdout is not None and data and not on_stdout(data) and reason is None:
+                        reason = "aborted"
+                    if reason:
+                        break
+            if reason:
+                break
+        return b"".join(chunks[stdout_fd]), b"".join(chunks[stderr_fd]), reason
+    finally:
+        sel.close()
+        for fd in (stdin_fd, stdout_fd, stderr_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+
+def _kill_group(pid):
+    """子进程都在独立的进程组里，整组 kill 掉 (连同它创建的孙进程)"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def _decode(data: bytes) -> str:
+    # 与 text=True 的行为保持一致：UTF-8 解码 + 统一换行符
+    return data.decode("utf-8", errors="replace").replace("\r\n", "\n")
+
+
+def _user_task_count():
+    """当前用户 (real uid) 的进程 + 线程总数，即内核检查 RLIMIT_NPROC 时统计的数量；没有 /proc 时返回 None"""
+    uid = str(os.getuid()).encode()
+    try:
+        names = os.listdir("/proc")
+    except OSError:
+        return None
+    total = 0
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/status", "rb") as f:
+                status = f.read()
+        except OSError:
+            continue  # 进程已经退出
+        fields = dict(line.split(b":", 1) for line in status.splitlines() if b":" in line)
+        if fields.get(b"Uid", b"").split()[:1] == [uid]:
+            total += int(fields.get(b"Threads", b"1"))
+    return total
+
+
+class _ProcessLimit:
+    """RLIMIT_NPROC 的取值：用户当前的进程 / 线程数 + 余量，每隔一段时间重新统计一次 (扫描 /proc 有几毫秒开销)"""
+
+    def __init__(self, headroom, interval):
+        self.headroom = headroom
+        self.interval = interval
+        self._value = None
+        self._counted_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if resource is None or not hasattr(os, "getuid") or os.getuid() == 0:
+            return None  # root 不受 RLIMIT_NPROC 限制，不必统计
+        with self._lock:
+            now = time.monotonic()
+            if self._counted_at is None or now - self._counted_at >= self.interval:
+                count = _user_task_count()
+                self._value = None if count is None else count + self.headroom
+                self._counted_at = now
+            return self._value
+
+
+process_limit = _ProcessLimit(SANDBOX_PROCESS_HEADROOM, SANDBOX_PROCESS_COUNT_INTERVAL)
+
+
+def _limits(time_limit):
+    """子进程的资源上限 (传给 zygote 或 spawn 模式的启动器)"""
+    return {
+        "cpu": int(time_limit) + 1,  # 比时间限制多 1 秒：超限由 CPU 用量判定，这里只负责停掉死循环
+        "as_mb": SANDBOX_MEMORY_LIMIT_MB,
+        "nproc": process_limit.get(),
+    }
+
+
+def _usage(done):
+    """zygote 回报的资源用量"""
+    if "cpu_ms" not in done:
+        return None
+    return {"cpu_ms": done["cpu_ms"], "max_rss_kb": done["max_rss_kb"]}
+
+
+# spawn 模式下设置资源上限的启动器：在一个最小的解释器里 setrlimit，再 exec 成真正执行学员代码的解释器
+# (不用 preexec_fn：它在多线程的服务进程 fork 之后、exec 之前运行 Python 代码，可能卡在别的线程持有的锁上)。
+# 地址空间上限不需要扣除基线；exec 之后是全新的解释器，报错信息与直接 `python xxx.py` 一致
+_SPAWN_LAUNCHER = (
+    "import json, os, sys\n"
+    "sys.path.insert(0, sys.argv[1])\n"
+    "from sandbox_zygote import apply_limits\n"
+    "try:\n"
+    "    apply_limits(json.loads(sys.argv[2]))\n"
+    "except (ValueError, OSError):\n"
+    "    pass\n"
+    "os.execv(sys.executable, [sys.executable] + sys.argv[3:])\n"
+)
+
+
+def _spawn_command(path, limits):
+    if not limits or resource is None:
+        return [sys.executable, path]
+    return [sys.executable, "-I", "-S", "-c", _SPAWN_LAUNCHER, os.path.dirname(ZYGOTE_SCRIPT), json.dumps(limits), path]
+
+
+class _Zygote:
+    """一个预热好的 zygote 进程及其控制 socket"""
+
+    def __init__(self):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock = parent_sock
+        self._buf = b""
+        self.ready = False
+        self.proc = subprocess.Popen(
+            [sys.executable, ZYGOTE_SCRIPT, str(child_sock.fileno()), json.dumps(SANDBOX_PRELOAD_MODULES)],
+            pass_fds=(child_sock.fileno(),),
+            stdin=subprocess.DEVNULL,
+            env=_sandbox_env(),
+        )
+        child_sock.close()
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _recv(self):
+        while b"\n" not in self._buf:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("zygote 进程已退出")
+            self._buf += data
+        line, self._buf = self._buf.split(b"\n", 1)
+        return json.loads(line)
+
+    def wait_ready(self):
+        if not self.ready:
+            self._recv()
+            self.ready = True
+
+    def run(self, path, input_bytes, timeout, cancel=None, on_stdout=None, limits=None, bytecode=None):
+        self.wait_ready()
+        in_r, in_w = os.pipe()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            socket.send_fds(self.sock, [json.dumps({"path": path, "bytecode": bytecode, "limits": limits}).encode() + b"\n"], [in_r, out_w, err_w])
+        except OSError:
+            for fd in (in_r, in_w, out_r, out_w, err_r, err_w):
+                os.close(fd)
+            raise
+        for fd in (in_r, out_w, err_w):
+            os.close(fd)
+
+        pid = self._recv()["pid"]
+        started = time.monotonic()
+        deadline = started + timeout
+        stdout, stderr, reason = _pump(in_w, out_r, err_r, input_bytes, deadline, cancel, on_stdout)
+        if reason is None:
+            # 管道已关闭但进程可能还没退出 (例如主动关闭了 stdout 后死循环)
+            self.sock.settimeout(max(0.001, deadline - time.monotonic()))
+            try:
+                done = self._recv()
+                return stdout, stderr, done["returncode"], None, time.monotonic() - started, _usage(done)
+            except socket.timeout:
+                reason = "timeout"
+            finally:
+                self.sock.settimeout(None)
+        _kill_group(pid)
+        done = self._recv()
+        return stdout, stderr, done["returncode"], reason, time.monotonic() - started, _usage(done)
+
+    def close(self):
+        try:
+            self.sock.close()
+        finally:
+            try:
+                self.proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+class ForkServerPool:
+    """
+    预热的 zygote 进程池：每个 zygote 同一时间只服务一个请求，
+    池的大小即 fork 模式下的最大并发执行数。
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._started = True
+        print(f"🧬 [Sandbox] fork-server 进程池已启动: {self.size} 个 zygote, 预加载 {SANDBOX_PRELOAD_MODULES}")
+
+    def run(self, path, input_bytes, timeout, cancel=None, on_stdout=None, limits=None, bytecode=None):
+        self.start()
+        while True:
+            if cancel is not None and cancel.is_set():
+                return b"", b"", None, "cancelled", 0.0, None
+            try:
+                zygote = self._idle.get(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        healthy = False
+        try:
+            if zygote is None or not zygote.alive():
+                if zygote is not None:
+                    zygote.close()
+                    zygote = None
+                # 重建失败时抛出 OSError，由 Sandbox.run 回退到冷启动模式；槽位以 None 占位归还
+                zygote = _Zygote()
+            result = zygote.run(path, input_bytes, timeout, cancel, on_stdout, limits, bytecode)
+            healthy = True
+            return result
+        finally:
+            if not healthy and zygote is not None:
+                # 通信中途出错，协议状态不可信，换一个新的 zygote
+                zygote.close()
+                zygote = self._spawn()
+            # 无论成败都要归还槽位，否则槽位耗尽后所有判题线程会永远卡在 _idle.get()
+            self._idle.put(zygote)
+
+    @staticmethod
+    def _spawn():
+        """启动一个 zygote；失败 (fork / exec 出错、fd 耗尽等) 时返回 None 占位，下次取到该槽位时再重建"""
+        try:
+            return _Zygote()
+        except Exception as e:
+            print(f"⚠️ [Sandbox] 启动 zygote 失败，稍后重试: {e}")
+            return None
+
+    def shutdown(self):
+        with self._lock:
+            while not self._idle.empty():
+                zygote = self._idle.get_nowait()
+                if zygote is not None:
+                    zygote.close()
+            self._started = False
+
+
+fork_pool = ForkServerPool(SANDBOX_POOL_SIZE) if SANDBOX_MODE == "fork" and hasattr(socket, "send_fds") else None
+
+
+class CompileError(Exception):
+    """提交的代码无法通过编译 (语法错误)，由 Sandbox.prepare 抛出"""
+
+    def __init__(self, exc):
+        super().__init__(str(exc))
+        self.message = getattr(exc, "msg", None) or str(exc)
+        self.line = getattr(exc, "lineno", None)
+        self.column = getattr(exc, "offset", None)
+        self.text = (getattr(exc, "text", None) or "").rstrip("\n")
+        # 与直接运行 python 时 stderr 里的格式一致
+        self.formatted = "".join(traceback.format_exception_only(type(exc), exc))
+
+    def to_dict(self):
+        return {"message": self.message, "line": self.line, "column": self.column, "text": self.text}
+
+
+class PreparedProgram:
+    """
+    编译好的提交：临时目录里的源码文件 (报错时 traceback 要显示源码行) + 编译一次得到的 .pyc。
+    同一次判题的所有测试点共用，用完调用 close() 删除 (也可以用 with)。
+    """
+
+    def __init__(self, source_path, bytecode_path):
+        self.source_path = source_path
+        self.bytecode_path = bytecode_path
+
+    def close(self):
+        for path in (self.source_path, self.bytecode_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 class Sandbox:
     @staticmethod
-    def run(code: str, input_data: str, timeout: int = 2):
+    def prepare(code: str) -> PreparedProgram:
         """
-        在临时文件中运行代码，捕获输出。
-        返回: (stdout, stderr, status)
+        判题前的编译阶段：在当前进程内编译 (只解析、不执行)，有语法错误时直接抛出 CompileError，
+        不必为每个测试点启动子进程才发现；编译通过则写出源码和 .pyc，供 Sandbox.run 的每个测试点直接加载。
         """
-        # 创建临时 Python 文件
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as tmp:
-            tmp.write(code)
-            tmp_path = tmp.name
-
+        fd, source_path = tempfile.mkstemp(suffix=".py")
+        os.close(fd)
+        try:
+            code_obj = compile(code, source_path, "exec", dont_inherit=True)
+        except (SyntaxError, ValueError, RecursionError, MemoryError) as e:
+            # ValueError: 源码中有 NUL 字符；RecursionError / MemoryError: 嵌套过深
+            os.remove(source_path)
+            raise CompileError(e)
+        bytecode_path = source_path + "c"
         try:
-            # 1. 准备环境变量，强制指定 Python IO 编码为 UTF-8
-            # 这能解决在 Windows (默认GBK) 或某些容器中 print 中文报错的问题
-            env = os.environ.copy()
-            env["PYTHONIOENCODING"] = "utf-8"
+            with open(source_path, "w", encoding="utf-8") as f:
+                f.write(code)
+            # 与 py_compile 相同的文件头: magic + flags + mtime + 源码长度 (直接 python xxx.pyc 也能运行)
+            header = importlib.util.MAGIC_NUMBER + (0).to_bytes(4, "little") + int(time.time()).to_bytes(4, "little") \
+                + (len(code.encode("utf-8")) & 0xFFFFFFFF).to_bytes(4, "little")
+            with open(bytecode_path, "wb") as f:
+                f.write(header + marshal.dumps(code_obj))
+        except BaseException:
+            PreparedProgram(source_path, bytecode_path).close()
+            raise
+        return PreparedProgram(source_path, bytecode_path)
 
-            # 启动子进程执行代码
-            process = subprocess.Popen(
-                [sys.executable, tmp_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,     # 文本模式，自动解码
-                env=env        # 注入环境变量
-            )
-            
-            # 写入输入数据并获取输出（设置 3 秒超时防止死循环）
-            stdout, stderr = process.communicate(input=input_data, timeout=timeout)
-            
-            return {
-                "stdout": stdout,
-                "stderr": stderr,
-                "status": "success" if process.returncode == 0 else "runtime_error"
-            }
-
-        except subprocess.TimeoutExpired:
-            try:
-                process.kill()
-            except:
-                pass
-            return {"stdout": "", "stderr": f"Error: Execution Timeout ({timeout}s limit).", "status": "timeout"}
+    @staticmethod
+    def run(code, input_data: str, timeout: int = 2, cancel: threading.Event = None, on_stdout=None):
+        """
+        运行代码，捕获输出。
+        code: 源码字符串 (写入临时文件后运行)，或 Sandbox.prepare 得到的 PreparedProgram (直接加载字节码，不会被删除)
+        timeout: 时间限制 (秒)，按 CPU 时间计算；墙钟兜底为 timeout × SANDBOX_WALL_TIME_FACTOR + 1
+        cancel: 可选的 threading.Event，置位后立即 kill 掉正在运行的子进程 (多测试点提前结束时使用)
+        on_stdout: 可选回调 (流式检查器)，边运行边接收 stdout 数据块，返回 False 时立即 kill；
+                   传入时返回的 stdout 只是开头一段预览
+        返回: {"stdout", "stderr", "status", "time_ms", "cpu_ms", "max_rss_kb"}
+              (cpu_ms / max_rss_kb 在拿不到资源用量的平台上为 None)
+        status: success / runtime_error / timeout / memory_limit / cancelled / output_limit / aborted / system_error
+        """
+        if isinstance(code, PreparedProgram):
+            tmp_path, bytecode, owned = code.source_path, code.bytecode_path, False
+        else:
+            # 创建临时 Python 文件
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as tmp:
+                tmp.write(code)
+                tmp_path = tmp.name
+            bytecode, owned = None, True
+
+        input_bytes = (input_data or "").encode("utf-8")
+        limits = _limits(timeout)
+        wall = timeout * SANDBOX_WALL_TIME_FACTOR + 1
+        streamed = False  # 回调是否已经收到过数据 (有状态的检查器不能再喂一遍重跑的输出)
+
+        def feed(data):
+            nonlocal streamed
+            streamed = True
+            return on_stdout(data)
+
+        mode = "fork"
+        try:
+            outcome = None
+            if fork_pool is not None:
+                try:
+                    outcome = fork_pool.run(tmp_path, input_bytes, wall, cancel, feed if on_stdout else None, limits, bytecode)
+                except (OSError, ValueError) as e:
+                    if streamed:
+                        raise
+                    print(f"⚠️ [Sandbox] fork-server 执行失败，回退到冷启动模式: {e}")
+            if outcome is None:
+                mode = "spawn"
+                outcome = Sandbox._run_spawned(bytecode or tmp_path, input_bytes, wall, cancel, on_stdout, limits)
         except Exception as e:
-            return {"stdout": "", "stderr": f"System Error: {str(e)}", "status": "system_error"}
+            SANDBOX_RUN_SECONDS.labels(mode, "system_error").observe(0.0)
+            return {"stdout": "", "stderr": f"System Error: {str(e)}", "status": "system_error", "time_ms": 0, "cpu_ms": None, "max_rss_kb": None}
         finally:
-            # 清理临时文件
+            # 清理临时文件 (PreparedProgram 由调用方负责)
             try:
-                if os.path.exists(tmp_path):
+                if owned and os.path.exists(tmp_path):
                     os.remove(tmp_path)
             except Exception:
-                pass
\ No newline at end of file
+                pass
+
+        stdout, stderr, returncode, reason, elapsed, usage = outcome
+        usage = usage or {"cpu_ms": None, "max_rss_kb": None}
+
+        def result(status, out="", err=""):
+            SANDBOX_RUN_SECONDS.labels(mode, status).observe(elapsed)
+            return {"stdout": out, "stderr": err, "status": status, "time_ms": int(elapsed * 1000), **usage}
+
+        cpu_ms = usage["cpu_ms"]
+        if reason == "timeout":
+            return result("timeout", err=f"Error: Execution Timeout ({wall}s wall-clock limit).")
+        if reason == "cancelled":
+            return result("cancelled")
+        if cpu_ms is not None and cpu_ms > timeout * 1000:
+            # 包括被 RLIMIT_CPU 的 SIGXCPU / SIGKILL 停掉的情况
+            return result("timeout", err=f"Error: Execution Timeout ({timeout}s CPU limit, used {cpu_ms / 1000:.2f}s).")
+        if reason == "output_limit":
+            # 只返回开头一小段作为预览，完整的 (已截断到上限的) 输出随即丢弃
+            preview = _decode(stdout[:SANDBOX_OUTPUT_PREVIEW])
+            if len(stdout) > SANDBOX_OUTPUT_PREVIEW:
+                preview += "\n... (输出过长，已截断)"
+            return result("output_limit", preview, _decode(stderr[:SANDBOX_OUTPUT_PREVIEW]) +
+                          f"\nError: Output Limit Exceeded (stdout 上限 {SANDBOX_MAX_STDOUT // 1024} KB, stderr 上限 {SANDBOX_MAX_STDERR // 1024} KB).")
+        if on_stdout is not None and len(stdout) > SANDBOX_OUTPUT_PREVIEW:
+            stdout = stdout[:SANDBOX_OUTPUT_PREVIEW] + "\n... (输出过长，已截断)".encode("utf-8")
+        if reason == "aborted":
+            return result("aborted", _decode(stdout), _decode(stderr))
+        if returncode != 0 and resource is not None and b"MemoryError" in stderr[-4096:]:
+            # 触碰 RLIMIT_AS 时解释器抛出 MemoryError
+            return result("memory_limit", _decode(stdout), _decode(stderr) + f"\nError: Memory Limit Exceeded ({SANDBOX_MEMORY_LIMIT_MB} MB limit).")
+        return result("success" if returncode == 0 else "runtime_error", _decode(stdout), _decode(stderr))
+
+    @staticmethod
+    def _run_spawned(tmp_path, input_bytes, timeout, cancel=None, on_stdout=None, limits=None):
+        """spawn 模式：每次冷启动一个新的解释器 (tmp_path 可以是 .py 源码或 .pyc 字节码)"""
+        in_r, in_w = os.pipe()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            # 启动子进程执行代码 (独立会话，超时时整组 kill)
+            process = subprocess.Popen(
+                _spawn_command(tmp_path, limits),
+                stdin=in_r,
+                stdout=out_w,
+                stderr=err_w,
+                env=_sandbox_env(),        # 注入环境变量
+                start_new_session=True,
+            )
+        except Exception:
+            for fd in (in_w, out_r, err_r):
+                os.close(fd)
+            raise
+        finally:
+            for fd in (in_r, out_w, err_w):
+                os.close(fd)
+
+        started = time.monotonic()
+        deadline = started + timeout
+        stdout, stderr, reason = _pump(in_w, out_r, err_r, input_bytes, deadline, cancel, on_stdout)
+        if reason is None:
+            try:
+                usage = _reap(process, deadline)
+                return stdout, stderr, process.returncode, None, time.monotonic() - started, usage
+            except subprocess.TimeoutExpired:
+                reason = "timeout"
+        _kill_group(process.pid)
+        usage = _reap(process)
+        return stdout, stderr, process.returncode, reason, time.monotonic() - started, usage
+
+
+def _reap(process, deadline=None):
+    """
+    等待 spawn 出的子进程退出，用 wait4 取回资源用量 (没有 wait4 的平台返回 None)。
+    deadline 到了子进程还没退出时抛出 subprocess.TimeoutExpired。
+    """
+    if not hasattr(os, "wait4"):
+        process.wait(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return None
+    delay = 0.0005
+    while True:
+        pid, status, usage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            max_rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+            return {"cpu_ms": int((usage.ru_utime + usage.ru_stime) * 1000), "max_rss_kb": max_rss}
+        if time.monotonic() >= deadline:
+            raise subprocess.TimeoutExpired(process.args, 0)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
@@ -0,0 +1,185 @@
+"""
+沙箱 Zygote 进程 (由 sandbox.ForkServerPool 启动，不要直接运行)
+
+启动时预先导入 numpy / pandas 等常用库，之后常驻等待判题请求：
+每个请求 fork 出一个干净的子进程执行学员代码，子进程继承已导入的模块，
+从而省掉解释器冷启动和重型库的导入时间。
+
+通信协议 (Unix socket, 每行一个 JSON)：
+    -> {"path": "/tmp/xxx.py", "bytecode": "/tmp/xxx.pyc" 或 null}  + 通过 SCM_RIGHTS 附带 [stdin, stdout, stderr] 三个 fd
+    <- {"pid": 1234}            子进程已启动
+    <- {"returncode": 0, "cpu_ms": 12, "max_rss_kb": 2048}   子进程已退出 (资源用量来自 wait4)
+
+请求里可以带 "limits": {"cpu": 秒, "as_mb": MB, "nproc": 个}，子进程 exec 学员代码前用 setrlimit 设置。
+as_mb 是在 zygote 当前地址空间之上额外允许的大小 (预加载的库已经占用了不少)；
+max_rss_kb 同样扣除了 fork 时从 zygote 继承的常驻内存，只统计学员代码新增的部分。
+"""
+import builtins
+import importlib
+import importlib.util
+import json
+import marshal
+import os
+import resource
+import signal
+import socket
+import sys
+import traceback
+import types
+
+
+def preload(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ModuleNotFoundError:
+            pass  # 未安装的库跳过即可，学员代码导入时自然会报错
+        except Exception as e:
+            print(f"[Zygote] 预加载 {name} 失败: {e}", file=sys.stderr)
+
+
+def load_bytecode(pyc_path):
+    """读取 .pyc 文件 (16 字节文件头 + marshal 数据)"""
+    with open(pyc_path, "rb") as f:
+        data = f.read()
+    if data[:4] != importlib.util.MAGIC_NUMBER:
+        raise ImportError(f"bad magic number in {pyc_path!r}")
+    return marshal.loads(data[16:])
+
+
+def _exit_code(exc):
+    """模拟解释器对 SystemExit 的处理"""
+    code = exc.code
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _statm_kb():
+    """当前进程的 (虚拟地址空间, 常驻内存)，单位 KB；拿不到时返回 (0, 0)"""
+    try:
+        with open("/proc/self/statm") as f:
+            vm, rss = f.read().split()[:2]
+        page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+        return int(vm) * page_kb, int(rss) * page_kb
+    except (OSError, ValueError):
+        return 0, 0
+
+
+def _rss_kb(usage):
+    # macOS 的 ru_maxrss 单位是字节，Linux 是 KB
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def apply_limits(limits, base_vm_kb=0):
+    """在子进程中设置资源上限：CPU 时间 (超出先收到 SIGXCPU，再过 1 秒 SIGKILL)、地址空间、进程数"""
+    cpu = limits.get("cpu")
+    if cpu:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    as_mb = limits.get("as_mb")
+    if as_mb:
+        cap = base_vm_kb * 1024 + as_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    nproc = limits.get("nproc")
+    if nproc and hasattr(resource, "RLIMIT_NPROC"):
+        resource.setrlimit(resource.RLIMIT_NPROC, (nproc, nproc))
+
+
+def run_child(req, fds):
+    """在 fork 出的子进程中执行学员代码，永不返回"""
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    os.setpgid(0, 0)  # 独立进程组，超时时整组 kill 掉
+    try:
+        apply_limits(req.get("limits") or {}, _statm_kb()[0])
+    except (ValueError, OSError):
+        pass  # 上限超过了 hard limit 等情况：按不限制处理，仍有墙钟超时兜底
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    # 重新绑定标准流，等价于 PYTHONIOENCODING=utf-8
+    sys.stdin = sys.__stdin__ = open(0, "r", encoding="utf-8", closefd=False)
+    sys.stdout = sys.__stdout__ = open(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = sys.__stderr__ = open(2, "w", encoding="utf-8", errors="backslashreplace", closefd=False, buffering=1)
+
+    path = req["path"]
+    sys.argv = [path]
+    sys.path[0] = os.path.dirname(path)
+
+    rc = 0
+    try:
+        if req.get("bytecode"):
+            # 判题前已编译好的字节码 (Sandbox.prepare)，所有测试点共用，不再重复解析源码
+            code = load_bytecode(req["bytecode"])
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                source = f.read()
+            code = compile(source, path, "exec")
+        main = types.ModuleType("__main__")
+        main.__file__ = path
+        main.__builtins__ = builtins
+        sys.modules["__main__"] = main
+        exec(code, main.__dict__)
+    except SystemExit as e:
+        rc = _exit_code(e)
+    except BaseException as e:
+        # 跳过本函数这一帧，让报错看起来和 `python xxx.py` 一致
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        rc = 1
+    finally:
+        try:
+            sys.stdout.flush()
+        except Exception:
+            pass
+        try:
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(rc)
+
+
+def serve(sock):
+    buf = b""
+    fds = []
+    while True:
+        while b"\n" not in buf:
+            msg, new_fds, _, _ = socket.recv_fds(sock, 65536, 3)
+            if not msg:
+                return  # 父进程已退出
+            buf += msg
+            fds.extend(new_fds)
+        line, buf = buf.split(b"\n", 1)
+        req = json.loads(line)
+        req_fds, fds = fds[:3], fds[3:]
+
+        base_rss_kb = _statm_kb()[1]
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            run_child(req, req_fds)
+
+        for fd in req_fds:
+            os.close(fd)
+        sock.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+        _, status, usage = os.wait4(pid, 0)
+        sock.sendall(json.dumps({
+            "returncode": os.waitstatus_to_exitcode(status),
+            "cpu_ms": int((usage.ru_utime + usage.ru_stime) * 1000),
+            "max_rss_kb": max(0, _rss_kb(usage) - base_rss_kb),
+        }).encode() + b"\n")
+
+
+if __name__ == "__main__":
+    # Ctrl+C 由主进程负责处理，zygote 随 socket 关闭而退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    preload(json.loads(sys.argv[2]) if len(sys.argv) > 2 else [])
+    try:
+        sock.sendall(b'{"ready": true}\n')
+        serve(sock)
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # 主进程已关闭连接 (服务退出)，安静地结束
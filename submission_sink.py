@@ -0,0 +1,136 @@
+import atexit
+import queue
+import threading
+import time
+
+from config import SUBMISSION_BATCH_SIZE, SUBMISSION_FLUSH_INTERVAL, SUBMISSION_BUFFER_SIZE, SUBMISSION_OVERFLOW_POLICY
+from database import db
+
+
+class SubmissionSink:
+    """
+    提交记录的异步写入器 (write-behind + group commit)：
+    - 判题线程只把记录放进内存缓冲区，不再在请求里等待 sqlite 提交
+    - 后台线程攒够 batch_size 条或距第一条记录超过 flush_interval 秒时，用一个事务批量写入
+    - 缓冲区有上限；满了按 overflow_policy 处理：
+        "sync": 退回同步写入，不丢数据 (默认)
+        "drop": 丢弃该条记录并计数，保护判题延迟
+    - 服务退出时 (shutdown 事件 / atexit) 会把缓冲区剩余记录全部写完
+    """
+
+    def __init__(self, batch_size, flush_interval, max_buffer, overflow_policy):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.overflow_sync = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name="submission-sink", daemon=True)
+            self._thread.start()
+
+    def submit(self, pid, code, output, error, is_correct, ai_analysis, cpu_ms=None, wall_ms=None, max_rss_kb=None):
+        record = (pid, code, output, error, is_correct, ai_analysis, time.time(), cpu_ms, wall_ms, max_rss_kb)
+        if self._stopping.is_set():
+            # 服务正在退出，写入线程已停止：直接同步写
+            db.save_submissions_batch([record])
+            return
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow_policy == "drop":
+                self.dropped += 1
+            else:
+                self.overflow_sync += 1
+                db.save_submissions_batch([record])
+
+    def _collect(self):
+        """取出一批记录：阻塞等第一条，然后在 flush_interval 内尽量攒满 batch_size 条"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(3):
+            try:
+                db.save_submissions_batch(batch)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                print(f"⚠️ [SubmissionSink] 批量写入失败 (第 {attempt + 1} 次): {e}")
+                time.sleep(0.2 * (attempt + 1))
+        self.failed += len(batch)
+
+    def _loop(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                try:
+                    self._write(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    def flush(self):
+        """阻塞直到当前缓冲区内的记录全部落盘"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        """停止写入线程并写完剩余记录 (可重复调用)"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping.set()
+        thread.join()
+        with self._lock:
+            self._thread = None
+        # 停止后仍可能有并发提交漏进队列，同步写掉
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                break
+        if leftover:
+            self._write(leftover)
+
+    def stats(self):
+        return {
+            "buffered": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "overflow_sync": self.overflow_sync,
+            "failed": self.failed,
+        }
+
+
+submission_sink = SubmissionSink(SUBMISSION_BATCH_SIZE, SUBMISSION_FLUSH_INTERVAL, SUBMISSION_BUFFER_SIZE, SUBMISSION_OVERFLOW_POLICY)
+atexit.register(submission_sink.stop)
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+# database.py 在导入时就会创建 db 单例并建表，必须先把它指向临时文件，不能碰到 pylearn.db
+config.DB_NAME = os.path.join(tempfile.mkdtemp(prefix="pylearn-test-"), "test.db")
@@ -0,0 +1,30 @@
+from database import db, LEGACY_SOURCE_REPO
+
+
+def problem(repo, path, title="旧题目"):
+    return {
+        "title": title, "description": "打印 1", "difficulty": 1, "code": "print(1)", "input": "", "output": "1",
+        "knowledge": "输出", "source_repo": repo, "file_path": path,
+    }
+
+
+def test_reimport_adopts_legacy_row():
+    [legacy] = db.bulk_upsert_problems([(problem(LEGACY_SOURCE_REPO, "legacy/hello.py"), None)])
+    repo = "https://example.com/legacy.git"
+    [pid] = db.bulk_upsert_problems([(problem(repo, "legacy/hello.py", title="新题目"), None)])
+    assert pid == legacy
+    assert db.get_problem_detail(pid)["title"] == "新题目"
+    assert db.get_problem_id_by_source(LEGACY_SOURCE_REPO, "legacy/hello.py") is None
+    # 已经被认领后，其他仓库的同名文件是另一道题
+    [other] = db.bulk_upsert_problems([(problem("https://example.com/other.git", "legacy/hello.py"), None)])
+    assert other != pid
+
+
+def test_existing_row_wins_over_legacy_row():
+    repo = "https://example.com/both.git"
+    [legacy] = db.bulk_upsert_problems([(problem(LEGACY_SOURCE_REPO, "both.py"), None)])
+    [current] = db.bulk_upsert_problems([(problem(repo, "both.py"), None)])
+    assert current == legacy
+    [legacy_again] = db.bulk_upsert_problems([(problem(LEGACY_SOURCE_REPO, "both.py"), None)])
+    assert db.bulk_upsert_problems([(problem(repo, "both.py"), None)]) == [current]
+    assert db.get_problem_id_by_source(LEGACY_SOURCE_REPO, "both.py") == legacy_again
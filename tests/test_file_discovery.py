@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from file_discovery import FileDiscovery, GitIgnore, _translate
+
+
+def ignore_with(tmp_path, *lines):
+    (tmp_path / ".gitignore").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return GitIgnore().extended("", str(tmp_path / ".gitignore"))
+
+
+def test_leading_slash_dir_pattern_is_anchored(tmp_path):
+    ignore = ignore_with(tmp_path, "/build/")
+    assert ignore.ignored("build", True)
+    assert not ignore.ignored("src/build", True)
+    assert not ignore.ignored("build", False)
+
+
+def test_trailing_slash_alone_does_not_anchor(tmp_path):
+    ignore = ignore_with(tmp_path, "build/")
+    assert ignore.ignored("build", True)
+    assert ignore.ignored("src/build", True)
+
+
+@pytest.mark.parametrize("pattern, path, matched", [
+    ("[abc].py", "b.py", True),
+    ("[!abc].py", "b.py", False),
+    ("[^abc].py", "d.py", True),
+    ("[]a]x", "]x", True),
+    ("[a-c]x", "dx", False),
+    ("[[:digit:]]x", "5x", True),
+    ("a[/]b", "a/b", False),
+    ("a[!x]b", "a/b", False),
+    ("[ab", "[ab", True),
+    ("*.py[co]", "mod.pyc", True),
+])
+def test_char_class(pattern, path, matched):
+    assert bool(_translate(pattern).match(path)) is matched
+
+
+def test_scan_checks_syntax_in_thread_pool(tmp_path):
+    for i in range(10):
+        (tmp_path / f"ok{i}.py").write_text(f"print({i})\n", encoding="utf-8")
+        (tmp_path / f"bad{i}.py").write_text("def broken(:\n", encoding="utf-8")
+    found = FileDiscovery(str(tmp_path), workers=2, chunk_size=3).scan()
+    assert sorted(found) == sorted(f"ok{i}.py" for i in range(10))
+
+
+def test_filter_paths_skips_symlinks(tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "secret.py").write_text("print('secret')\n", encoding="utf-8")
+    repo = tmp_path / "repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pkg" / "real.py").write_text("print('real')\n", encoding="utf-8")
+    os.symlink(outside / "secret.py", repo / "pkg" / "link.py")
+    os.symlink(outside, repo / "linked_dir")
+    paths = ["pkg/real.py", "pkg/link.py", "linked_dir/secret.py", "pkg", "../outside/secret.py", "missing.py"]
+    assert list(FileDiscovery(str(repo)).filter_paths(paths)) == ["pkg/real.py"]
@@ -0,0 +1,107 @@
+"""
+热点查询的执行计划：用 set_trace_callback 抓下 Database 方法实际执行的语句 (参数已展开)，
+再用 Database.explain() 检查它们走了预期的索引，没有全表扫描，也没有为排序建临时 B 树。
+"""
+import pytest
+
+from database import db
+
+TABLES = ("problems", "p", "test_cases", "submissions", "problem_tags", "t", "verdict_cache", "app_meta")
+
+
+def problem(i, difficulty=2, knowledge="循环,列表推导", repo="https://example.com/repo.git"):
+    return {
+        "title": f"题目 {i}", "description": f"第 {i} 题：打印平方数", "difficulty": difficulty, "code": f"print({i} * {i})",
+        "input": "", "output": str(i * i), "knowledge": knowledge, "source_repo": repo, "file_path": f"p{i}.py",
+    }
+
+
+@pytest.fixture(scope="module")
+def pids():
+    pids = db.bulk_upsert_problems([(problem(i, difficulty=i % 5 + 1), [{"input": "", "output": str(i * i)}]) for i in range(50)])
+    db.save_submissions_batch([(pid, "print(1)", "1", "", True, "", 0.0, 1, 2, 3) for pid in pids])
+    return pids
+
+
+def traced(fn, *args, **kwargs):
+    """执行 fn，返回它发出的 SELECT / UPDATE / DELETE 语句 (跳过 FTS5 内部的 "-- " 语句)"""
+    statements = []
+    conn = db.get_conn()
+    conn.set_trace_callback(statements.append)
+    try:
+        fn(*args, **kwargs)
+    finally:
+        conn.set_trace_callback(None)
+    return [s for s in statements if s.split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE")]
+
+
+def assert_indexed(sql, *indexes):
+    plan = db.explain(sql)
+    text = " | ".join(plan)
+    for step in plan:
+        assert "TEMP B-TREE" not in step, f"排序没有走索引: {sql}\n  {text}"
+        words = step.split()
+        if words[0] == "SCAN" and words[1] in TABLES:
+            assert "USING" in words, f"全表扫描: {sql}\n  {text}"
+    for index in indexes:
+        assert index in text, f"没有用到 {index}: {sql}\n  {text}"
+    return plan
+
+
+def test_get_test_cases(pids):
+    [sql] = traced(db.get_test_cases, pids[0])
+    assert_indexed(sql, "idx_test_cases_problem")
+
+
+def test_get_history(pids):
+    [sql] = traced(db.get_history, pids[0])
+    assert_indexed(sql, "idx_submissions_problem")
+
+
+def test_list_first_page(pids):
+    [sql] = traced(db.list_problems)
+    assert_indexed(sql, "idx_problems_difficulty")
+
+
+def test_list_cursor(pids):
+    _, after = db.list_problems(limit=5)
+    [sql] = traced(db.list_problems, after=after)
+    plan = assert_indexed(sql, "idx_problems_difficulty")
+    # 两支 UNION ALL 都是索引范围查找
+    assert sum(step.startswith("SEARCH p USING INDEX idx_problems_difficulty") for step in plan) == 2
+
+
+def test_list_by_tag(pids):
+    [sql] = traced(db.list_problems, tag="循环", after=(1, pids[0]))
+    assert_indexed(sql, "SEARCH t USING PRIMARY KEY", "INTEGER PRIMARY KEY")
+
+
+def test_list_by_source(pids):
+    [sql] = traced(db.list_problems, source="https://example.com/repo.git", after=(1, pids[0]))
+    assert_indexed(sql, "idx_problems_source")
+
+
+def test_search(pids):
+    if not db.fts_tokenizer:
+        pytest.skip("SQLite 没有编译 FTS5")
+    [sql] = traced(db.list_problems, query="平方数")
+    assert_indexed(sql, "problems_fts VIRTUAL TABLE", "INTEGER PRIMARY KEY")
+
+
+def test_bulk_upsert(pids):
+    statements = traced(db.bulk_upsert_problems, [(problem(i), [{"input": "", "output": "1"}]) for i in range(3)])
+    assert statements
+    lookup = [s for s in statements if s.startswith("SELECT")]
+    assert len(lookup) == 1
+    assert_indexed(lookup[0], "uq_problems_source")
+    for sql in statements:
+        assert_indexed(sql)
+
+
+def test_retire_problems(pids):
+    repo = "https://example.com/retire.git"
+    db.bulk_upsert_problems([(problem(i, repo=repo), None) for i in range(2)])
+    statements = traced(db.retire_problems, repo, ["p0.py", "p1.py"])
+    assert db.get_problem_id_by_source(repo, "p0.py") is None
+    for sql in statements:
+        assert_indexed(sql)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from config import VERDICT_CACHE_SIZE, VERDICT_CACHE_DB_ROWS, SANDBOX_OUTPUT_PREVIEW
+from database import db
+
+
+def normalize_code(code: str) -> str:
+    """
+    缓存用的代码规范化：统一换行符、去掉文件末尾的空白。
+    不动行内空白 (字符串字面量里的空格可能影响输出)。
+    """
+    return (code or "").replace("\r\n", "\n").rstrip()
+
+
+# 缓存里只保留这些文本字段的开头一段，条目数上限才能真正约束内存 / 磁盘占用
+_TEXT_FIELDS = ("output", "error", "expected")
+
+
+def _compact(result):
+    compacted = dict(result)
+    for field in _TEXT_FIELDS:
+        value = compacted.get(field)
+        if isinstance(value, str) and len(value) > SANDBOX_OUTPUT_PREVIEW:
+            compacted[field] = value[:SANDBOX_OUTPUT_PREVIEW] + "\n... (输出过长，已截断)"
+    return compacted
+
+
+class VerdictCache:
+    """
+    内容寻址的判题结果缓存：
+    key = (规范化代码哈希, 题号, 测试数据版本, 时间限制, 是否提前结束, 运行环境指纹)
+    - 内存层：有界 LRU，命中时不访问数据库
+    - 持久层：sqlite verdict_cache 表，进程重启 / 多 worker 之间共享
+    题目或测试点被修改时 test_version 递增，旧 key 自然失效 (持久层同时被清理)；
+    后台安装新库后环境指纹改变，之前因缺库而 Runtime Error 的结果同样不再命中。
+    输出 / 错误信息只缓存开头 SANDBOX_OUTPUT_PREVIEW 个字符。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def make_key(code, problem_id, test_version, time_limit, stop_on_failure, env=""):
+        code_hash = hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+        return f"{code_hash}:{problem_id}:{test_version}:{time_limit}:{int(bool(stop_on_failure))}:{env}"
+
+    def get(self, key):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return self._lru[key]
+
+        raw = db.get_cached_verdict(key)
+        if raw is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        result = json.loads(raw)
+        with self._lock:
+            self.db_hits += 1
+            self._remember(key, result)
+        return result
+
+    def put(self, key, problem_id, result):
+        result = _compact(result)
+        db.put_cached_verdict(key, problem_id, json.dumps(result, ensure_ascii=False), VERDICT_CACHE_DB_ROWS)
+        with self._lock:
+            self.stores += 1
+            self._remember(key, result)
+
+    def _remember(self, key, result):
+        self._lru[key] = result
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def stats(self):
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "size": len(self._lru),
+            "capacity": self.capacity,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+verdict_cache = VerdictCache(VERDICT_CACHE_SIZE)